@@ -0,0 +1,144 @@
+"""BagIt writer for SIPs.
+
+Writes bags in place, like bagit.py: the SIP contents are moved into
+data/, then payload and tag manifests, bagit.txt and bag-info.txt (with
+Payload-Oxum) are written alongside. Payload files are hashed on the
+thread pool in disk_image_toolkit.checksums, reusing digests computed
+earlier in the pipeline.
+
+Bagging is restartable: if a run is interrupted, calling make_bag again
+finishes moving the payload and rewrites all tag files.
+"""
+import datetime
+import logging
+import os
+
+from disk_image_toolkit.checksums import hash_file, hash_files
+from disk_image_toolkit.disk_image import __version__
+from disk_image_toolkit.exception import DiskImageError
+
+
+BAGIT_VERSION = "0.97"
+DEFAULT_ALGORITHMS = ("sha256", "sha512")
+
+
+def _is_tag_file(filename):
+    return filename in ("bagit.txt", "bag-info.txt") or filename.startswith(
+        ("manifest-", "tagmanifest-")
+    )
+
+
+def _encode_filename(path):
+    """Percent-encode line breaks in manifest paths, as BagIt 0.97 bags do."""
+    return path.replace("\r", "%0D").replace("\n", "%0A")
+
+
+def _write_manifest(manifest_path, lines):
+    with open(manifest_path, "w", encoding="utf-8") as manifest_file:
+        for digest, path in lines:
+            manifest_file.write(f"{digest}  {_encode_filename(path)}\n")
+
+
+def make_bag(
+    bag_dir,
+    algorithms=DEFAULT_ALGORITHMS,
+    bag_info=None,
+    known_digests=None,
+    workers=1,
+):
+    """Turn bag_dir into a BagIt bag in place.
+
+    :param bag_dir: Directory to bag (str)
+    :param algorithms: Manifest algorithms (iterable)
+    :param bag_info: Additional bag-info.txt fields (dict)
+    :param known_digests: Dict of file path to dict with "size" and hex
+        digests by algorithm, for reuse. Paths may be given as they were
+        before the payload was moved into data/ (dict)
+    :param workers: Number of files hashed concurrently (int)
+
+    :returns: Paths of tag manifests written (list)
+    """
+    logger = logging.getLogger()
+    bag_dir = os.path.abspath(bag_dir)
+    data_dir = os.path.join(bag_dir, "data")
+    algorithms = list(algorithms)
+
+    # Move payload into data/. Anything left at the top level other than
+    # tag files was not moved yet by an interrupted run, and tag files from
+    # such a run are rewritten.
+    os.makedirs(data_dir, exist_ok=True)
+    for filename in sorted(os.listdir(bag_dir)):
+        if filename == "data":
+            continue
+        if _is_tag_file(filename):
+            os.remove(os.path.join(bag_dir, filename))
+        else:
+            os.rename(os.path.join(bag_dir, filename), os.path.join(data_dir, filename))
+
+    # Digests known for paths before the move apply to their new location.
+    rebased_digests = {}
+    for path, digests in (known_digests or {}).items():
+        path = os.path.abspath(path)
+        relpath = os.path.relpath(path, bag_dir)
+        if not relpath.startswith(("data" + os.sep, os.pardir)):
+            path = os.path.join(data_dir, relpath)
+        rebased_digests[path] = digests
+
+    files, digests_by_path, stats = hash_files(
+        data_dir, algorithms, known_digests=rebased_digests, workers=workers
+    )
+    if stats["errors"]:
+        raise DiskImageError(
+            f"Unable to hash {stats['errors']} payload files in {bag_dir}"
+        )
+    logger.info(
+        "Payload manifests for {}: {} files hashed, {} reused".format(
+            bag_dir, stats["hashed"], stats["reused"]
+        )
+    )
+
+    for algorithm in algorithms:
+        _write_manifest(
+            os.path.join(bag_dir, f"manifest-{algorithm}.txt"),
+            (
+                (
+                    digests_by_path[path][algorithm],
+                    os.path.relpath(path, bag_dir).replace(os.sep, "/"),
+                )
+                for path, _ in files
+            ),
+        )
+
+    with open(os.path.join(bag_dir, "bagit.txt"), "w", encoding="utf-8") as f:
+        f.write(f"BagIt-Version: {BAGIT_VERSION}\n")
+        f.write("Tag-File-Character-Encoding: UTF-8\n")
+
+    info = {
+        "Bag-Software-Agent": f"Disk Image Toolkit {__version__}",
+        "Bagging-Date": datetime.date.today().isoformat(),
+        "Payload-Oxum": "{}.{}".format(sum(size for _, size in files), len(files)),
+    }
+    info.update(bag_info or {})
+    with open(os.path.join(bag_dir, "bag-info.txt"), "w", encoding="utf-8") as f:
+        for key in sorted(info):
+            f.write(f"{key}: {info[key]}\n")
+
+    tag_files = sorted(
+        filename
+        for filename in os.listdir(bag_dir)
+        if _is_tag_file(filename) and not filename.startswith("tagmanifest-")
+    )
+    tag_digests = {
+        filename: hash_file(os.path.join(bag_dir, filename), algorithms)
+        for filename in tag_files
+    }
+    tagmanifests = []
+    for algorithm in algorithms:
+        tagmanifest = os.path.join(bag_dir, f"tagmanifest-{algorithm}.txt")
+        _write_manifest(
+            tagmanifest,
+            ((tag_digests[filename][algorithm], filename) for filename in tag_files),
+        )
+        tagmanifests.append(tagmanifest)
+
+    return tagmanifests
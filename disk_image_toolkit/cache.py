@@ -0,0 +1,245 @@
+"""Content-addressed cache of disk image analysis results.
+
+Results are keyed by the SHA-256 digest of the disk image content (all
+segments of a split image, in order). Each entry stores the disktype
+output, the volumes found, the fiwalk DFXML and, once the description
+step has run, the statistics parsed from that DFXML. Entries are evicted
+least recently used first once the cache grows past its size cap.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+DEFAULT_CACHE_SIZE = 10 * 1024**3
+CHUNK_SIZE = 4 * 1024**2
+
+ENTRY_FILENAME = "entry.json"
+DISKTYPE_FILENAME = "disktype.txt"
+
+
+def image_digest(paths):
+    """Return hex SHA-256 digest of the concatenated content of paths."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as image_file:
+            for chunk in iter(lambda: image_file.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def images_sharing_size(segments):
+    """Return disk images whose content has the same size as another's.
+
+    Only these images can be identical to another, so only they need to be
+    hashed to find duplicates. Only file sizes are read.
+
+    :param segments: Dict of disk image to the paths of its segments, as
+        listed by SourceIndex (dict)
+
+    :returns: Sorted disk images (list)
+    """
+    by_size = {}
+    for image, image_segments in segments.items():
+        size = sum(os.path.getsize(path) for path in image_segments)
+        by_size.setdefault(size, []).append(image)
+
+    return sorted(
+        image
+        for candidates in by_size.values()
+        if len(candidates) > 1
+        for image in candidates
+    )
+
+
+class ResultCache:
+    """Local cache of disk image results keyed by content digest.
+
+    :param cache_dir: Directory holding cache entries (str)
+    :param max_size: Maximum total size of entries in bytes, or None for
+        no limit (int)
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_CACHE_SIZE):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._claims = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_dir(self, digest):
+        return os.path.join(self.cache_dir, digest)
+
+    def claim(self, digest):
+        """Wait until no other image is producing results for digest.
+
+        Identical images processed at the same time then take turns: the
+        first produces and stores results while the others wait, and find
+        them cached once it is done.
+
+        :param digest: Disk image content digest (str)
+
+        :returns: Lock held for digest, to release once results are stored
+            or could not be produced (threading.Lock)
+        """
+        with self._lock:
+            lock = self._claims.setdefault(digest, threading.Lock())
+        lock.acquire()
+        return lock
+
+    def get(self, digest, image_path=None):
+        """Return cached results for digest, or None on a miss.
+
+        Marks the entry as most recently used.
+
+        :param digest: Disk image content digest (str)
+        :param image_path: Path of the image being processed. Replaces the
+            path of the originally cached image in disktype output (str)
+
+        :returns: Dict with "disktype" (bytes), "volumes" (list),
+            "dfxml_files" (dict of filename to cached path) and "stats"
+            (dict of DFXML filename to statistics)
+        """
+        entry_dir = self._entry_dir(digest)
+        entry_path = os.path.join(entry_dir, ENTRY_FILENAME)
+        try:
+            with open(entry_path, "r") as entry_file:
+                entry = json.load(entry_file)
+            with open(os.path.join(entry_dir, DISKTYPE_FILENAME), "rb") as f:
+                disktype = f.read()
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            return None
+
+        if image_path and entry.get("image_path"):
+            disktype = disktype.replace(
+                os.fsencode(entry["image_path"]), os.fsencode(image_path)
+            )
+
+        return {
+            "disktype": disktype,
+            "volumes": entry["volumes"],
+            "dfxml_files": {
+                name: os.path.join(entry_dir, name) for name in entry["dfxml_files"]
+            },
+            "stats": entry.get("stats", {}),
+            "image_path": entry.get("image_path"),
+        }
+
+    def put(self, digest, disktype, volumes, dfxml_files=(), image_path=None):
+        """Store results for digest. Existing entries are kept.
+
+        :param digest: Disk image content digest (str)
+        :param disktype: Disktype output (bytes)
+        :param volumes: Volumes from DiskImage.get_volumes_from_disktype (list)
+        :param dfxml_files: Paths of DFXML files to store (iterable)
+        :param image_path: Path of the image the results were produced
+            from, as it appears in disktype and DFXML output (str)
+        """
+        entry_dir = self._entry_dir(digest)
+        if os.path.isdir(entry_dir):
+            return
+
+        temp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+        try:
+            with open(os.path.join(temp_dir, DISKTYPE_FILENAME), "wb") as f:
+                f.write(disktype or b"")
+            dfxml_names = []
+            for dfxml_file in dfxml_files:
+                name = os.path.basename(dfxml_file)
+                shutil.copyfile(dfxml_file, os.path.join(temp_dir, name))
+                dfxml_names.append(name)
+
+            size = sum(
+                os.path.getsize(os.path.join(temp_dir, name))
+                for name in os.listdir(temp_dir)
+            )
+            entry = {
+                "digest": digest,
+                "volumes": volumes,
+                "dfxml_files": dfxml_names,
+                "stats": {},
+                "image_path": image_path,
+                "size": size,
+                "created": time.time(),
+            }
+            with open(os.path.join(temp_dir, ENTRY_FILENAME), "w") as entry_file:
+                json.dump(entry, entry_file)
+
+            with self._lock:
+                if os.path.isdir(entry_dir):
+                    return
+                os.rename(temp_dir, entry_dir)
+        finally:
+            if os.path.isdir(temp_dir):
+                shutil.rmtree(temp_dir)
+
+        self._evict()
+
+    def update_stats(self, digest, stats):
+        """Add parsed DFXML statistics to an existing entry.
+
+        :param digest: Disk image content digest (str)
+        :param stats: Dict of DFXML filename to statistics dict (dict)
+        """
+        entry_path = os.path.join(self._entry_dir(digest), ENTRY_FILENAME)
+        with self._lock:
+            try:
+                with open(entry_path, "r") as entry_file:
+                    entry = json.load(entry_file)
+            except (OSError, ValueError):
+                return
+            entry.setdefault("stats", {}).update(stats)
+            temp_path = entry_path + ".tmp"
+            with open(temp_path, "w") as entry_file:
+                json.dump(entry, entry_file)
+            os.replace(temp_path, entry_path)
+
+    def copy_dfxml(self, cached_path, destination_path, old_image_path, image_path):
+        """Copy cached DFXML, pointing its source image at image_path.
+
+        Only the document header, which holds the image filename, is
+        rewritten; file objects are copied unchanged.
+        """
+        old_name = "<image_filename>{}</image_filename>".format(old_image_path)
+        new_name = "<image_filename>{}</image_filename>".format(image_path)
+
+        with open(cached_path, "r") as source, open(destination_path, "w") as dest:
+            for line in source:
+                if old_image_path:
+                    line = line.replace(old_name, new_name)
+                dest.write(line)
+                if "<fileobject" in line or "<volume" in line:
+                    break
+            shutil.copyfileobj(source, dest, CHUNK_SIZE)
+
+    def _evict(self):
+        """Remove least recently used entries until under max_size."""
+        if self.max_size is None:
+            return
+
+        with self._lock:
+            entries = []
+            total_size = 0
+            for name in os.listdir(self.cache_dir):
+                entry_path = os.path.join(self.cache_dir, name, ENTRY_FILENAME)
+                try:
+                    last_used = os.path.getmtime(entry_path)
+                    with open(entry_path, "r") as entry_file:
+                        size = json.load(entry_file)["size"]
+                except (OSError, ValueError, KeyError):
+                    continue
+                entries.append((last_used, size, name))
+                total_size += size
+
+            for last_used, size, name in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                logging.getLogger().info(f"Evicting cached results for {name}")
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+                total_size -= size
@@ -0,0 +1,275 @@
+"""Checksum manifests for SIPs.
+
+Files are found with a single os.scandir walk and hashed on a thread
+pool; hashlib releases the GIL while hashing, so threads scale across
+cores. Every requested algorithm is computed in the same read of a file.
+Digests that are already known (from staging or from DFXML) are reused
+when the file size still matches.
+
+Manifests use the md5deep format ("<digest>  <path>"), one line per file,
+sorted by path.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+import time
+import xml.parsers.expat
+
+from disk_image_toolkit.exception import DFXMLError
+from disk_image_toolkit.summary import READ_SIZE
+
+
+CHUNK_SIZE = 4 * 1024**2
+PROGRESS_INTERVAL = 30
+
+DFXML_ALGORITHMS = ("md5", "sha1", "sha256", "sha512")
+
+# Direct children of <fileobject> read for digests
+_DIGEST_FIELDS = frozenset(
+    ("filename", "name_type", "filesize", "alloc", "unalloc", "hashdigest")
+)
+
+
+def _scan_files(root):
+    """Return list of (path, size) for files under root.
+
+    Symbolic links to directories are not followed.
+    """
+    files = []
+    dirs = [root]
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif entry.is_file():
+                    files.append((entry.path, entry.stat().st_size))
+    return files
+
+
+def hash_file(path, algorithms):
+    """Return dict of algorithm to hex digest for path."""
+    hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb") as f:
+        while True:
+            length = f.readinto(buffer)
+            if not length:
+                break
+            for hash_ in hashes:
+                hash_.update(view[:length])
+    return {
+        algorithm: hash_.hexdigest() for algorithm, hash_ in zip(algorithms, hashes)
+    }
+
+
+class _DigestHandler:
+    """expat handlers collecting the digests of each fileobject."""
+
+    def __init__(self, root_dir, offset):
+        self.root_dir = root_dir
+        self.offset = offset
+        self.known_digests = {}
+        self.depth = 0
+        # [depth, partition offset] of each enclosing volume
+        self.volumes = []
+        self.file_depth = None
+        self.file_fields = None
+        self.field = None
+        self.field_attrs = None
+        self.text = []
+
+    def start_element(self, name, attrs):
+        self.depth += 1
+        local_name = name.rpartition(" ")[2]
+        if self.file_depth is None:
+            if local_name == "fileobject":
+                self.file_depth = self.depth
+                self.file_fields = {"digests": {}}
+            elif local_name == "volume":
+                self.volumes.append([self.depth, None])
+            elif (
+                local_name == "partition_offset"
+                and self.volumes
+                and self.depth == self.volumes[-1][0] + 1
+            ):
+                self.field = local_name
+                self.text = []
+        elif self.depth == self.file_depth + 1 and local_name in _DIGEST_FIELDS:
+            self.field = local_name
+            self.field_attrs = attrs
+            self.text = []
+
+    def end_element(self, name):
+        if self.field is not None:
+            value = "".join(self.text).strip()
+            if self.field == "partition_offset":
+                self.volumes[-1][1] = int(value) if value.isdigit() else None
+            elif self.field == "hashdigest":
+                algorithm = self.field_attrs.get("type", "").lower()
+                if algorithm in DFXML_ALGORITHMS and value:
+                    self.file_fields["digests"][algorithm] = value
+            else:
+                self.file_fields[self.field] = value
+            self.field = None
+        elif self.file_depth is not None and self.depth == self.file_depth:
+            self._add_file(self.file_fields)
+            self.file_depth = None
+        elif self.volumes and self.depth == self.volumes[-1][0]:
+            self.volumes.pop()
+        self.depth -= 1
+
+    def character_data(self, data):
+        if self.field is not None:
+            self.text.append(data)
+
+    def _add_file(self, file_fields):
+        # skip directories, links and unallocated files
+        name_type = file_fields.get("name_type")
+        if name_type and name_type != "r":
+            return
+        if (
+            file_fields.get("unalloc") in ("1", "true")
+            or file_fields.get("alloc") == "0"
+        ):
+            return
+        filename = file_fields.get("filename")
+        filesize = file_fields.get("filesize")
+        if filename is None or not filesize or not filesize.isdigit():
+            return
+        if (
+            self.offset is not None
+            and self.volumes
+            and self.volumes[-1][1] not in (None, self.offset)
+        ):
+            return
+
+        digests = file_fields["digests"]
+        if digests:
+            digests["size"] = int(filesize)
+            self.known_digests[os.path.join(self.root_dir, filename)] = digests
+
+
+def digests_from_dfxml(dfxml_path, root_dir, offset=None):
+    """Return digests recorded in DFXML for files carved to root_dir.
+
+    Only allocated regular files are included. The DFXML is streamed
+    through expat and no FileObjects are built.
+
+    :param dfxml_path: Path to DFXML file (str)
+    :param root_dir: Directory the DFXML filenames are relative to (str)
+    :param offset: Byte offset of the partition carved to root_dir. If
+        given, files in volumes at other offsets are left out (int)
+
+    :returns: Dict of file path to dict with "size" and hex digests by
+        algorithm, suitable as known_digests (dict)
+    """
+    handler = _DigestHandler(root_dir, offset)
+    parser = xml.parsers.expat.ParserCreate(namespace_separator=" ")
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start_element
+    parser.EndElementHandler = handler.end_element
+    parser.CharacterDataHandler = handler.character_data
+
+    try:
+        with open(dfxml_path, "rb") as dfxml_file:
+            while True:
+                data = dfxml_file.read(READ_SIZE)
+                parser.Parse(data, not data)
+                if not data:
+                    break
+    except (OSError, ValueError, xml.parsers.expat.ExpatError) as err:
+        raise DFXMLError("Unable to read DFXML file {}: {}".format(dfxml_path, err))
+
+    return handler.known_digests
+
+
+def hash_files(root, algorithms, known_digests=None, workers=1):
+    """Return digests of all files under root.
+
+    :param root: Directory to hash recursively (str)
+    :param algorithms: hashlib algorithm names (list)
+    :param known_digests: Dict of file path to dict with "size" and hex
+        digests by algorithm. A file is not read if its size matches and
+        digests for all algorithms are known (dict)
+    :param workers: Number of files hashed concurrently (int)
+
+    :returns: Tuple of sorted list of (path, size) for every file, dict of
+        path to digests by algorithm for files hashed or reused, and dict
+        with counts of "files", "hashed", "reused" and "errors"
+    """
+    logger = logging.getLogger()
+    known_digests = {
+        os.path.abspath(path): digests
+        for path, digests in (known_digests or {}).items()
+    }
+
+    files = sorted(_scan_files(os.path.abspath(root)))
+    digests_by_path = {}
+    to_hash = []
+    for path, size in files:
+        known = known_digests.get(path, {})
+        if known.get("size") == size and all(known.get(a) for a in algorithms):
+            digests_by_path[path] = known
+        else:
+            to_hash.append(path)
+
+    stats = {
+        "files": len(files),
+        "hashed": 0,
+        "reused": len(digests_by_path),
+        "errors": 0,
+    }
+
+    def _hash(path):
+        try:
+            return path, hash_file(path, algorithms)
+        except OSError as err:
+            logger.error(f"Error hashing {path}: {err}")
+            return path, None
+
+    last_report = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for count, (path, digests) in enumerate(executor.map(_hash, to_hash), 1):
+            if digests is None:
+                stats["errors"] += 1
+                continue
+            digests_by_path[path] = digests
+            stats["hashed"] += 1
+            if time.monotonic() - last_report > PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                logger.info(f"Hashed {count} of {len(to_hash)} files in {root}")
+
+    return files, digests_by_path, stats
+
+
+def write_checksum_manifests(
+    root, manifests, start=None, known_digests=None, workers=1
+):
+    """Hash all files under root and write one manifest per algorithm.
+
+    :param root: Directory to hash recursively (str)
+    :param manifests: Dict of algorithm name to manifest path (dict)
+    :param start: Directory paths in manifests are relative to. Defaults to
+        the current working directory (str)
+    :param known_digests: Digests to reuse, as for hash_files (dict)
+    :param workers: Number of files hashed concurrently (int)
+
+    :returns: Dict with counts of "files", "hashed", "reused" and "errors"
+    """
+    start = os.path.abspath(start or os.curdir)
+    files, digests_by_path, stats = hash_files(
+        root, list(manifests), known_digests=known_digests, workers=workers
+    )
+
+    for algorithm, manifest in manifests.items():
+        with open(manifest, "w") as manifest_file:
+            for path, _ in files:
+                digests = digests_by_path.get(path)
+                if digests:
+                    relpath = os.path.relpath(path, start)
+                    manifest_file.write(f"{digests[algorithm]}  {relpath}\n")
+
+    return stats
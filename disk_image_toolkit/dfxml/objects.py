@@ -629,6 +629,80 @@ class DFXMLObject(AbstractParentObject):
         return self._volumes
 
 
+class DFXMLWriter(object):
+    """
+    Streaming DFXML document writer.  Writes the document head of a DFXMLObject, then each FileObject as it is handed over, then the document foot, so memory use does not grow with the number of files.  The caller is responsible for the order of the file objects.
+
+    Child objects appended to the DFXMLObject itself are not written.
+
+    Usage:
+
+        with DFXMLWriter(dobj, output_fh) as writer:
+            for fobj in fobjs:
+                writer.write_fileobject(fobj)
+
+    If the with block raises, the document foot is not written, leaving the output recognizably incomplete.
+    """
+
+    _dfxml_foot = "</dfxml>"
+
+    def __init__(
+      self,
+      dfxml_object : DFXMLObject,
+      output_fh : typing.IO[str]
+    ) -> None:
+        self.dfxml_object = dfxml_object
+        self.output_fh = output_fh
+        self._head_written = False
+        self._closed = False
+
+    def __enter__(self) -> "DFXMLWriter":
+        self.write_head()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+
+    def write_head(self) -> None:
+        """Write the XML prototype and the opening dfxml element, including metadata and creator."""
+        if self._head_written:
+            return
+        dfxml_wrapper = _ET_tostring(self.dfxml_object.to_partial_Element()).strip()
+        # Check for an empty element.
+        if dfxml_wrapper[-3:] == " />":
+            dfxml_head = dfxml_wrapper[:-3] + ">"
+        elif dfxml_wrapper[-2:] == "/>":
+            dfxml_head = dfxml_wrapper[:-2] + ">"
+        else:
+            dfxml_head = dfxml_wrapper[:-len(self._dfxml_foot)]
+
+        self.output_fh.write("""<?xml version="1.0"?>\n""")
+        self.output_fh.write(dfxml_head)
+        self.output_fh.write("\n")
+        self._head_written = True
+
+    def write_fileobject(
+      self,
+      fobj : FileObject
+    ) -> None:
+        """Write one fileobject element."""
+        if self._closed:
+            raise ValueError("DFXML document already closed.")
+        self.write_head()
+        self.output_fh.write(_ET_tostring(fobj.to_Element()))
+        self.output_fh.write("\n")
+
+    def close(self) -> None:
+        """Write the document foot."""
+        if self._closed:
+            return
+        self.write_head()
+        self.output_fh.write(self._dfxml_foot)
+        self.output_fh.write("\n")
+        self._closed = True
+
+
 class LibraryObject(AbstractObject):
 
     def __init__(self, *args, **kwargs):
@@ -23,6 +23,7 @@ __version__ = "0.4.4"
 
 import argparse
 import collections
+import concurrent.futures
 import functools
 import hashlib
 import logging
@@ -40,14 +41,22 @@ _logger = logging.getLogger(os.path.basename(__file__))
 #Exclude md6 from hash list borrowed from Objects.py - hashlib doesn't support md6.
 walk_default_hashes : typing.Set[str] = set(Objects.FileObject._hash_properties) - {"md6"}
 
+#Files are hashed in chunks of this size.
+hash_chunk_size : int = 2**22
+
+#Files at least this large have each selected hash computed on its own thread.
+parallel_hash_threshold : int = 2**26
+
 def filepath_to_fileobject(
   filepath : str,
   *,
-  ignore_properties : typing.Dict[str, typing.Set[str]] = dict()
+  ignore_properties : typing.Dict[str, typing.Set[str]] = dict(),
+  stat_result : typing.Optional[os.stat_result] = None
 ) -> Objects.FileObject:
     """
     Optional arguments:
     * ignore_properties - dictionary of property names to exclude from FileObject.
+    * stat_result - lstat() result for filepath, e.g. from os.DirEntry.stat(follow_symlinks=False).  If given, the name type is taken from it and filepath is not stat'ed again.
     """
     global walk_default_hashes
     fobj = Objects.FileObject()
@@ -55,22 +64,33 @@ def filepath_to_fileobject(
     #_logger.debug("ignore_properties = %r." % ignore_properties)
 
     name_type : typing.Optional[str]
-    #Determine type - done in three steps.
-    if os.path.islink(filepath):
-        name_type = "l"
-    elif os.path.isdir(filepath):
-        name_type = "d"
-    elif os.path.isfile(filepath):
-        name_type = "r"
+    if stat_result is not None:
+        sobj = stat_result
+        if stat.S_ISLNK(sobj.st_mode):
+            name_type = "l"
+        elif stat.S_ISDIR(sobj.st_mode):
+            name_type = "d"
+        elif stat.S_ISREG(sobj.st_mode):
+            name_type = "r"
+        else:
+            name_type = None
     else:
-        #Nop. Need to finish type determinations with stat structure.
-        name_type = None
+        #Determine type - done in three steps.
+        if os.path.islink(filepath):
+            name_type = "l"
+        elif os.path.isdir(filepath):
+            name_type = "d"
+        elif os.path.isfile(filepath):
+            name_type = "r"
+        else:
+            #Nop. Need to finish type determinations with stat structure.
+            name_type = None
 
-    # Retrieve stat struct for file to finish determining name type, and later to populate properties.
-    if name_type == "l":
-        sobj = os.lstat(filepath)
-    else:
-        sobj = os.stat(filepath)
+        # Retrieve stat struct for file to finish determining name type, and later to populate properties.
+        if name_type == "l":
+            sobj = os.lstat(filepath)
+        else:
+            sobj = os.stat(filepath)
     #_logger.debug(sobj)
 
     if name_type is None:
@@ -118,56 +138,48 @@ def filepath_to_fileobject(
             walk_default_hashes
           )
         ):
+            hash_names = sorted(filter(lambda x: not _should_ignore(x), walk_default_hashes))
             try:
                 with open(filepath, "rb") as in_fh:
-                    chunk_size = 2**22
-                    md5obj = hashlib.md5()
-                    sha1obj = hashlib.sha1()
-                    sha224obj = hashlib.sha224()
-                    sha256obj = hashlib.sha256()
-                    sha384obj = hashlib.sha384()
-                    sha512obj = hashlib.sha512()
+                    hashers = [hashlib.new(hash_name) for hash_name in hash_names]
+                    # Each chunk is read into one reusable buffer and shared across the selected hashers through a memoryview.
+                    buf = bytearray(hash_chunk_size)
+                    view = memoryview(buf)
+                    # hashlib releases the GIL, so the algorithms for a large file can run on parallel threads.
+                    executor = None
+                    if len(hashers) > 1 and sobj.st_size >= parallel_hash_threshold:
+                        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(hashers) - 1)
                     any_error = False
-                    while True:
-                        buf = b""
-                        try:
-                            buf = in_fh.read(chunk_size)
-                        except Exception as e:
-                            any_error = True
-                            if not _should_ignore("error"):
-                                fobj.error = "".join(traceback.format_stack())
-                                if e.args:
-                                    fobj.error += "\n" + str(e.args)
-                            buf = b""
-                        if buf == b"":
-                            break
-
-                        if not _should_ignore("md5"):
-                            md5obj.update(buf)
-                        if not _should_ignore("sha1"):
-                            sha1obj.update(buf)
-                        if not _should_ignore("sha224"):
-                            sha224obj.update(buf)
-                        if not _should_ignore("sha256"):
-                            sha256obj.update(buf)
-                        if not _should_ignore("sha384"):
-                            sha384obj.update(buf)
-                        if not _should_ignore("sha512"):
-                            sha512obj.update(buf)
+                    try:
+                        while True:
+                            length = 0
+                            try:
+                                length = in_fh.readinto(buf)
+                            except Exception as e:
+                                any_error = True
+                                if not _should_ignore("error"):
+                                    fobj.error = "".join(traceback.format_stack())
+                                    if e.args:
+                                        fobj.error += "\n" + str(e.args)
+                            if not length:
+                                break
+
+                            chunk = view[:length]
+                            if executor is None:
+                                for hasher in hashers:
+                                    hasher.update(chunk)
+                            else:
+                                futures = [executor.submit(hasher.update, chunk) for hasher in hashers[1:]]
+                                hashers[0].update(chunk)
+                                for future in futures:
+                                    future.result()
+                    finally:
+                        if executor is not None:
+                            executor.shutdown()
 
                     if not any_error:
-                        if not _should_ignore("md5"):
-                            fobj.md5 = md5obj.hexdigest()
-                        if not _should_ignore("sha1"):
-                            fobj.sha1 = sha1obj.hexdigest()
-                        if not _should_ignore("sha224"):
-                            fobj.sha224 = sha224obj.hexdigest()
-                        if not _should_ignore("sha256"):
-                            fobj.sha256 = sha256obj.hexdigest()
-                        if not _should_ignore("sha384"):
-                            fobj.sha384 = sha384obj.hexdigest()
-                        if not _should_ignore("sha512"):
-                            fobj.sha512 = sha512obj.hexdigest()
+                        for (hash_name, hasher) in zip(hash_names, hashers):
+                            setattr(fobj, hash_name, hasher.hexdigest())
             except Exception as e:
                 if not _should_ignore("error"):
                     if fobj.error is None:
@@ -2,21 +2,36 @@
 
 Contains DiskImage class for interacting with disk images in an archival context.
 """
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import functools
 import logging
+import operator
 import os
+import re
 import shutil
-import six
 import stat
 import subprocess
 import sys
-import tempfile
+import threading
 import time
 
+from disk_image_toolkit.cache import image_digest
 from disk_image_toolkit.dfxml import objects
 from disk_image_toolkit.dfxml.walk_to_dfxml import filepath_to_fileobject
+from disk_image_toolkit.disktype import (
+    SECTOR_SIZE,
+    load_volumes,
+    parse_disktype,
+    save_volumes,
+)
 
 from disk_image_toolkit.exception import DFXMLError, DiskImageError
+from disk_image_toolkit.probe import probe_disk_image
+from disk_image_toolkit.staging import write_sparse
+from disk_image_toolkit.summary import DFXMLSummary
+from disk_image_toolkit.timestamps import index_files, set_times
 from disk_image_toolkit.util import time_to_int
 
 
@@ -27,6 +42,23 @@ THIS_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
 UNHFS_DEFAULT_BIN = "/usr/share/hfsexplorer/bin/unhfs"
 UDF_MOUNT = "/mnt/diskid/"
 
+# Name of the raw image file ewfmount exposes in its mount point.
+RAW_VIEW_FILENAME = "ewf1"
+
+# Digests written to DFXML of HFS and UDF volumes. "minimal" covers the
+# MD5 checksum manifest and "archival" also the SHA-256 and SHA-512 bag
+# manifests, so those reuse the DFXML digests instead of hashing again.
+HASH_PROFILES = {
+    "minimal": ("md5",),
+    "archival": ("md5", "sha256", "sha512"),
+    "all": ("md5", "sha1", "sha224", "sha256", "sha384", "sha512"),
+}
+DEFAULT_HASH_PROFILE = "all"
+
+# UDF images are all mounted at the same mount point, so only one can be
+# mounted and copied at a time.
+_udf_mount_lock = threading.Lock()
+
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -36,6 +68,73 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
+@functools.lru_cache(maxsize=None)
+def tsk_supports_ewf():
+    """Return whether the Sleuth Kit tools can read EWF images natively."""
+    try:
+        output = subprocess.run(
+            ["tsk_recover", "-i", "list"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        ).stdout
+    except OSError:
+        return False
+    return re.search(rb"^\s*ewf\b", output, re.MULTILINE) is not None
+
+
+def unmount_raw_view(mount_point):
+    """Unmount a raw view mounted with ewfmount.
+
+    :param mount_point: Directory the view is mounted on (str)
+    """
+    try:
+        subprocess.check_output(
+            ["fusermount", "-u", mount_point], stderr=subprocess.STDOUT
+        )
+    except (OSError, subprocess.CalledProcessError) as err:
+        logger.error("Unable to unmount raw view at {}: {}".format(mount_point, err))
+
+
+def _sorted_entries(root):
+    """Yield (path relative to root, os.DirEntry) for everything under root.
+
+    "." is yielded for root itself, with None as its entry. Paths are
+    yielded in the order sorted() would put the full list in, holding only
+    one directory listing per level in memory. Symbolic links to
+    directories are listed but not followed, and directories that cannot
+    be read are skipped, as with os.walk.
+    """
+
+    def _keys(dirpath, prefix):
+        # A directory's contents sort right after its name followed by
+        # os.sep, so each directory is also listed under that key.
+        keys = []
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    relpath = prefix + entry.name
+                    keys.append((relpath, entry, False))
+                    if entry.is_dir(follow_symlinks=False):
+                        keys.append((relpath + os.sep, entry, True))
+        except OSError:
+            pass
+        keys.sort(key=operator.itemgetter(0))
+        return keys
+
+    top = _keys(root, "") + [(".", None, False)]
+    stack = [iter(sorted(top, key=operator.itemgetter(0)))]
+    while stack:
+        key = next(stack[-1], None)
+        if key is None:
+            stack.pop()
+            continue
+        relpath, entry, is_contents = key
+        if is_contents:
+            stack.append(iter(_keys(entry.path, relpath)))
+        else:
+            yield relpath, entry
+
+
 class DiskImage:
     """DiskImage class."""
 
@@ -58,14 +157,36 @@ class DiskImage:
     DEFAULT_RAW_IMAGE = os.path.join(THIS_DIR, "raw_disk_image.img")
     DEFAULT_DISKTYPE_TXT = os.path.join(THIS_DIR, "disktype.txt")
 
-    def __init__(self, path, unhfs_bin=UNHFS_DEFAULT_BIN):
+    @classmethod
+    def is_tsk_file_system(cls, file_system):
+        """Return whether files are carved from file_system by tsk_recover."""
+        file_system = file_system.lower()
+        return "fat" in file_system or file_system in cls.TSK_FILE_SYSTEMS
+
+    def __init__(self, path, unhfs_bin=UNHFS_DEFAULT_BIN, cache=None, segments=None):
         self.path = os.path.abspath(path)
+        # paths of the image content, in order; the cache key is their digest
+        self.segments = [os.path.abspath(segment) for segment in segments or [path]]
         self.filename = os.path.basename(path)
         self.identifier, self.extension = os.path.splitext(self.filename)
         self.raw_disk_image = None
+        self.raw_view_mount = None
         self.disktype: bytes = None
+        self.disktype_path = None
+        self._disktype_run = False
+        self.volumes_sidecar_path = None
+        self._disktype_volumes = None
         self.disk_dfxml_path = None
+        self._fiwalk_future = None
+        # threads this disk image may use, shared by the volumes carved at
+        # once; each volume hashes files and restores dates with its share
+        self.workers = 1
+        self._file_workers = 1
+        self.hash_profile = DEFAULT_HASH_PROFILE
         self.unhfs_bin = unhfs_bin
+        self.cache = cache
+        self.digest = None
+        self.cache_entry = None
 
     @staticmethod
     def _call_subprocess(
@@ -86,7 +207,9 @@ class DiskImage:
     def convert_to_raw(self, destination_path=DEFAULT_RAW_IMAGE):
         """Convert disk image from EWF to raw format and return new path.
 
-        If disk image is already raw, return path to existing image.
+        The raw image is written as a sparse file, with holes in place of
+        all-zero blocks. If disk image is already raw, return path to
+        existing image.
 
         :param destination_path: Path of output raw disk image (str)
 
@@ -98,126 +221,226 @@ class DiskImage:
 
         logger.info("Converting EWF disk image to raw format...")
 
-        with tempfile.TemporaryDirectory() as tempdir:
-            temp_raw_image = os.path.join(tempdir, self.identifier)
-            self._call_subprocess(
-                command=[
-                    "ewfexport",
-                    "-t",
-                    temp_raw_image,
-                    "-f",
-                    "raw",
-                    "-o",
-                    "0",
-                    "-S",
-                    "0",
-                    "-u",
-                    self.path,
-                ],
-                error_msg="Error running ewfexport to convert disk image to raw format",
+        # ewfexport writes the raw image to stdout, so that zeros can be
+        # left as holes rather than written out; its report goes to stderr
+        command = [
+            "ewfexport",
+            "-t",
+            "-",
+            "-f",
+            "raw",
+            "-o",
+            "0",
+            "-S",
+            "0",
+            "-u",
+            self.path,
+        ]
+        with open(destination_path, "wb") as raw_file, open(
+            destination_path + ".info", "wb"
+        ) as info_file:
+            process = subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=info_file, cwd=THIS_DIR
             )
+            with process.stdout:
+                write_sparse(process.stdout, raw_file)
+            raw_file.truncate()
+            returncode = process.wait()
 
-            # Rename and move raw disk image files to expected path.
-            os.rename(
-                os.path.join(tempdir, "{}.raw".format(self.identifier)),
-                destination_path,
-            )
-            os.rename(
-                os.path.join(tempdir, "{}.raw.info".format(self.identifier)),
-                destination_path + ".info",
+        if returncode:
+            logger.error(
+                "Subprocess error: Error running ewfexport to convert disk image "
+                "to raw format. Details: {}".format(
+                    subprocess.CalledProcessError(returncode, command)
+                )
             )
 
-            self.raw_disk_image = destination_path
+        self.raw_disk_image = destination_path
 
         return self.raw_disk_image
 
-    def run_disktype(self, output_file=DEFAULT_DISKTYPE_TXT):
+    def mount_raw_view(self, mount_point):
+        """Expose EWF disk image as a read-only raw image and return its path.
+
+        Unlike convert_to_raw, nothing is written to disk: ewfmount
+        decompresses chunks as they are read. Sleuth Kit tools read the EWF
+        image directly instead when they support it. A raw file is only
+        materialized if a volume has to be loop mounted.
+
+        If disk image is already raw, return path to existing image.
+
+        :param mount_point: Directory to mount the raw view on (str)
+
+        :returns: Path to raw disk image (str)
+        """
+        if not self.is_ewf:
+            self.raw_disk_image = self.path
+            return self.raw_disk_image
+
+        os.makedirs(mount_point, exist_ok=True)
+        self._call_subprocess(
+            command=["ewfmount", self.path, mount_point],
+            error_msg="Error running ewfmount to mount raw view of disk image",
+            raise_exception=True,
+        )
+        self.raw_view_mount = mount_point
+        self.raw_disk_image = os.path.join(mount_point, RAW_VIEW_FILENAME)
+
+        return self.raw_disk_image
+
+    def close_raw_view(self):
+        """Unmount raw view mounted by mount_raw_view, if any."""
+        if not self.raw_view_mount:
+            return
+
+        unmount_raw_view(self.raw_view_mount)
+        if self.raw_disk_image == os.path.join(self.raw_view_mount, RAW_VIEW_FILENAME):
+            self.raw_disk_image = None
+        self.raw_view_mount = None
+
+    def materialize_raw(self):
+        """Replace raw view with a raw image file and return its path.
+
+        The file is written next to the mount point of the view.
+        """
+        if not self.raw_view_mount:
+            return self.raw_disk_image
+
+        destination_path = self.raw_view_mount.rstrip(os.sep) + ".raw"
+        self.close_raw_view()
+        logger.info("Materializing raw image for {}".format(self.filename))
+
+        return self.convert_to_raw(destination_path)
+
+    @property
+    def tsk_image_path(self):
+        """Path of disk image to pass to Sleuth Kit tools.
+
+        EWF images read through a raw view are passed as they are if the
+        Sleuth Kit was built with libewf, skipping the FUSE layer.
+        """
+        if self.raw_view_mount and tsk_supports_ewf():
+            return self.path
+        return self.raw_disk_image
+
+    def cached_results(self):
+        """Return results cached for this disk image's content, or None.
+
+        The content digest is computed on first use unless already set.
+        A hit is kept on the instance; a miss is looked up again on the next
+        call, as an identical image may have been cached in the meantime.
+        """
+        if self.cache is None:
+            return None
+
+        if self.cache_entry is None:
+            if self.digest is None:
+                self.digest = image_digest(self.segments)
+            self.cache_entry = self.cache.get(
+                self.digest, image_path=self.raw_disk_image
+            )
+
+        return self.cache_entry
+
+    def run_disktype(self, output_file=DEFAULT_DISKTYPE_TXT, probe=True):
         """Run disktype on disk image and return output.
 
+        Common disk layouts are described by a Python probe that reads only
+        a few sectors, in disktype's output format; disktype is run for
+        anything the probe does not recognize.
+
         :param output_file: Optional path to file to write output to (str)
+        :param probe: Whether to try the Python probe first (bool)
 
         :returns: Disktype output (bytes)
         """
         if not self.raw_disk_image:
             self.convert_to_raw()
 
-        self.disktype = self._call_subprocess(
-            command=["disktype", self.raw_disk_image],
-            error_msg="Error running disktype",
-        )
+        cached = self.cached_results()
+        if cached:
+            logger.info("Using cached disktype output for {}".format(self.filename))
+            self.disktype = cached["disktype"]
+        else:
+            self.disktype = probe_disk_image(self.raw_disk_image) if probe else None
+            if self.disktype:
+                logger.info("Probed disk layout of {}".format(self.filename))
+            else:
+                self.disktype = self._call_subprocess(
+                    command=["disktype", self.raw_disk_image],
+                    error_msg="Error running disktype",
+                )
 
+        self._disktype_run = True
+        self._disktype_volumes = None
         if self.disktype and output_file:
             with open(output_file, "wb") as disktype_file:
                 disktype_file.write(self.disktype)
+            self.disktype_path = output_file
 
         return self.disktype
 
-    def get_volumes_from_disktype(self):
-        """Return dict of volumes from disktype output."""
-        if not self.disktype:
-            self.run_disktype()
-
-        volumes = []
-        current_volume = {}
-        current_volume_index = 0
-
-        for line in self.disktype.splitlines():
-            line = six.ensure_text(line, errors="ignore").strip()
+    def load_disktype(self, disktype_path):
+        """Use disktype output written to disktype_path by an earlier run.
 
-            if "file system" in line:
-                if current_volume.get("file_system"):
-                    # If there's already a populated current volume, add it to volumes
-                    # list before intializing new current_volume
-                    volumes.append(current_volume)
-                    current_volume = {}
+        Nothing is written when disktype gives no output, so a missing file
+        leaves the output empty without running disktype again.
 
-                current_volume_index += 1
-                current_volume["id"] = current_volume_index
-                current_volume["name"] = ""
-                current_volume["formatted_name"] = ""
+        :param disktype_path: Path to disktype output (str)
 
-                file_system = line.split(" file system")[0]
-                current_volume["file_system"] = file_system
-                current_volume[
-                    "output_directory_name"
-                ] = f"volume-{current_volume_index}-{file_system.lower()}"
+        :returns: Disktype output (bytes)
+        """
+        self.disktype = None
+        if os.path.isfile(disktype_path):
+            with open(disktype_path, "rb") as disktype_file:
+                self.disktype = disktype_file.read()
+            self.disktype_path = disktype_path
+        self._disktype_run = True
+        self._disktype_volumes = None
 
-            else:
-                if "Volume name" in line:
-                    volume_name = (
-                        line.strip().replace("Volume name ", "").replace('"', "")
-                    )
-                    current_volume["name"] = volume_name
-                    current_volume["formatted_name"] = self._format_volume_name(
-                        volume_name
-                    )
-                    current_volume["output_directory_name"] = "{}-{}".format(
-                        current_volume["output_directory_name"],
-                        current_volume["formatted_name"],
-                    )
+        return self.disktype
 
-                elif "Volume size" in line:
-                    volume_size = line.strip().replace("Volume size ", "")
-                    current_volume["size"] = volume_size
+    def disktype_volumes(self):
+        """Return volumes parsed from disktype output.
 
-                elif "Disk size" in line:
-                    disk_size = line.strip().replace("Disk size ", "")
-                    current_volume["size"] = disk_size
+        The result is kept on the instance. If disktype output was written
+        to a file, it is also saved to a JSON sidecar (volumes_sidecar_path,
+        by default next to the output with a .json extension) and read from
+        there while the output is unchanged.
 
-        volumes.append(current_volume)
+        :returns: Volumes in disktype order (list of DisktypeVolume)
+        """
+        if self._disktype_volumes is not None:
+            return self._disktype_volumes
+
+        sidecar_path = self.volumes_sidecar_path
+        if sidecar_path is None and self.disktype_path:
+            sidecar_path = os.path.splitext(self.disktype_path)[0] + ".json"
+
+        volumes = None
+        if sidecar_path:
+            volumes = load_volumes(sidecar_path, self.disktype_path)
+        if volumes is None:
+            if not self.disktype and not self._disktype_run:
+                self.run_disktype()
+            volumes = parse_disktype(self.disktype or b"")
+            if sidecar_path and self.disktype_path:
+                try:
+                    save_volumes(sidecar_path, self.disktype_path, volumes)
+                except OSError as err:
+                    logger.warning(
+                        "Unable to save volumes to {}: {}".format(sidecar_path, err)
+                    )
 
+        self._disktype_volumes = volumes
         return volumes
 
-    @staticmethod
-    def _format_volume_name(line):
-        """Return volume name or None."""
-        output = [
-            char
-            for char in line
-            if char.isalnum() or char.isspace() or char in ("-", "_")
-        ]
-        output_string = "".join(output)
-        return output_string.replace(" ", "_").rstrip("/")
+    def get_volumes_from_disktype(self):
+        """Return list of volume dicts from disktype output.
+
+        See DisktypeVolume.to_dict for the keys of each dict.
+        """
+        return [volume.to_dict() for volume in self.disktype_volumes()]
 
     def carve_files_from_all_volumes(
         self,
@@ -225,6 +448,7 @@ class DiskImage:
         export_unallocated=False,
         appledouble_resforks=True,
         dfxml_directory=THIS_DIR,
+        volume_workers=None,
     ):
         """Attempt to carve files from each volume identified by disktype.
 
@@ -234,38 +458,133 @@ class DiskImage:
         :param appledouble_resforks: Flag of whether to carve AppleDouble
             resource forks from HFS disk images (bool)
         :param dfxml_directory: Optional directory to write DFXML files to (str)
+        :param volume_workers: Maximum number of volumes to carve
+            concurrently. Defaults to the disk image's workers (int)
+
+        :returns: Volumes found by disktype (list of dicts). Each volume's
+            "stats" is a dict of DFXMLSummary values for its files, gathered
+            while its DFXML was written or its dates restored. It is missing
+            if they could not be gathered, and from every volume if files in
+            the disk's DFXML cannot be told apart by volume.
         """
-        if not self.disktype:
+        # disktype is run here only if it was not already (e.g. by a
+        # convert stage, with its own output path and probe setting)
+        if not self.disktype and not self._disktype_run:
             self.run_disktype()
 
         dfxml_path = os.path.join(THIS_DIR, "dfxml.xml")
         if dfxml_directory:
             dfxml_path = os.path.join(dfxml_directory, "dfxml.xml")
 
-        self.write_dfxml_with_fiwalk(dfxml_path)
-
         if not self.disktype:
-            logger.error("No disktype output - skipping")
-            sys.exit(1)
+            raise DiskImageError("No disktype output")
+
+        cached = self.cached_results()
+        claim = None
+        if self.cache is not None and not cached:
+            # an identical image being carved at the same time is waited for,
+            # so its results are reused rather than computed alongside it
+            claim = self.cache.claim(self.digest)
+            cached = self.cached_results()
+            if cached:
+                claim.release()
+                claim = None
 
-        volumes = self.get_volumes_from_disktype()
-
-        for volume in volumes:
-            output_dir_name = volume["output_directory_name"]
-            output_dir = os.path.join(destination_path, output_dir_name)
-            os.makedirs(output_dir)
+        try:
+            if cached:
+                volumes = cached["volumes"]
+            else:
+                volumes = self.get_volumes_from_disktype()
+
+            # Each volume is carved from its own partition, so volumes can be
+            # carved at the same time. Loop mounting needs a real file, which
+            # is materialized before any volume is read from a raw view.
+            if self.raw_view_mount and any(
+                volume["file_system"].lower() == "udf" for volume in volumes
+            ):
+                self.materialize_raw()
+
+            # fiwalk and tsk_recover only read the disk image, so fiwalk runs
+            # alongside carving; tsk_recover waits for its DFXML only to
+            # restore last modified dates.
+            fiwalk_executor = None
+            if cached and "dfxml.xml" in cached["dfxml_files"]:
+                self.cache.copy_dfxml(
+                    cached["dfxml_files"]["dfxml.xml"],
+                    dfxml_path,
+                    cached["image_path"],
+                    self.raw_disk_image,
+                )
+                self.disk_dfxml_path = dfxml_path
+                logger.info("Cached DFXML written to {}".format(self.disk_dfxml_path))
+            else:
+                fiwalk_executor = ThreadPoolExecutor(max_workers=1)
+                self._fiwalk_future = fiwalk_executor.submit(
+                    self.write_dfxml_with_fiwalk, dfxml_path
+                )
 
-            volume_dfxml_path = os.path.join(
-                dfxml_directory, "dfxml_{}.xml".format(volume["output_directory_name"])
+            # fiwalk DFXML covers the whole disk. Its files are attributed to a
+            # TSK volume by partition offset, or to the only TSK volume; without
+            # either, each such volume would count every file in it.
+            tsk_volumes = [
+                volume
+                for volume in volumes
+                if self.is_tsk_file_system(volume["file_system"])
+            ]
+            keep_stats = len(tsk_volumes) == 1 or all(
+                volume.get("offset") is not None for volume in tsk_volumes
             )
 
-            self.carve_files(
-                volume["file_system"],
-                destination_path=output_dir,
-                export_unallocated=export_unallocated,
-                disk_dfxml_path=dfxml_path,
-                volume_dfxml_path=volume_dfxml_path,
-            )
+            def _carve_volume(volume):
+                output_dir_name = volume["output_directory_name"]
+                output_dir = os.path.join(destination_path, output_dir_name)
+                os.makedirs(output_dir)
+
+                volume_dfxml_path = os.path.join(
+                    dfxml_directory,
+                    "dfxml_{}.xml".format(volume["output_directory_name"]),
+                )
+
+                summary = self.carve_files(
+                    volume["file_system"],
+                    destination_path=output_dir,
+                    export_unallocated=export_unallocated,
+                    disk_dfxml_path=dfxml_path,
+                    volume_dfxml_path=volume_dfxml_path,
+                    offset=volume.get("offset"),
+                )
+                if summary is not None and keep_stats:
+                    volume["stats"] = summary.to_dict()
+
+            try:
+                if volumes:
+                    volume_workers = min(volume_workers or self.workers, len(volumes))
+                    self._file_workers = max(1, self.workers // volume_workers)
+                    with ThreadPoolExecutor(max_workers=volume_workers) as executor:
+                        for future in [
+                            executor.submit(_carve_volume, volume) for volume in volumes
+                        ]:
+                            future.result()
+            finally:
+                self._wait_for_disk_dfxml()
+                if fiwalk_executor is not None:
+                    fiwalk_executor.shutdown()
+
+            if not cached and self.cache is not None:
+                # statistics depend on carving options, so are not cached
+                self.cache.put(
+                    self.digest,
+                    self.disktype,
+                    [
+                        {key: value for key, value in volume.items() if key != "stats"}
+                        for volume in volumes
+                    ],
+                    [path for path in (dfxml_path,) if os.path.isfile(path)],
+                    image_path=self.raw_disk_image,
+                )
+        finally:
+            if claim is not None:
+                claim.release()
 
         num_volumes = len(volumes)
         msg = f"File export attempted from {num_volumes} volume"
@@ -283,6 +602,7 @@ class DiskImage:
         appledouble_resforks=False,
         disk_dfxml_path="dfxml.xml",
         volume_dfxml_path=os.path.join(THIS_DIR, "volume_dfxml.xml"),
+        offset=None,
     ):
         """Carve files from disk image, choosing method based on file system
             information produced by disktype.
@@ -294,22 +614,28 @@ class DiskImage:
         :param appledouble_resforks: Flag of whether to carve AppleDouble
             resource forks from HFS disk images (bool)
         :param dfxml_path: Path to write DFXML to (str)
+        :param offset: Byte offset of the volume's partition, or None if the
+            volume is not in a partition (int)
+
+        :returns: Summary of files in the volume gathered while carving, or
+            None if unavailable (DFXMLSummary)
         """
         file_system = file_system.lower()
+        summary = None
 
         if not os.path.isdir(destination_path):
             os.makedirs(destination_path)
 
-        if "fat" in file_system or file_system in self.TSK_FILE_SYSTEMS:
-            self.carve_files_with_tsk_recover(
-                destination_path, export_unallocated, disk_dfxml_path
+        if self.is_tsk_file_system(file_system):
+            summary = self.carve_files_with_tsk_recover(
+                destination_path, export_unallocated, disk_dfxml_path, offset
             )
         elif file_system == "hfs":
-            self.carve_files_with_hfs_explorer(
+            summary = self.carve_files_with_hfs_explorer(
                 destination_path, appledouble_resforks, dfxml_path=volume_dfxml_path
             )
         elif file_system == "udf":
-            self.mount_disk_image_and_copy_files(
+            summary = self.mount_disk_image_and_copy_files(
                 destination_path, dfxml_path=volume_dfxml_path
             )
         else:
@@ -331,11 +657,14 @@ class DiskImage:
             except OSError:
                 pass
 
+        return summary
+
     def carve_files_with_tsk_recover(
         self,
         destination_path="carved_files",
         export_unallocated=False,
         dfxml_path="dfxml.py",
+        offset=None,
     ):
         """Carve files from disk image using tsk_recover.
 
@@ -343,32 +672,41 @@ class DiskImage:
         :param export_unallocated: Flag of whether to carve unallocated (e.g.
             deleted) files in addition to allocated ones (bool)
         :param dfxml_path: Path to write DFXML to (str)
+        :param offset: Byte offset of the partition to carve. If None, all
+            file systems tsk_recover finds on the disk are carved (int)
+
+        :returns: Summary of files in the carved volume from DFXML, or None
+            if the DFXML could not be read (DFXMLSummary)
         """
         if not self.raw_disk_image:
             self.convert_to_raw()
 
-        if not self.disk_dfxml_path:
+        if not self.disk_dfxml_path and self._fiwalk_future is None:
             self.write_dfxml_with_fiwalk(dfxml_path)
 
         carve_flag = "-a"
         if export_unallocated:
             carve_flag = "-e"
 
-        self._call_subprocess(
-            ["tsk_recover", carve_flag, self.raw_disk_image, destination_path],
-            "tsk_recover could not carve files",
-        )
+        command = ["tsk_recover", carve_flag]
+        if offset is not None:
+            command.extend(["-o", str(offset // SECTOR_SIZE)])
+        command.extend([self.tsk_image_path, destination_path])
+        self._call_subprocess(command, "tsk_recover could not carve files")
 
         self.set_file_permissions(destination_path)
 
         try:
-            self._restore_file_last_modified_dates(
-                destination_path, self.disk_dfxml_path
+            self._wait_for_disk_dfxml()
+            restored = self._restore_file_last_modified_dates(
+                destination_path, self.disk_dfxml_path, offset
             )
         except DFXMLError as err:
             logger.error(
                 f"Error restoring file last modified dates from DFXML values: {err}"
             )
+            return None
+        return restored["summary"]
 
     def write_dfxml_with_fiwalk(self, dfxml_path="dfxml.xml"):
         """Write DFXML of disk image with fiwalk.
@@ -376,52 +714,86 @@ class DiskImage:
         :param dfxml_path: Path to write DFXML to (str)
         """
         self._call_subprocess(
-            ["fiwalk", "-X", dfxml_path, self.raw_disk_image],
+            ["fiwalk", "-X", dfxml_path, self.tsk_image_path],
             "Unable to create DFXML with fiwalk",
         )
         self.disk_dfxml_path = dfxml_path
         logger.info("DFXML written to {}".format(self.disk_dfxml_path))
 
-    def _restore_file_last_modified_dates(self, destination_path, dfxml_path):
-        """Restore file last modified dates from values in DFXML."""
+    def _wait_for_disk_dfxml(self):
+        """Wait for fiwalk started by carve_files_from_all_volumes to finish."""
+        future = self._fiwalk_future
+        if future is not None:
+            future.result()
+            self._fiwalk_future = None
+
+    def _restore_file_last_modified_dates(
+        self, destination_path, dfxml_path, offset=None
+    ):
+        """Restore file last modified dates from values in DFXML.
+
+        If offset is given, only files in the volume at that byte offset
+        are considered. Files in the DFXML that are not under
+        destination_path are counted as missing.
+
+        :returns: Dict with number of files "restored", "skipped" (not
+            regular files or without a readable date) and "missing", and
+            "summary" of files in the volume (DFXMLSummary)
+        """
         try:
+            index = index_files(destination_path)
+            now = int(time.time())
+            skipped = 0
+            timestamps = []
+            summary = DFXMLSummary()
             for event, obj in objects.iterparse(dfxml_path):
                 if not isinstance(obj, objects.FileObject):
                     continue
 
+                if (
+                    offset is not None
+                    and obj.volume_object is not None
+                    and obj.volume_object.partition_offset not in (None, offset)
+                ):
+                    continue
+
+                summary.add_fileobject(obj)
+
                 # Skip directories and links.
                 if obj.name_type and obj.name_type != "r":
+                    skipped += 1
+                    continue
+
+                dfxml_filedate = now
+                for timestamp in (obj.mtime, obj.crtime):
+                    if timestamp and str(timestamp) != "None":
+                        dfxml_filedate = time_to_int(str(timestamp)[:19])
+                        break
+                if dfxml_filedate is None:
+                    skipped += 1
                     continue
 
-                dfxml_filename = obj.filename
-                dfxml_filedate = int(time.time())
-
-                modified_time = None
-                if obj.mtime:
-                    modified_time = str(obj.mtime)
-
-                created_time = None
-                if obj.crtime:
-                    created_time = str(obj.crtime)
-
-                if modified_time and modified_time != "None":
-                    modified_time = time_to_int(modified_time[:19])
-                    dfxml_filedate = modified_time
-                elif created_time and created_time != "None":
-                    created_time = time_to_int(created_time[:19])
-                    dfxml_filedate = created_time
-
-                carved_filepath = os.path.join(destination_path, dfxml_filename)
-                if os.path.isfile(carved_filepath):
-                    os.utime(carved_filepath, (dfxml_filedate, dfxml_filedate))
-                elif os.path.isfile(dfxml_filename):
-                    os.utime(dfxml_filename, (dfxml_filedate, dfxml_filedate))
+                timestamps.append((obj.filename, dfxml_filedate))
+
+            restored, missing = set_times(index, timestamps, workers=self._file_workers)
         except OSError as err:
             error_msg = "Error restoring modified dates for files carved from disk {}: {}".format(
                 self.raw_disk_image, err
             )
             raise DFXMLError(error_msg)
 
+        logger.info(
+            "Last modified dates restored for {} files in {} ({} skipped, {} not carved)".format(
+                restored, destination_path, skipped, missing
+            )
+        )
+        return {
+            "restored": restored,
+            "skipped": skipped,
+            "missing": missing,
+            "summary": summary,
+        }
+
     def carve_files_with_hfs_explorer(
         self,
         destination_path="carved_files",
@@ -435,6 +807,9 @@ class DiskImage:
         :param export_unallocated: Flag of whether to carve unallocated (e.g.
             deleted) files in addition to allocated ones (bool)
         :param dfxml_path: Path to write DFXML to (str)
+
+        :returns: Summary of carved files, or None if DFXML was not written
+            (DFXMLSummary)
         """
         if not self.raw_disk_image:
             self.convert_to_raw()
@@ -456,7 +831,12 @@ class DiskImage:
         self.set_file_permissions(destination_path)
 
         if create_dfxml:
-            self.write_dfxml_from_path(destination_path, dfxml_path)
+            return self.write_dfxml_from_path(
+                destination_path,
+                dfxml_path,
+                workers=self._file_workers,
+                hash_profile=self.hash_profile,
+            )
 
     def mount_disk_image_and_copy_files(
         self,
@@ -469,44 +849,70 @@ class DiskImage:
 
         :param destination_path: Path to write carved files to (str)
         :param dfxml_path: Path to write DFXML to (str)
+
+        :returns: Summary of copied files, or None if DFXML was not written
+            (DFXMLSummary)
         """
         if not self.raw_disk_image:
             self.convert_to_raw()
 
-        # Mount disk image.
-        subprocess.call(
-            "sudo mount -t {} -o loop '{}' {}".format(
-                file_system, self.raw_disk_image, UDF_MOUNT
-            ),
-            shell=True,
-        )
+        # root cannot read FUSE mounts of other users, so loop mounting
+        # needs a real file
+        if self.raw_view_mount:
+            self.materialize_raw()
+
+        with _udf_mount_lock:
+            # Mount disk image.
+            subprocess.call(
+                "sudo mount -t {} -o loop '{}' {}".format(
+                    file_system, self.raw_disk_image, UDF_MOUNT
+                ),
+                shell=True,
+            )
 
-        # Copy files.
-        try:
-            if os.path.isdir(destination_path):
-                shutil.rmtree(destination_path)
-            shutil.copytree(UDF_MOUNT, destination_path, symlinks=False, ignore=None)
-        except OSError as err:
-            logger.error(
-                "Error copying files from disk image {} mounted at {}: {}".format(
-                    self.raw_disk_image, UDF_MOUNT, err
+            # Copy files.
+            try:
+                if os.path.isdir(destination_path):
+                    shutil.rmtree(destination_path)
+                shutil.copytree(
+                    UDF_MOUNT, destination_path, symlinks=False, ignore=None
+                )
+            except OSError as err:
+                logger.error(
+                    "Error copying files from disk image {} mounted at {}: {}".format(
+                        self.raw_disk_image, UDF_MOUNT, err
+                    )
                 )
-            )
 
-        # Unmount disk image.
-        subprocess.call("sudo umount {}".format(UDF_MOUNT), shell=True)
+            # Unmount disk image.
+            subprocess.call("sudo umount {}".format(UDF_MOUNT), shell=True)
 
         self.set_file_permissions(destination_path)
 
         if create_dfxml:
-            self.write_dfxml_from_path(destination_path, dfxml_path)
+            return self.write_dfxml_from_path(
+                destination_path,
+                dfxml_path,
+                workers=self._file_workers,
+                hash_profile=self.hash_profile,
+            )
 
     @staticmethod
-    def write_dfxml_from_path(target_path, dfxml_path="dfxml.xml"):
+    def write_dfxml_from_path(
+        target_path,
+        dfxml_path="dfxml.xml",
+        workers=1,
+        hash_profile=DEFAULT_HASH_PROFILE,
+    ):
         """Write DFXML of directory.
 
         :param target_path: Path to source directory (str)
         :param dfxml_path: Path to write DFXML to (str)
+        :param workers: Number of files hashed concurrently (int)
+        :param hash_profile: Name of digests to include, from HASH_PROFILES
+            (str)
+
+        :returns: Summary of files written to DFXML (DFXMLSummary)
 
         Modified from walk_to_dfxml.py by NIST, Simson Garfinkel, and
         Alex Nelson, public domain:
@@ -520,34 +926,54 @@ class DiskImage:
         dobj.add_creator_library("objects.py", objects.__version__)
         dobj.add_creator_library("dfxml.py", objects.dfxml.__version__)
 
-        os.chdir(os.path.abspath(target_path))
-
-        filepaths = set()
-        filepaths.add(".")
-        for dirpath, dirnames, filenames in os.walk(target_path):
-            dirent_names = set()
-            for dirname in dirnames:
-                dirent_names.add(dirname)
-            for filename in filenames:
-                dirent_names.add(filename)
-            for dirent_name in sorted(dirent_names):
-                filepath = os.path.relpath(os.path.join(dirpath, dirent_name))
-                filepaths.add(filepath)
-
-        fileobjects_by_filepath = dict()
-
-        for filepath in sorted(filepaths):
-            fobj = filepath_to_fileobject(filepath)
-            rel_filepath = os.path.relpath(filepath, start=target_path)
-            fileobjects_by_filepath[rel_filepath] = fobj
-
-        # Build output DFXML tree.
-        for filepath in sorted(fileobjects_by_filepath.keys()):
-            dobj.append(fileobjects_by_filepath[filepath])
+        try:
+            algorithms = HASH_PROFILES[hash_profile]
+        except KeyError:
+            raise DFXMLError("Unknown hash profile {}".format(hash_profile))
+        ignore_properties = {
+            algorithm: {"*"}
+            for algorithm in HASH_PROFILES["all"]
+            if algorithm not in algorithms
+        }
+
+        target_path = os.path.abspath(target_path)
+
+        def _fileobject(filepath, entry):
+            # One lstat per entry, reused for its type and properties
+            fobj = filepath_to_fileobject(
+                os.path.join(target_path, filepath),
+                ignore_properties=ignore_properties,
+                stat_result=entry.stat(follow_symlinks=False) if entry else None,
+            )
+            fobj.filename = filepath
+            return fobj
+
+        # File objects are built on a thread pool (hashlib releases the GIL)
+        # and written in sorted order as soon as they are ready. Only a few
+        # files per worker are in flight, so memory use does not grow with
+        # the number of files. Paths are resolved against target_path
+        # rather than changing the working directory, so DFXML can be
+        # written from several threads.
+        workers = max(workers, 1)
+        summary = DFXMLSummary()
+
+        def _write(fobj):
+            writer.write_fileobject(fobj)
+            summary.add_fileobject(fobj)
+
         with open(dfxml_path, "w") as output_fh:
-            dobj.print_dfxml(output_fh=output_fh)
+            with objects.DFXMLWriter(dobj, output_fh) as writer:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    in_flight = collections.deque()
+                    for filepath, entry in _sorted_entries(target_path):
+                        if len(in_flight) >= 2 * workers:
+                            _write(in_flight.popleft().result())
+                        in_flight.append(executor.submit(_fileobject, filepath, entry))
+                    while in_flight:
+                        _write(in_flight.popleft().result())
 
         logger.info("DFXML written to {}".format(dfxml_path))
+        return summary
 
     @staticmethod
     def set_file_permissions(target_dir):
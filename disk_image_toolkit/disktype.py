@@ -0,0 +1,216 @@
+"""Parser for disktype output.
+
+disktype describes a disk as an indented tree: partition maps list their
+partitions, and each partition lists what was found inside it, including
+file systems and nested partition maps. parse_disktype walks that tree and
+returns one DisktypeVolume per file system found, with offsets and sizes
+in bytes.
+
+Parsed volumes can be saved to a JSON sidecar next to the disktype output
+and loaded again while the output is unchanged.
+"""
+from dataclasses import asdict, dataclass, fields
+import json
+import os
+import re
+import typing
+
+import six
+
+
+# disktype reports partition offsets and sizes in 512-byte sectors.
+SECTOR_SIZE = 512
+
+PARTITION_RE = re.compile(r"^Partition (\d+):")
+PARTITION_EXTENT_RE = re.compile(r"(\d+) sectors from (\d+)(?:\+(\d+))?")
+SIZE_BYTES_RE = re.compile(r"\((\d+) bytes")
+
+SIDECAR_VERSION = 1
+
+
+@dataclass
+class DisktypeVolume:
+    """File system found by disktype.
+
+    :param index: 1-based position of the volume in disktype output (int)
+    :param file_system: File system name as reported, e.g. "FAT12" (str)
+    :param name: Volume name, or "" (str)
+    :param partition: Number of the innermost partition containing the
+        volume, or None (int)
+    :param offset: Byte offset of that partition on the disk, or None if
+        the volume is not in a partition (int)
+    :param length: Size of the volume in bytes, or of its partition if
+        disktype does not report the volume size, or None (int)
+    :param depth: Number of partitions the volume is nested in (int)
+    :param size: Volume size as displayed by disktype, or None (str)
+    """
+
+    index: int
+    file_system: str
+    name: str = ""
+    partition: typing.Optional[int] = None
+    offset: typing.Optional[int] = None
+    length: typing.Optional[int] = None
+    depth: int = 0
+    size: typing.Optional[str] = None
+
+    @property
+    def formatted_name(self):
+        """Return volume name made safe for use in a directory name."""
+        output = [
+            char
+            for char in self.name
+            if char.isalnum() or char.isspace() or char in ("-", "_")
+        ]
+        return "".join(output).replace(" ", "_").rstrip("/")
+
+    @property
+    def output_directory_name(self):
+        """Return name of directory files from this volume are carved to."""
+        name = f"volume-{self.index}-{self.file_system.lower()}"
+        if self.name:
+            name = f"{name}-{self.formatted_name}"
+        return name
+
+    def to_dict(self):
+        """Return volume as a JSON-serializable dict.
+
+        The dict has the keys of the volume dicts returned by
+        DiskImage.get_volumes_from_disktype; "size" is only present if
+        disktype reported a size.
+        """
+        volume = {
+            "id": self.index,
+            "name": self.name,
+            "formatted_name": self.formatted_name,
+            "file_system": self.file_system,
+            "output_directory_name": self.output_directory_name,
+            "partition": self.partition,
+            "offset": self.offset,
+            "length": self.length,
+            "depth": self.depth,
+        }
+        if self.size is not None:
+            volume["size"] = self.size
+        return volume
+
+
+def _size_in_bytes(size):
+    match = SIZE_BYTES_RE.search(size)
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def parse_disktype(disktype):
+    """Return list of DisktypeVolume for each file system in disktype output.
+
+    :param disktype: disktype output (bytes or str)
+
+    :returns: Volumes in the order disktype reports them (list)
+    """
+    volumes = []
+    # stack of (indent, number, offset, length) of enclosing partitions
+    partitions = []
+    volume = None
+    volume_indent = 0
+
+    for line in disktype.splitlines():
+        line = six.ensure_text(line, errors="ignore").rstrip()
+        text = line.lstrip()
+        if not text:
+            continue
+        indent = len(line) - len(text)
+
+        while partitions and indent <= partitions[-1][0]:
+            partitions.pop()
+        if volume is not None and indent <= volume_indent:
+            volume = None
+
+        match = PARTITION_RE.match(text)
+        if match:
+            offset = length = None
+            extent = PARTITION_EXTENT_RE.search(text)
+            if extent:
+                sectors, start, extended_start = extent.groups()
+                offset = (int(start) + int(extended_start or 0)) * SECTOR_SIZE
+                length = int(sectors) * SECTOR_SIZE
+            partitions.append((indent, int(match.group(1)), offset, length))
+            continue
+
+        if "file system" in text:
+            partition = partitions[-1] if partitions else (None, None, None, None)
+            volume = DisktypeVolume(
+                index=len(volumes) + 1,
+                file_system=text.split(" file system")[0],
+                partition=partition[1],
+                offset=partition[2],
+                length=partition[3],
+                depth=len(partitions),
+            )
+            volume_indent = indent
+            volumes.append(volume)
+            continue
+
+        if volume is None:
+            continue
+
+        if text.startswith("Volume name "):
+            volume.name = text.replace("Volume name ", "").replace('"', "")
+        elif text.startswith(("Volume size ", "Disk size ")):
+            volume.size = text.split(" size ", 1)[1]
+            volume.length = _size_in_bytes(volume.size) or volume.length
+        elif text.startswith("Data size "):
+            volume.length = _size_in_bytes(text) or volume.length
+
+    return volumes
+
+
+def save_volumes(sidecar_path, disktype_path, volumes):
+    """Write volumes parsed from disktype_path to a JSON sidecar.
+
+    :param sidecar_path: Path to sidecar JSON file (str)
+    :param disktype_path: Path to the disktype output parsed (str)
+    :param volumes: Parsed volumes (list of DisktypeVolume)
+    """
+    stat_result = os.stat(disktype_path)
+    sidecar = {
+        "version": SIDECAR_VERSION,
+        "disktype_size": stat_result.st_size,
+        "disktype_mtime_ns": stat_result.st_mtime_ns,
+        "volumes": [asdict(volume) for volume in volumes],
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(sidecar_path)), exist_ok=True)
+    temp_path = sidecar_path + ".tmp"
+    with open(temp_path, "w") as sidecar_file:
+        json.dump(sidecar, sidecar_file, indent=1)
+    os.replace(temp_path, sidecar_path)
+
+
+def load_volumes(sidecar_path, disktype_path):
+    """Return volumes saved by save_volumes, or None.
+
+    None is returned if the sidecar is missing or unreadable, or if the
+    disktype output has changed since it was written.
+    """
+    try:
+        with open(sidecar_path, "r") as sidecar_file:
+            sidecar = json.load(sidecar_file)
+        stat_result = os.stat(disktype_path)
+    except (OSError, ValueError):
+        return None
+
+    if sidecar.get("version") != SIDECAR_VERSION or (
+        sidecar.get("disktype_size"),
+        sidecar.get("disktype_mtime_ns"),
+    ) != (stat_result.st_size, stat_result.st_mtime_ns):
+        return None
+
+    names = {field.name for field in fields(DisktypeVolume)}
+    try:
+        return [
+            DisktypeVolume(**{k: v for k, v in volume.items() if k in names})
+            for volume in sidecar["volumes"]
+        ]
+    except (KeyError, TypeError):
+        return None
@@ -0,0 +1,136 @@
+"""Persistent per-image stage journal for resumable batch runs.
+
+The journal is an append-only JSON Lines file. Each line records that a
+pipeline stage finished for one disk image, the artifacts it produced and
+any state later stages need (e.g. the volumes found on the disk). The
+whole file is read once at startup, so checking progress for thousands of
+images only costs one read plus a stat() of each image's newest artifacts.
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+
+
+JOURNAL_FILENAME = "journal.jsonl"
+
+
+class StageJournal:
+    """Record and look up completed pipeline stages per disk image.
+
+    :param path: Path to journal file. Created if it does not exist (str)
+    :param base_dir: Directory artifact paths are recorded relative to.
+        Defaults to the directory containing the journal (str)
+    """
+
+    def __init__(self, path, base_dir=None):
+        self.path = os.path.abspath(path)
+        self.base_dir = os.path.abspath(base_dir or os.path.dirname(self.path))
+        self._records = {}
+        self._lock = threading.Lock()
+        self._needs_newline = False
+        self._load()
+
+    def _load(self):
+        """Read existing journal entries into memory."""
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path, "r") as journal_file:
+            for line in journal_file:
+                self._needs_newline = not line.endswith("\n")
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Partially written last line after a crash.
+                    logging.getLogger().warning(
+                        f"Ignoring unreadable journal entry in {self.path}"
+                    )
+                    continue
+                self._apply(entry)
+
+    def _apply(self, entry):
+        image = entry["image"]
+        if entry.get("event") == "reset":
+            for stage in entry["stages"]:
+                self._records.get(image, {}).pop(stage, None)
+        else:
+            self._records.setdefault(image, {})[entry["stage"]] = entry
+
+    def _append(self, entry):
+        with self._lock:
+            self._apply(entry)
+            with open(self.path, "a") as journal_file:
+                if self._needs_newline:
+                    # Do not append to a line truncated by a crash.
+                    journal_file.write("\n")
+                    self._needs_newline = False
+                journal_file.write(json.dumps(entry) + "\n")
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def get(self, image, stage):
+        """Return journal entry for completed stage or None."""
+        return self._records.get(image, {}).get(stage)
+
+    def record(self, image, stage, artifacts=(), data=None):
+        """Record that stage finished for image.
+
+        :param image: Disk image identifier (str)
+        :param stage: Stage name (str)
+        :param artifacts: Paths of files or directories produced. Paths that
+            do not exist (e.g. output a tool failed to write) are not
+            recorded (iterable)
+        :param data: JSON-serialisable state to restore on resume (dict)
+        """
+        self._append(
+            {
+                "image": image,
+                "stage": stage,
+                "artifacts": [
+                    os.path.relpath(os.path.abspath(path), self.base_dir)
+                    for path in artifacts
+                    if path and os.path.exists(path)
+                ],
+                "data": data or {},
+                "completed": datetime.datetime.now().isoformat(timespec="seconds"),
+            }
+        )
+
+    def reset(self, image, stages):
+        """Forget completed stages for image, e.g. before they are redone."""
+        stages = [stage for stage in stages if self.get(image, stage)]
+        if stages:
+            self._append({"image": image, "event": "reset", "stages": stages})
+
+    def artifacts_exist(self, entry):
+        """Return True if every artifact recorded in entry still exists."""
+        return all(
+            os.path.exists(os.path.join(self.base_dir, path))
+            for path in entry["artifacts"]
+        )
+
+    def resume_index(self, image, stages):
+        """Return index of the first stage that must be run for image.
+
+        Stages only count as done as a contiguous prefix. The newest
+        finished stage must also still have all of its artifacts on disk;
+        earlier stages' artifacts may legitimately have been consumed (e.g.
+        scratch raw images or files moved during packaging).
+
+        :param image: Disk image identifier (str)
+        :param stages: Stage names in pipeline order (list)
+
+        :returns: Index into stages; len(stages) if all are done (int)
+        """
+        done = 0
+        for stage in stages:
+            if not self.get(image, stage):
+                break
+            done += 1
+
+        while done and not self.artifacts_exist(self.get(image, stages[done - 1])):
+            done -= 1
+
+        return done
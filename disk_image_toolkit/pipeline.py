@@ -0,0 +1,165 @@
+"""Staged pipeline executor for batch disk image processing.
+
+Each stage has its own bounded input queue and its own pool of worker
+threads, so different images can be in different stages at the same time
+(e.g. image N+1 is copied while image N is carved and image N-1 is
+scanned). Most stages spend their time in external tools (ewfexport,
+disktype, fiwalk, tsk_recover, brunnhilde) or in hashlib, both of which
+run outside the GIL, so threads are sufficient to use multiple cores.
+
+With a StageJournal, every finished stage is recorded and a rerun skips
+the stages an item already completed.
+"""
+import logging
+import queue
+import threading
+import time
+
+
+_STOP = object()
+
+
+class Stage:
+    """Pipeline stage.
+
+    :param name: Stage name, used in logs and journals (str)
+    :param func: Callable run once per item; receives the item (callable)
+    :param workers: Maximum number of items processed concurrently (int)
+    :param queue_size: Maximum number of items waiting for this stage.
+        Defaults to the number of workers (int)
+    :param resume: Callable run instead of func when the journal shows the
+        stage already finished; receives the item and the journaled data
+        (callable)
+
+    func may return a dict with "artifacts" (list of paths produced) and
+    "data" (JSON-serialisable state for resume) to be journaled.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None, resume=None):
+        if workers < 1:
+            raise ValueError(f"Stage {name} requires at least one worker")
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue_size = queue_size or workers
+        self.resume = resume
+
+
+class Pipeline:
+    """Run items through an ordered list of stages concurrently.
+
+    Items that raise in a stage, including SystemExit, are logged, passed
+    to the optional on_error callback and not handed to later stages. Items are
+    identified in logs and in the optional journal by str(item).
+    """
+
+    def __init__(self, stages, on_error=None, journal=None):
+        self.stages = list(stages)
+        self.on_error = on_error
+        self.journal = journal
+        self._start_index = {}
+
+    def run(self, items):
+        """Run all items through the pipeline.
+
+        :param items: Items to process, in submission order (iterable)
+
+        :returns: Items in submission order (list)
+        """
+        items = list(items)
+        if not self.stages:
+            return items
+
+        if self.journal is not None:
+            stage_names = [stage.name for stage in self.stages]
+            for item in items:
+                key = str(item)
+                index = self.journal.resume_index(key, stage_names)
+                self._start_index[key] = index
+                # Anything after the resume point is redone from scratch.
+                self.journal.reset(key, stage_names[index:])
+
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+
+        threads_by_stage = []
+        for index, stage in enumerate(self.stages):
+            out_queue = queues[index + 1] if index + 1 < len(queues) else None
+            threads = [
+                threading.Thread(
+                    target=self._worker,
+                    args=(index, stage, queues[index], out_queue),
+                    name=f"{stage.name}-{number}",
+                    daemon=True,
+                )
+                for number in range(stage.workers)
+            ]
+            for thread in threads:
+                thread.start()
+            threads_by_stage.append(threads)
+
+        for item in items:
+            queues[0].put(item)
+
+        # Shut stages down in order: once every worker of a stage has exited,
+        # all of its items have been handed to the next stage.
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                queues[index].put(_STOP)
+            for thread in threads_by_stage[index]:
+                thread.join()
+
+        return items
+
+    def _worker(self, index, stage, in_queue, out_queue):
+        # Look up the root logger per call so handlers configured by the
+        # calling script after import are used.
+        logger = logging.getLogger()
+
+        while True:
+            item = in_queue.get()
+            if item is _STOP:
+                return
+
+            if index < self._start_index.get(str(item), 0):
+                try:
+                    if stage.resume:
+                        entry = self.journal.get(str(item), stage.name)
+                        stage.resume(item, entry["data"])
+                except BaseException as err:
+                    self._report_error(item, stage, err)
+                    continue
+                logger.info(f"Stage {stage.name} already complete for {item}")
+                if out_queue is not None:
+                    out_queue.put(item)
+                continue
+
+            start_time = time.monotonic()
+            try:
+                result = stage.func(item) or {}
+                if self.journal is not None:
+                    self.journal.record(
+                        str(item),
+                        stage.name,
+                        artifacts=result.get("artifacts", ()),
+                        data=result.get("data"),
+                    )
+            # SystemExit (e.g. sys.exit in a library) must not end the worker
+            # thread, or the stages before it block on a full queue
+            except BaseException as err:
+                self._report_error(item, stage, err)
+                continue
+
+            elapsed = time.monotonic() - start_time
+            logger.info(f"Stage {stage.name} finished for {item} in {elapsed:.1f}s")
+
+            if out_queue is not None:
+                out_queue.put(item)
+
+    def _report_error(self, item, stage, err):
+        logger = logging.getLogger()
+        logger.error(f"Stage {stage.name} failed for {item}: {err}")
+        if self.on_error:
+            try:
+                self.on_error(item, stage, err)
+            except Exception as callback_err:
+                logger.error(f"Error handler failed for {item}: {callback_err}")
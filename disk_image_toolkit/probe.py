@@ -0,0 +1,643 @@
+"""Pure-Python probe of common disk layouts.
+
+Recognizes MBR, GPT and Apple partition maps and FAT, NTFS, ext2/3/4,
+HFS, HFS Plus, ISO9660 and UDF file systems by their signatures, reading
+only the first sectors of the disk and the known superblock locations
+through a small read-limited cache.
+
+probe_disk_image returns a report in the layout of disktype's output, so
+it can be parsed and archived like disktype output. The probe is
+conservative: anything it does not fully recognize (extended partitions,
+hybrid layouts other than ISO9660 with HFS or UDF, partitions with no
+known file system, unusual sector sizes) returns None, and disktype
+should be run instead.
+"""
+import os
+import struct
+import uuid
+
+from disk_image_toolkit.disktype import SECTOR_SIZE
+
+
+DEFAULT_READ_LIMIT = 4 * 1024**2
+READ_BLOCK_SIZE = 4096
+
+CD_SECTOR_SIZE = 2048
+ISO9660_FIRST_DESCRIPTOR = 16
+MAX_VOLUME_DESCRIPTORS = 32
+UDF_ANCHOR_SECTOR = 256
+
+MBR_EXTENDED_TYPES = (0x05, 0x0F, 0x85)
+MBR_GPT_PROTECTIVE_TYPE = 0xEE
+
+# GPT partition types that hold no file system.
+GPT_EMPTY_TYPES = (
+    "e3c9e316-0b5c-4db8-817d-f92df00215ae",  # Microsoft reserved
+    "21686148-6449-6e6f-744e-656564454649",  # BIOS boot
+)
+
+# Apple partition map entries that hold no file system.
+APM_EMPTY_TYPES = ("Apple_partition_map", "Apple_Free", "Apple_Void")
+APM_EMPTY_TYPE_PREFIXES = ("Apple_Driver", "Apple_Patches", "Iomega_")
+
+EXT_MAGIC = 0xEF53
+EXT_COMPAT_HAS_JOURNAL = 0x4
+EXT_INCOMPAT_EXT4 = 0x40 | 0x80 | 0x200  # extents, 64bit, flex_bg
+
+_UNITS = ("KiB", "MiB", "GiB", "TiB", "PiB", "EiB")
+
+
+class _Unrecognized(Exception):
+    """Disk layout is not one the probe can describe with confidence."""
+
+
+class _Reader:
+    """Read-only, cached access to a disk image with a cap on bytes read."""
+
+    def __init__(self, image_file, size, limit):
+        self.image_file = image_file
+        self.size = size
+        self.limit = limit
+        self.bytes_read = 0
+        self._blocks = {}
+
+    def read(self, offset, length):
+        if offset < 0 or length < 0 or offset + length > self.size:
+            raise _Unrecognized(f"Read of {length} bytes at {offset} out of bounds")
+
+        first = offset // READ_BLOCK_SIZE
+        last = (offset + length - 1) // READ_BLOCK_SIZE
+        data = bytearray()
+        for index in range(first, last + 1):
+            block = self._blocks.get(index)
+            if block is None:
+                if self.bytes_read + READ_BLOCK_SIZE > self.limit:
+                    raise _Unrecognized("Read limit reached")
+                self.image_file.seek(index * READ_BLOCK_SIZE)
+                block = self.image_file.read(READ_BLOCK_SIZE)
+                self.bytes_read += READ_BLOCK_SIZE
+                self._blocks[index] = block
+            data += block
+
+        start = offset - first * READ_BLOCK_SIZE
+        return bytes(data[start : start + length])
+
+
+def format_size(size):
+    """Return size in bytes formatted as disktype does, e.g. "1.390 MiB"."""
+    if size < 1000:
+        return f"{size} bytes"
+
+    unit_index = 0
+    unit_size = 1024
+    while size >= 1000 * unit_size and unit_index < len(_UNITS) - 1:
+        unit_index += 1
+        unit_size *= 1024
+
+    if size % unit_size == 0:
+        return f"{size // unit_size} {_UNITS[unit_index]}"
+    value = size / unit_size
+    if value < 10:
+        return f"{value:.3f} {_UNITS[unit_index]}"
+    if value < 100:
+        return f"{value:.2f} {_UNITS[unit_index]}"
+    return f"{value:.1f} {_UNITS[unit_index]}"
+
+
+def _format_raw_size(size):
+    """Return size in the largest unit dividing it exactly, e.g. "1536 bytes"."""
+    unit_index = -1
+    while size and size % 1024 == 0 and unit_index < len(_UNITS) - 1:
+        size //= 1024
+        unit_index += 1
+    if unit_index < 0:
+        return f"{size} bytes"
+    return f"{size} {_UNITS[unit_index]}"
+
+
+def _format_blocky_size(count, block_size, blocks):
+    """Return e.g. "1.390 MiB (1457664 bytes, 2847 clusters of 512 bytes)"."""
+    size = count * block_size
+    if size < 1000:
+        return f"{format_size(size)} ({count} {blocks})"
+    return f"{format_size(size)} ({size} bytes, {count} {blocks})"
+
+
+def _ascii_text(data):
+    try:
+        return data.decode("ascii").rstrip(" \x00")
+    except UnicodeDecodeError:
+        raise _Unrecognized("Non-ASCII volume name")
+
+
+def _udf_dstring(data):
+    """Decode an OSTA compressed Unicode dstring."""
+    length = data[-1]
+    if length == 0:
+        return ""
+    if data[0] == 8:
+        return data[1:length].decode("latin-1")
+    if data[0] == 16:
+        return data[1:length].decode("utf-16-be")
+    raise _Unrecognized("Unknown UDF string compression")
+
+
+def _fat_or_ntfs(reader, offset, length):
+    """Return report lines for a FAT or NTFS boot sector at offset, or None."""
+    if length < SECTOR_SIZE:
+        return None
+    boot = reader.read(offset, SECTOR_SIZE)
+    if boot[510:512] != b"\x55\xaa":
+        return None
+
+    bytes_per_sector = struct.unpack_from("<H", boot, 11)[0]
+    if bytes_per_sector not in (512, 1024, 2048, 4096):
+        return None
+
+    if boot[3:11] == b"NTFS    ":
+        total_sectors = struct.unpack_from("<Q", boot, 40)[0]
+        return [
+            "NTFS file system",
+            "  Volume size {}".format(
+                _format_blocky_size(total_sectors, bytes_per_sector, "sectors")
+            ),
+        ]
+
+    sectors_per_cluster = boot[13]
+    reserved, fats, root_entries, total16 = struct.unpack_from("<HBHH", boot, 14)
+    media = boot[21]
+    fat_size16 = struct.unpack_from("<H", boot, 22)[0]
+    total32, fat_size32 = struct.unpack_from("<II", boot, 32)
+    if (
+        boot[0] not in (0xEB, 0xE9)
+        or sectors_per_cluster == 0
+        or sectors_per_cluster & (sectors_per_cluster - 1)
+        or reserved == 0
+        or fats not in (1, 2)
+        or not (media == 0xF0 or media >= 0xF8)
+    ):
+        return None
+
+    total_sectors = total16 or total32
+    fat_size = fat_size16 or fat_size32
+    root_sectors = (root_entries * 32 + bytes_per_sector - 1) // bytes_per_sector
+    data_sectors = total_sectors - reserved - fats * fat_size - root_sectors
+    if not total_sectors or not fat_size or data_sectors <= 0:
+        return None
+    if total_sectors * bytes_per_sector > length:
+        raise _Unrecognized("FAT file system larger than its container")
+
+    clusters = data_sectors // sectors_per_cluster
+    cluster_size = sectors_per_cluster * bytes_per_sector
+    if fat_size16 == 0:
+        fat_type, signature_offset = 32, 66
+        root_cluster = struct.unpack_from("<I", boot, 44)[0]
+        root_offset = (
+            offset
+            + (reserved + fats * fat_size + (root_cluster - 2) * sectors_per_cluster)
+            * bytes_per_sector
+        )
+        root_length = cluster_size
+    else:
+        fat_type, signature_offset = (12 if clusters < 4085 else 16), 38
+        root_offset = offset + (reserved + fats * fat_size) * bytes_per_sector
+        root_length = root_sectors * bytes_per_sector
+
+    label = ""
+    if boot[signature_offset] == 0x29:
+        label = _ascii_text(boot[signature_offset + 5 : signature_offset + 16])
+        if label == "NO NAME":
+            label = ""
+
+    # A label in the root directory that differs from the boot sector's
+    # could be reported either way, so leave that to disktype.
+    root = reader.read(root_offset, root_length)
+    for entry in range(0, len(root), 32):
+        if root[entry] == 0:
+            break
+        if root[entry] != 0xE5 and root[entry + 11] & 0x3F == 0x08:
+            if _ascii_text(root[entry : entry + 11]) != label:
+                raise _Unrecognized("FAT volume labels differ")
+            break
+
+    lines = [
+        f"FAT{fat_type} file system",
+        "  Volume size {}".format(
+            _format_blocky_size(
+                clusters, cluster_size, f"clusters of {_format_raw_size(cluster_size)}"
+            )
+        ),
+    ]
+    if label:
+        lines.append(f'  Volume name "{label}"')
+    return lines
+
+
+def _hfs_plus_volume_name(reader, offset, header):
+    """Return volume name from the first record of the HFS Plus catalog."""
+    block_size = struct.unpack_from(">I", header, 40)[0]
+    # catalog file fork: first extent's start block and block count
+    start_block, block_count = struct.unpack_from(">II", header, 288)
+    catalog_offset = offset + start_block * block_size
+
+    node = reader.read(catalog_offset, 512)
+    first_leaf, _, node_size = struct.unpack_from(">IIH", node, 24)
+    if (
+        node_size < 512
+        or node_size > 32768
+        or (first_leaf + 1) * node_size > block_count * block_size
+    ):
+        raise _Unrecognized("Unexpected HFS Plus catalog layout")
+
+    leaf = reader.read(catalog_offset + first_leaf * node_size, node_size)
+    kind, _, records = struct.unpack_from(">bBH", leaf, 8)
+    record = struct.unpack_from(">H", leaf, node_size - 2)[0]
+    if kind != -1 or not records or record + 8 > node_size:
+        raise _Unrecognized("Unexpected HFS Plus catalog leaf")
+
+    parent_id, name_length = struct.unpack_from(">IH", leaf, record + 2)
+    if parent_id != 1 or record + 8 + name_length * 2 > node_size:
+        raise _Unrecognized("HFS Plus root folder not found")
+    return leaf[record + 8 : record + 8 + name_length * 2].decode("utf-16-be")
+
+
+def _hfs(reader, offset, length):
+    """Return report lines for an HFS or HFS Plus volume at offset, or None."""
+    if length < 1536:
+        return None
+    header = reader.read(offset + 1024, 512)
+    signature = header[0:2]
+
+    if signature == b"BD":
+        if header[124:126] == b"H+":
+            raise _Unrecognized("HFS Plus volume embedded in HFS wrapper")
+        blocks, block_size = struct.unpack_from(">HI", header, 18)
+        name_length = header[36]
+        if not block_size or block_size % 512 or name_length > 27:
+            return None
+        name = header[37 : 37 + name_length].decode("mac_roman")
+        lines = ["HFS file system"]
+        if name:
+            lines.append(f'  Volume name "{name}"')
+        lines.append(
+            "  Volume size {}".format(
+                _format_blocky_size(
+                    blocks, block_size, f"blocks of {_format_raw_size(block_size)}"
+                )
+            )
+        )
+        return lines
+
+    if signature == b"H+" and header[2:4] == b"\x00\x04":
+        block_size, blocks = struct.unpack_from(">II", header, 40)
+        if not block_size or block_size % 512:
+            return None
+        name = _hfs_plus_volume_name(reader, offset, header)
+        lines = ["HFS Plus file system"]
+        if name:
+            lines.append(f'  Volume name "{name}"')
+        lines.append(
+            "  Volume size {}".format(
+                _format_blocky_size(
+                    blocks, block_size, f"blocks of {_format_raw_size(block_size)}"
+                )
+            )
+        )
+        return lines
+
+    if signature == b"HX":
+        raise _Unrecognized("HFSX volume")
+    return None
+
+
+def _ext(reader, offset, length):
+    """Return report lines for an ext2, ext3 or ext4 volume, or None."""
+    if length < 2048:
+        return None
+    superblock = reader.read(offset + 1024, 1024)
+    if struct.unpack_from("<H", superblock, 56)[0] != EXT_MAGIC:
+        return None
+
+    blocks = struct.unpack_from("<I", superblock, 4)[0]
+    log_block_size = struct.unpack_from("<I", superblock, 24)[0]
+    compat, incompat = struct.unpack_from("<II", superblock, 92)
+    if log_block_size > 6:
+        return None
+    block_size = 1024 << log_block_size
+    if incompat & 0x80:
+        blocks += struct.unpack_from("<I", superblock, 0x150)[0] << 32
+
+    if incompat & EXT_INCOMPAT_EXT4:
+        version = "Ext4"
+    elif compat & EXT_COMPAT_HAS_JOURNAL:
+        version = "Ext3"
+    else:
+        version = "Ext2"
+
+    lines = [f"{version} file system"]
+    name = _ascii_text(superblock[120:136])
+    if name:
+        lines.append(f'  Volume name "{name}"')
+    lines.append(
+        "  Volume size {}".format(
+            _format_blocky_size(
+                blocks, block_size, f"blocks of {_format_raw_size(block_size)}"
+            )
+        )
+    )
+    return lines
+
+
+def _cd(reader, offset, length):
+    """Return report lines for ISO9660 and UDF volumes at offset.
+
+    Returns a list of line lists, one per file system found, in the order
+    ISO9660, UDF.
+    """
+    first = offset + ISO9660_FIRST_DESCRIPTOR * CD_SECTOR_SIZE
+    if length < first - offset + CD_SECTOR_SIZE:
+        return []
+
+    primary = joliet = None
+    nsr = False
+    for index in range(MAX_VOLUME_DESCRIPTORS):
+        sector_offset = first + index * CD_SECTOR_SIZE
+        if sector_offset + CD_SECTOR_SIZE > offset + length:
+            break
+        descriptor = reader.read(sector_offset, CD_SECTOR_SIZE)
+        identifier = descriptor[1:6]
+        if identifier == b"CD001":
+            if descriptor[0] == 1 and primary is None:
+                primary = descriptor
+            elif descriptor[0] == 2 and descriptor[88:91] in (
+                b"%/@",
+                b"%/C",
+                b"%/E",
+            ):
+                joliet = descriptor
+        elif identifier in (b"NSR02", b"NSR03"):
+            nsr = True
+        elif identifier not in (b"BEA01", b"TEA01", b"BOOT2", b"CDW02"):
+            break
+
+    found = []
+    if primary is not None:
+        name = _ascii_text(primary[40:72])
+        space_size = struct.unpack_from("<I", primary, 80)[0]
+        block_size = struct.unpack_from("<H", primary, 128)[0]
+        lines = ["ISO9660 file system"]
+        if name:
+            lines.append(f'  Volume name "{name}"')
+        lines.append(
+            "  Data size {}".format(
+                _format_blocky_size(
+                    space_size, block_size, f"blocks of {_format_raw_size(block_size)}"
+                )
+            )
+        )
+        if joliet is not None:
+            joliet_name = joliet[40:72].decode("utf-16-be", errors="replace")
+            lines.append(
+                '  Joliet extension, volume name "{}"'.format(
+                    joliet_name.rstrip(" \x00")
+                )
+            )
+        found.append(lines)
+
+    if nsr:
+        found.append(_udf(reader, offset, length))
+
+    return found
+
+
+def _udf(reader, offset, length):
+    """Return report lines for a UDF volume with 2048-byte sectors."""
+    anchor = reader.read(offset + UDF_ANCHOR_SECTOR * CD_SECTOR_SIZE, 32)
+    if struct.unpack_from("<H", anchor, 0)[0] != 2:
+        raise _Unrecognized("UDF anchor volume descriptor not found")
+    extent_length, extent_location = struct.unpack_from("<II", anchor, 16)
+
+    volume_name = logical_name = None
+    for index in range(min(extent_length // CD_SECTOR_SIZE, 16)):
+        descriptor = reader.read(
+            offset + (extent_location + index) * CD_SECTOR_SIZE, 512
+        )
+        tag = struct.unpack_from("<H", descriptor, 0)[0]
+        if tag == 1 and volume_name is None:
+            volume_name = _udf_dstring(descriptor[24:56])
+        elif tag == 6 and logical_name is None:
+            logical_name = _udf_dstring(descriptor[84:212])
+        elif tag == 8:
+            break
+
+    # Which of the two names disktype reports is not certain, so only
+    # describe volumes where they agree.
+    if volume_name is None or volume_name != logical_name:
+        raise _Unrecognized("UDF volume names missing or differ")
+
+    lines = ["UDF file system"]
+    if volume_name:
+        lines.append(f'  Volume name "{volume_name}"')
+    return lines
+
+
+def _file_systems(reader, offset, length):
+    """Return list of report line lists for file systems at offset."""
+    found = []
+    for detect in (_fat_or_ntfs, _hfs, _ext):
+        lines = detect(reader, offset, length)
+        if lines:
+            found.append(lines)
+    if len(found) > 1:
+        raise _Unrecognized("Conflicting file system signatures")
+
+    cd_file_systems = _cd(reader, offset, length)
+    if cd_file_systems and found and not found[0][0].startswith("HFS file"):
+        raise _Unrecognized("File system signatures of a hybrid disc")
+
+    return found + cd_file_systems
+
+
+def _indent(lines, level=1):
+    return ["  " * level + line for line in lines]
+
+
+def _partition_lines(number, start, sectors, info, reader, empty_allowed):
+    """Return report lines for a partition and the file systems in it.
+
+    :param info: Lines describing the partition type and name (list)
+    :param empty_allowed: Whether the partition may hold no file system
+        (bool)
+    """
+    lines = [
+        "Partition {}: {}".format(
+            number, _format_blocky_size(sectors, SECTOR_SIZE, f"sectors from {start}")
+        )
+    ]
+    lines.extend(_indent(info))
+    file_systems = _file_systems(reader, start * SECTOR_SIZE, sectors * SECTOR_SIZE)
+    if not file_systems and not empty_allowed:
+        raise _Unrecognized(f"No file system found in partition {number}")
+    for fs_lines in file_systems:
+        lines.extend(_indent(fs_lines))
+    return lines
+
+
+def _mbr_entries(boot):
+    """Return list of (number, type, start, sectors) of used MBR entries.
+
+    Returns None if the entries do not form a partition table.
+    """
+    entries = []
+    for number in range(1, 5):
+        entry = boot[446 + (number - 1) * 16 : 446 + number * 16]
+        if entry[0] not in (0x00, 0x80):
+            return None
+        partition_type = entry[4]
+        start, sectors = struct.unpack_from("<II", entry, 8)
+        if partition_type == 0:
+            continue
+        if not start or not sectors:
+            return None
+        entries.append((number, partition_type, start, sectors))
+    return entries
+
+
+def _mbr(reader, entries):
+    lines = ["DOS/MBR partition map"]
+    for number, partition_type, start, sectors in entries:
+        if partition_type in MBR_EXTENDED_TYPES:
+            raise _Unrecognized("Extended partitions")
+        lines.extend(
+            _partition_lines(
+                number, start, sectors, [f"Type 0x{partition_type:02X}"], reader, False
+            )
+        )
+    return lines
+
+
+def _gpt(reader):
+    header = reader.read(SECTOR_SIZE, SECTOR_SIZE)
+    if header[0:8] != b"EFI PART":
+        raise _Unrecognized("Protective MBR without GPT header")
+    entries_lba = struct.unpack_from("<Q", header, 72)[0]
+    count, entry_size = struct.unpack_from("<II", header, 80)
+    if entry_size < 128 or count > 1024:
+        raise _Unrecognized("Unexpected GPT entry layout")
+
+    table = reader.read(entries_lba * SECTOR_SIZE, count * entry_size)
+    lines = [f"GPT partition map, {count} entries"]
+    for number in range(1, count + 1):
+        entry = table[(number - 1) * entry_size : number * entry_size]
+        if entry[0:16] == bytes(16):
+            continue
+        type_guid = str(uuid.UUID(bytes_le=entry[0:16]))
+        first, last = struct.unpack_from("<QQ", entry, 32)
+        if last < first:
+            raise _Unrecognized("Invalid GPT entry")
+        info = [f"Type {type_guid}"]
+        name = entry[56:128].decode("utf-16-le", errors="replace").rstrip("\x00")
+        if name:
+            info.append(f'Partition Name "{name}"')
+        lines.extend(
+            _partition_lines(
+                number,
+                first,
+                last - first + 1,
+                info,
+                reader,
+                type_guid in GPT_EMPTY_TYPES,
+            )
+        )
+    return lines
+
+
+def _apm(reader):
+    if struct.unpack_from(">H", reader.read(0, 4), 2)[0] != SECTOR_SIZE:
+        raise _Unrecognized("Apple partition map block size is not 512")
+
+    first = reader.read(SECTOR_SIZE, SECTOR_SIZE)
+    count = struct.unpack_from(">I", first, 4)[0]
+    if not count or count > 256:
+        raise _Unrecognized("Unexpected Apple partition map size")
+
+    lines = [f"Apple partition map, {count} entries"]
+    for number in range(1, count + 1):
+        entry = reader.read(number * SECTOR_SIZE, SECTOR_SIZE)
+        if entry[0:2] != b"PM":
+            raise _Unrecognized("Invalid Apple partition map entry")
+        start, sectors = struct.unpack_from(">II", entry, 8)
+        partition_type = _ascii_text(entry[48:80])
+        empty_allowed = partition_type in APM_EMPTY_TYPES or partition_type.startswith(
+            APM_EMPTY_TYPE_PREFIXES
+        )
+        lines.extend(
+            _partition_lines(
+                number,
+                start,
+                sectors,
+                [f'Type "{partition_type}"'],
+                reader,
+                empty_allowed,
+            )
+        )
+    return lines
+
+
+def _probe(reader):
+    """Return report lines describing the disk."""
+    first_sector = reader.read(0, SECTOR_SIZE)
+
+    if first_sector[0:2] == b"ER" and reader.read(SECTOR_SIZE, 2) == b"PM":
+        lines = _apm(reader)
+        if _cd(reader, 0, reader.size):
+            raise _Unrecognized("Apple partition map on an ISO9660 disc")
+        return lines
+
+    if first_sector[510:512] == b"\x55\xaa" and not _fat_or_ntfs(
+        reader, 0, reader.size
+    ):
+        entries = _mbr_entries(first_sector)
+        if entries is None:
+            raise _Unrecognized("Boot sector is not a partition table")
+        if entries:
+            if _cd(reader, 0, reader.size):
+                raise _Unrecognized("Partition table on an ISO9660 disc")
+            if any(entry[1] == MBR_GPT_PROTECTIVE_TYPE for entry in entries):
+                if len(entries) > 1:
+                    raise _Unrecognized("Hybrid MBR")
+                return _gpt(reader)
+            return _mbr(reader, entries)
+
+    lines = []
+    file_systems = _file_systems(reader, 0, reader.size)
+    if not file_systems:
+        raise _Unrecognized("No file system found")
+    for fs_lines in file_systems:
+        lines.extend(fs_lines)
+    return lines
+
+
+def probe_disk_image(path, read_limit=DEFAULT_READ_LIMIT):
+    """Describe disk image at path in the layout of disktype output.
+
+    :param path: Path to raw disk image (str)
+    :param read_limit: Maximum number of bytes to read from the image (int)
+
+    :returns: Report (bytes), or None if the layout is not recognized
+    """
+    try:
+        with open(path, "rb") as image_file:
+            size = image_file.seek(0, os.SEEK_END)
+            reader = _Reader(image_file, size, read_limit)
+            lines = _probe(reader)
+    except (OSError, _Unrecognized, struct.error, UnicodeDecodeError, ValueError):
+        return None
+
+    header = [
+        "",
+        f"--- {path}",
+        "Probed by disk_image_toolkit.probe; disktype was not run",
+        f"Regular file, size {format_size(size)} ({size} bytes)",
+    ]
+    return ("\n".join(header + lines) + "\n").encode("utf-8")
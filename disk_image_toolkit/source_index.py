@@ -0,0 +1,136 @@
+"""Index of the disk images in a source directory.
+
+The source directory is listed once and each disk image is grouped with
+the files belonging to it: its numbered segments (.E02, ..., .002, ...)
+and its sidecars (.info, .log, .md5, ...). Files are matched on the exact
+image stem followed by a dot, so disk1 never claims disk10.img or
+disk100.E01.
+"""
+from dataclasses import dataclass, field
+import os
+import re
+import typing
+
+
+DISK_IMAGE_EXTENSIONS = (".e01", ".000", ".ewf", ".001", ".raw", ".img", ".dd", ".iso")
+
+# Numbered segment extensions: EWF (.E01 to .E99, then .EAA, .EAB, ...),
+# EWF2 (.Ex01, ...), SMART (.s01, ...) and split raw (.000 or .001, ...)
+SEGMENT_EXTENSION_RE = re.compile(
+    r"\.(?:(?P<series>ex|e|s)(?P<number>\d{2}|[a-z]{2})|(?P<raw>\d{3}))$",
+    re.IGNORECASE,
+)
+
+FIRST_SEGMENTS = ("01", "000", "001")
+
+
+def _segment_series(names):
+    """Return dict of (stem, series) to sorted names of its segments.
+
+    Names are only segments of a series that has a first segment (.E01,
+    .001, ...), and lettered EWF segments only of a series that reached
+    its 99th segment, so sidecars such as disk.exe or disk.eps next to
+    disk.E01 are not taken for segments.
+    """
+    candidates = {}
+    for name in names:
+        stem, extension = os.path.splitext(name)
+        match = SEGMENT_EXTENSION_RE.match(extension)
+        if not match:
+            continue
+        series = (match.group("series") or "").lower()
+        number = (match.group("number") or match.group("raw")).lower()
+        candidates.setdefault((stem, series), []).append((number, name))
+
+    segments = {}
+    for key, numbered in candidates.items():
+        numbers = {number for number, _ in numbered}
+        if numbers.isdisjoint(FIRST_SEGMENTS):
+            continue
+        segments[key] = [
+            name for number, name in numbered if number.isdigit() or "99" in numbers
+        ]
+    return segments
+
+
+@dataclass
+class SourceImage:
+    """A disk image in the source directory and the files belonging to it.
+
+    :param filename: Filename of the image, or of its first segment (str)
+    :param segments: Sorted filenames of the image content, starting with
+        filename (list)
+    :param sidecars: Sorted filenames of other files belonging to the
+        image (list)
+    """
+
+    filename: str
+    segments: typing.List[str] = field(default_factory=list)
+    sidecars: typing.List[str] = field(default_factory=list)
+
+    @property
+    def files(self):
+        """Sorted filenames of all files to stage with the image."""
+        return sorted(self.segments + self.sidecars)
+
+
+class SourceIndex:
+    """Disk images in a source directory, grouped with their files.
+
+    A file with a disk image extension is an image unless it is a later
+    segment of another image with the same stem. Segments share the exact
+    stem of the image and have a numbered extension of the same series
+    (EWF, EWF2, SMART or split raw) as its first segment. Any other
+    file named <stem>.<anything> is a sidecar of the image with the
+    longest such stem, so disk1.E01.txt belongs to disk1.E01 and
+    disk1.part2.log to disk1.part2.img. Images sharing a stem share its
+    sidecars, but images never claim other images.
+
+    :param source_dir: Directory holding disk images and sidecars (str)
+    """
+
+    def __init__(self, source_dir):
+        self.source_dir = os.path.abspath(source_dir)
+        with os.scandir(self.source_dir) as entries:
+            self.names = sorted(entry.name for entry in entries if entry.is_file())
+
+        segments_by_series = _segment_series(self.names)
+
+        # image filename to SourceImage, in sorted filename order
+        self.images = {}
+        images_by_stem = {}
+        claimed = set()
+        for name in self.names:
+            stem, extension = os.path.splitext(name)
+            if extension.lower() not in DISK_IMAGE_EXTENSIONS or name in claimed:
+                continue
+            segments = [name]
+            match = SEGMENT_EXTENSION_RE.match(extension)
+            if match:
+                series = (match.group("series") or "").lower()
+                segments = segments_by_series[(stem, series)]
+            image = SourceImage(name, segments=list(segments))
+            self.images[name] = image
+            images_by_stem.setdefault(stem, []).append(image)
+            claimed.update(segments)
+
+        for name in self.names:
+            if name in claimed:
+                continue
+            # longest stem that name extends with a dot
+            dot = len(name)
+            while True:
+                dot = name.rfind(".", 0, dot)
+                if dot <= 0:
+                    break
+                if name[:dot] in images_by_stem:
+                    for image in images_by_stem[name[:dot]]:
+                        image.sidecars.append(name)
+                    break
+
+    def segment_paths(self, filename):
+        """Return sorted paths of the content of image filename."""
+        return [
+            os.path.join(self.source_dir, name)
+            for name in self.images[filename].segments
+        ]
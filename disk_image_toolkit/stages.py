@@ -0,0 +1,398 @@
+"""Pipeline stages shared by diskimageprocessor.py and diskimageanalyzer.py.
+
+Both front ends stage each disk image, convert it to raw (or mount a raw
+view) and run disktype, and carve files from its volumes before their own
+stages (Brunnhilde scans, packaging or reports) take over. The state of
+each disk image is kept on a DiskImageJob, and each stage has a resume
+partner that restores that state from the journal of an earlier run.
+
+Helpers for the front ends' main functions set up result caches for disk
+images that may be identical, report identical images and clean up after
+a run.
+"""
+import functools
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+from disk_image_toolkit.cache import ResultCache, images_sharing_size
+from disk_image_toolkit.disk_image import DiskImage, unmount_raw_view
+from disk_image_toolkit.pipeline import Stage
+from disk_image_toolkit.source_index import SourceIndex
+from disk_image_toolkit.staging import DigestSidecar, stage_file
+
+
+RAW_VIEW_DIRNAME = "ewf"
+
+# Stages that mostly read and write whole files use at most this many
+# workers, so they do not saturate the disks
+MAX_IO_WORKERS = 2
+
+
+class DiskImageJob:
+    """State of a single disk image moving through a pipeline.
+
+    :param file: Filename of the disk image in source (str)
+    :param source: Directory holding the disk image (str)
+    :param root_dir: Directory of the output for the disk image (e.g. its
+        SIP), which is emptied when staging starts over (str)
+    :param diskimage_dir: Directory the disk image and its sidecars are
+        staged to (str)
+    :param files_dir: Directory files are carved to (str)
+    :param dfxml_dir: Directory disktype output and DFXML are written to
+        (str)
+    :param state_dir: Directory outside the output keeping volumes parsed
+        from disktype output and digests computed while staging (str)
+    :param cache: Result cache for identical disk images (ResultCache)
+    :param source_image: Files of the disk image in source, if already
+        indexed (SourceImage)
+    """
+
+    def __init__(
+        self,
+        file,
+        source,
+        root_dir,
+        diskimage_dir,
+        files_dir,
+        dfxml_dir,
+        state_dir,
+        cache=None,
+        source_image=None,
+    ):
+        self.file = file
+        self.image_id = os.path.splitext(file)[0]
+        self.source = source
+        # disk image segments and sidecars to stage
+        if source_image is None:
+            source_image = SourceIndex(source).images[file]
+        self.source_image = source_image
+
+        self.root_dir = root_dir
+        self.diskimage_dir = diskimage_dir
+        self.files_dir = files_dir
+        self.dfxml_dir = dfxml_dir
+        self.disktype_path = os.path.join(dfxml_dir, "disktype.txt")
+        self.scratch_dir = None
+        self.digests_path = os.path.join(state_dir, ".digests", "{}.json".format(file))
+
+        self.disk_image = DiskImage(
+            os.path.join(diskimage_dir, file),
+            cache=cache,
+            segments=[
+                os.path.join(diskimage_dir, name) for name in source_image.segments
+            ],
+        )
+        self.disk_image.volumes_sidecar_path = os.path.join(
+            state_dir, ".disktype", "{}.json".format(file)
+        )
+        self.volumes = []
+        self.files_carved = False
+
+    def __str__(self):
+        return self.file
+
+    def digest_sidecar(self):
+        """Return digests of files staged for this disk image (DigestSidecar)."""
+        return DigestSidecar(self.digests_path, self.root_dir)
+
+
+def copy_disk_image(job, algorithms=(), hardlink=False):
+    """Stage disk image and its sidecars.
+
+    Files are hashed while staging with algorithms, for checksum manifests
+    written later, and digests are recorded in the job's digest sidecar.
+    If the disk image has a result cache, the SHA-256 of its content (all
+    segments, in order), the cache key, is computed in the same read.
+    Hashing rules out kernel-side copies, so files that are not cloned,
+    linked or copied sparse are then copied in userspace.
+
+    :param algorithms: hashlib algorithm names (list)
+    :param hardlink: Whether files may be hard linked (bool)
+    """
+    logger = logging.getLogger()
+
+    # start clean in case an earlier run was interrupted
+    for directory in (job.root_dir, job.diskimage_dir):
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+    for directory in (job.root_dir, job.diskimage_dir, job.dfxml_dir):
+        os.makedirs(directory, exist_ok=True)
+
+    algorithms = list(dict.fromkeys(algorithms))
+    sidecar = job.digest_sidecar()
+    image_hash = None
+    if job.disk_image.cache is not None and job.disk_image.digest is None:
+        image_hash = hashlib.sha256()
+
+    # raw images are copied sparse, as their unused space is mostly zeros
+    staged_files = []
+    for file_ in job.source_image.files:
+        staged_path = os.path.join(job.diskimage_dir, file_)
+        is_segment = file_ in job.source_image.segments
+        try:
+            hashes = {name: hashlib.new(name) for name in algorithms}
+            method = stage_file(
+                os.path.join(job.source, file_),
+                staged_path,
+                allow_hardlink=hardlink,
+                hashes=list(hashes.values())
+                + ([image_hash] if image_hash and is_segment else []),
+                sparse=not job.disk_image.is_ewf,
+            )
+            logger.info("Staged {} by {}".format(file_, method))
+            if hashes:
+                sidecar.record(
+                    staged_path,
+                    {name: hash_.hexdigest() for name, hash_ in hashes.items()},
+                )
+            staged_files.append(staged_path)
+        except Exception:
+            logger.error(
+                "ERROR: File {} not successfully copied to {}".format(
+                    file_, job.diskimage_dir
+                )
+            )
+            if is_segment:
+                image_hash = None
+
+    artifacts = staged_files
+    if algorithms:
+        sidecar.save()
+        artifacts = staged_files + [job.digests_path]
+
+    if image_hash:
+        job.disk_image.digest = image_hash.hexdigest()
+
+    return {"artifacts": artifacts, "data": {"digest": job.disk_image.digest}}
+
+
+def resume_copy_disk_image(job, data):
+    """Restore the content digest computed while staging in an earlier run."""
+    if job.disk_image.cache is not None and data and data.get("digest"):
+        job.disk_image.digest = data["digest"]
+
+
+def convert_disk_image(job, scratch_root, no_conversion=False, probe=True):
+    """Convert EWF disk images to raw (or mount a raw view) and run disktype.
+
+    :param scratch_root: Directory to create the job's scratch directory
+        in, so that concurrent workers never share a raw image path (str)
+    :param no_conversion: Whether to mount a raw view of EWF images
+        instead of converting them (bool)
+    :param probe: Whether to try the Python probe before disktype (bool)
+    """
+    job.scratch_dir = tempfile.mkdtemp(prefix=".scratch-", dir=scratch_root)
+    if no_conversion:
+        raw_disk_image = job.disk_image.mount_raw_view(
+            os.path.join(job.scratch_dir, RAW_VIEW_DIRNAME)
+        )
+    else:
+        raw_disk_image = job.disk_image.convert_to_raw(
+            os.path.join(job.scratch_dir, "{}.raw".format(job.image_id))
+        )
+    job.disk_image.run_disktype(job.disktype_path, probe=probe)
+
+    return {
+        "artifacts": [raw_disk_image, job.disktype_path],
+        "data": {
+            "raw_disk_image": raw_disk_image,
+            "raw_view_mount": job.disk_image.raw_view_mount,
+            "scratch_dir": job.scratch_dir,
+        },
+    }
+
+
+def resume_convert_disk_image(job, data):
+    """Restore raw image path and disktype output from an earlier run."""
+    job.scratch_dir = data["scratch_dir"]
+    job.disk_image.raw_disk_image = data["raw_disk_image"]
+    job.disk_image.raw_view_mount = data.get("raw_view_mount")
+    job.disk_image.load_disktype(job.disktype_path)
+
+
+def carve_disk_image(job, export_unallocated=False, appledouble_resforks=False):
+    """Carve files from all volumes and write DFXML.
+
+    :param export_unallocated: Whether to carve unallocated files too (bool)
+    :param appledouble_resforks: Whether to carve AppleDouble resource
+        forks from HFS volumes (bool)
+    """
+    logger = logging.getLogger()
+
+    # discard partial output from an interrupted run
+    if os.path.isdir(job.files_dir):
+        shutil.rmtree(job.files_dir)
+    os.makedirs(job.files_dir)
+    for filename in os.listdir(job.dfxml_dir):
+        if filename.startswith("dfxml"):
+            os.remove(os.path.join(job.dfxml_dir, filename))
+
+    try:
+        job.volumes = job.disk_image.carve_files_from_all_volumes(
+            destination_path=job.files_dir,
+            export_unallocated=export_unallocated,
+            appledouble_resforks=appledouble_resforks,
+            dfxml_directory=job.dfxml_dir,
+        )
+    finally:
+        job.disk_image.close_raw_view()
+        if job.scratch_dir:
+            shutil.rmtree(job.scratch_dir, ignore_errors=True)
+
+    job.files_carved = bool(os.listdir(job.files_dir))
+    if not job.files_carved:
+        logger.error("No files carved from disk image {} - skipping".format(job))
+
+    dfxml_files = [
+        os.path.join(job.dfxml_dir, filename)
+        for filename in os.listdir(job.dfxml_dir)
+        if filename.startswith("dfxml")
+    ]
+    return {
+        "artifacts": [job.files_dir] + dfxml_files,
+        "data": {"volumes": job.volumes, "files_carved": job.files_carved},
+    }
+
+
+def resume_carve_disk_image(job, data):
+    """Restore volumes found by an earlier run."""
+    job.volumes = data["volumes"]
+    job.files_carved = data["files_carved"]
+
+
+def disk_image_stages(args, scratch_root, algorithms=()):
+    """Return the copy, convert and carve stages, with their resume partners.
+
+    :param args: Options common to the front ends: jobs, hardlink,
+        no_conversion, always_disktype, exportall and resforks
+        (argparse.Namespace)
+    :param scratch_root: Directory scratch directories are created in (str)
+    :param algorithms: hashlib algorithm names to hash staged files with
+        (list)
+
+    :returns: Stages (list of Stage)
+    """
+    return [
+        Stage(
+            "copy",
+            functools.partial(
+                copy_disk_image, algorithms=algorithms, hardlink=args.hardlink
+            ),
+            workers=min(args.jobs, MAX_IO_WORKERS),
+            resume=resume_copy_disk_image,
+        ),
+        Stage(
+            "convert",
+            functools.partial(
+                convert_disk_image,
+                scratch_root=scratch_root,
+                no_conversion=args.no_conversion,
+                probe=not args.always_disktype,
+            ),
+            workers=args.jobs,
+            resume=resume_convert_disk_image,
+        ),
+        Stage(
+            "carve",
+            functools.partial(
+                carve_disk_image,
+                export_unallocated=args.exportall,
+                appledouble_resforks=args.resforks,
+            ),
+            workers=args.jobs,
+            resume=resume_carve_disk_image,
+        ),
+    ]
+
+
+def image_workers(args):
+    """Return number of threads each disk image may use.
+
+    The --threads budget is split between the --jobs disk images in each
+    stage, for carving volumes, hashing files and restoring dates.
+
+    :param args: Options with threads and jobs (argparse.Namespace)
+    """
+    return max(1, args.threads // args.jobs)
+
+
+def share_results(jobs, source_index, cache, scratch_root):
+    """Give disk images that may be identical to another a result cache.
+
+    Only disk images the same size as another can be identical. They are
+    hashed while staging and, without a cache directory, share results
+    through a cache local to this run: the first of them to be carved
+    stores results that identical images wait for.
+
+    :param jobs: Jobs of the run (list of DiskImageJob)
+    :param source_index: Index of the source directory (SourceIndex)
+    :param cache: Result cache from the command line, or None (ResultCache)
+    :param scratch_root: Directory to create a cache local to the run in
+        (str)
+
+    :returns: Cache of the disk images that may be identical: cache, or a
+        cache local to the run to remove once it is done (ResultCache)
+    """
+    candidates = set(
+        images_sharing_size(
+            {job.file: source_index.segment_paths(job.file) for job in jobs}
+        )
+    )
+    run_cache = cache
+    if candidates and cache is None:
+        run_cache = ResultCache(os.path.join(scratch_root, ".cache"), max_size=None)
+
+    for job in jobs:
+        if job.file in candidates:
+            job.disk_image.cache = run_cache
+    return run_cache
+
+
+def report_identical_images(jobs):
+    """Log disk images found identical by the digests computed while staging."""
+    identical = {}
+    for job in jobs:
+        if job.disk_image.digest:
+            identical.setdefault(job.disk_image.digest, []).append(job.file)
+    for files in identical.values():
+        if len(files) > 1:
+            logging.getLogger().warning(
+                "Identical disk images found: {}".format(", ".join(files))
+            )
+
+
+def remove_scratch_dirs(scratch_root):
+    """Remove scratch directories left behind by interrupted runs."""
+    for filename in os.listdir(scratch_root):
+        if filename.startswith(".scratch-"):
+            scratch_dir = os.path.join(scratch_root, filename)
+            raw_view_mount = os.path.join(scratch_dir, RAW_VIEW_DIRNAME)
+            if os.path.ismount(raw_view_mount):
+                unmount_raw_view(raw_view_mount)
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def cache_dfxml_stats(jobs, dfxml_stats, dfxml_path):
+    """Store statistics of each disk's DFXML with its cached results.
+
+    :param jobs: Jobs of the run (list of DiskImageJob)
+    :param dfxml_stats: Dict of DFXML path to statistics (dict)
+    :param dfxml_path: Callable returning the path of a job's disk DFXML
+        (callable)
+    """
+    for job in jobs:
+        dfxml_info = dfxml_stats.get(dfxml_path(job))
+        # dates fall back to the current year if the DFXML has none; do not
+        # cache statistics that would go stale
+        if (
+            job.disk_image.cache is not None
+            and job.disk_image.digest
+            and dfxml_info
+            and len(dfxml_info["date_earliest"]) > 4
+        ):
+            job.disk_image.cache.update_stats(
+                job.disk_image.digest, {"dfxml.xml": dfxml_info}
+            )
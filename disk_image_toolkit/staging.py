@@ -0,0 +1,358 @@
+"""Stage disk images into SIPs and working directories.
+
+Disk images can be many gigabytes, so staging tries the cheapest method
+the file system offers before falling back to copying bytes in Python:
+
+1. reflink clone (copy-on-write, e.g. on Btrfs or XFS)
+2. hard link, only when allowed by the caller
+3. sparse copy, only when asked for by the caller
+4. kernel-side copy with copy_file_range or sendfile
+5. userspace copy
+
+Sparse copies skip the holes of the source file (found with SEEK_DATA and
+SEEK_HOLE) and leave holes in place of all-zero blocks, so mostly empty
+disk images take up only the space of their data.
+
+When digests of the staged files are needed, they are computed while the
+bytes are copied (or, for clones and links, in a single read) and can be
+recorded in a DigestSidecar so later steps do not read the files again.
+Kernel-side copies never pass the bytes through Python, so they are only
+used when no digests are asked for; a file that is not cloned or linked
+is then copied in userspace and hashed as it goes.
+"""
+import errno
+import json
+import os
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+
+REFLINK = "reflink"
+HARDLINK = "hardlink"
+SPARSE = "sparse"
+COPY_FILE_RANGE = "copy_file_range"
+SENDFILE = "sendfile"
+COPY = "copy"
+
+# ioctl request number of FICLONE from linux/fs.h
+FICLONE = 0x40049409
+
+KERNEL_CHUNK_SIZE = 1024**3
+COPY_CHUNK_SIZE = 4 * 1024**2
+
+# Granularity at which zeros are left as holes in sparse copies.
+SPARSE_BLOCK_SIZE = 64 * 1024
+_ZERO_BLOCK = bytes(SPARSE_BLOCK_SIZE)
+_ZERO_CHUNK = bytes(COPY_CHUNK_SIZE)
+
+
+def _reflink(fsrc, fdst):
+    """Clone fsrc into fdst. Return False if not supported."""
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        return False
+    return True
+
+
+def _kernel_copy(copy_chunk, size):
+    """Copy size bytes calling copy_chunk(offset, count) until done.
+
+    Return False if the first call fails, in which case nothing has been
+    copied. Errors after the first chunk are raised.
+    """
+    offset = 0
+    while offset < size:
+        try:
+            copied = copy_chunk(offset, min(KERNEL_CHUNK_SIZE, size - offset))
+        except OSError as err:
+            if offset == 0 and err.errno in (
+                errno.EXDEV,
+                errno.ENOSYS,
+                errno.EINVAL,
+                errno.EOPNOTSUPP,
+                errno.EBADF,
+            ):
+                return False
+            raise
+        if copied == 0:
+            if offset == 0:
+                return False
+            raise OSError(
+                errno.EIO, f"Unexpected end of file after {offset} of {size} bytes"
+            )
+        offset += copied
+    return True
+
+
+def _copy_file_range(fsrc, fdst, size):
+    if not hasattr(os, "copy_file_range"):
+        return False
+    src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+    return _kernel_copy(
+        lambda offset, count: os.copy_file_range(src_fd, dst_fd, count, offset, offset),
+        size,
+    )
+
+
+def _sendfile(fsrc, fdst, size):
+    if not hasattr(os, "sendfile"):
+        return False
+    src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+    return _kernel_copy(
+        lambda offset, count: os.sendfile(dst_fd, src_fd, offset, count), size
+    )
+
+
+def _copy_and_hash(fsrc, fdst, hashes):
+    """Copy fsrc to fdst (if given), updating hashes with every chunk."""
+    buffer = bytearray(COPY_CHUNK_SIZE)
+    view = memoryview(buffer)
+    while True:
+        length = fsrc.readinto(buffer)
+        if not length:
+            break
+        chunk = view[:length]
+        if fdst is not None:
+            fdst.write(chunk)
+        for hash_ in hashes:
+            hash_.update(chunk)
+
+
+def _write_sparse_chunk(fdst, buffer, length):
+    """Write buffer[:length] to fdst, seeking over all-zero blocks."""
+    view = memoryview(buffer)
+    data_start = 0
+    for offset in range(0, length, SPARSE_BLOCK_SIZE):
+        end = min(offset + SPARSE_BLOCK_SIZE, length)
+        # Comparing bytearray slices uses memcmp; memoryviews compare
+        # item by item.
+        if buffer[offset:end] != _ZERO_BLOCK[: end - offset]:
+            continue
+        if data_start < offset:
+            fdst.write(view[data_start:offset])
+        fdst.seek(end - offset, os.SEEK_CUR)
+        data_start = end
+    if data_start < length:
+        fdst.write(view[data_start:length])
+
+
+def write_sparse(fsrc, fdst, length=None, hashes=None):
+    """Copy from fsrc to fdst, leaving holes in place of all-zero blocks.
+
+    Both files are read and written from their current positions. fsrc may
+    be a pipe. Zeros at the end are not written, so the caller must
+    truncate fdst to its final size.
+
+    :param fsrc: Binary file object to read from
+    :param fdst: Binary file object to write to
+    :param length: Number of bytes to copy, or None to copy to end of
+        file (int)
+    :param hashes: Optional hashlib objects to update with the content
+        (iterable)
+
+    :returns: Number of bytes copied (int)
+    """
+    hashes = list(hashes or ())
+    buffer = bytearray(COPY_CHUNK_SIZE)
+    view = memoryview(buffer)
+    copied = 0
+    while length is None or copied < length:
+        count = COPY_CHUNK_SIZE
+        if length is not None:
+            count = min(count, length - copied)
+        read = fsrc.readinto(view[:count])
+        if not read:
+            break
+        for hash_ in hashes:
+            hash_.update(view[:read])
+        if buffer[:read] == _ZERO_CHUNK[:read]:
+            fdst.seek(read, os.SEEK_CUR)
+        else:
+            _write_sparse_chunk(fdst, buffer, read)
+        copied += read
+    return copied
+
+
+def _data_segments(fd, size):
+    """Yield (start, end) of each data segment of fd.
+
+    The whole file is one segment if the file system does not report holes.
+    """
+    if not hasattr(os, "SEEK_DATA"):
+        yield 0, size
+        return
+
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as err:
+            if err.errno == errno.ENXIO:
+                # only a hole remains
+                return
+            if offset == 0 and err.errno == errno.EINVAL:
+                yield 0, size
+                return
+            raise
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        yield start, end
+        offset = end
+
+
+def _hash_zeros(hashes, count):
+    view = memoryview(_ZERO_CHUNK)
+    while count > 0:
+        for hash_ in hashes:
+            hash_.update(view[:count])
+        count -= COPY_CHUNK_SIZE
+
+
+def _copy_sparse(fsrc, fdst, size, hashes):
+    """Copy fsrc to fdst, keeping existing holes and making new ones."""
+    position = 0
+    for start, end in _data_segments(fsrc.fileno(), size):
+        if hashes:
+            _hash_zeros(hashes, start - position)
+        fsrc.seek(start)
+        fdst.seek(start)
+        position = start + write_sparse(fsrc, fdst, end - start, hashes)
+    if hashes:
+        _hash_zeros(hashes, size - position)
+    fdst.truncate(size)
+
+
+def stage_file(src, dst, allow_hardlink=False, hashes=None, sparse=False):
+    """Copy src to dst with the cheapest available method.
+
+    :param src: Path to source file (str)
+    :param dst: Path to destination file. Overwritten if it exists (str)
+    :param allow_hardlink: Flag of whether dst may be a hard link to src.
+        Only set this if neither file will be modified in place (bool)
+    :param hashes: Optional hashlib objects to update with the file
+        content. If given, copy_file_range and sendfile are not used: a
+        file that cannot be cloned or linked is copied in userspace and
+        hashed as it goes, so it is read once rather than copied by the
+        kernel and read again to hash it (iterable)
+    :param sparse: Flag of whether to make a sparse copy rather than a
+        kernel-side or plain copy (bool)
+
+    :returns: Name of the method used: "reflink", "hardlink", "sparse",
+        "copy_file_range", "sendfile" or "copy" (str)
+    """
+    hashes = list(hashes or ())
+
+    with open(src, "rb") as fsrc:
+        size = os.fstat(fsrc.fileno()).st_size
+
+        with open(dst, "wb") as fdst:
+            if _reflink(fsrc, fdst):
+                _copy_and_hash(fsrc, None, hashes)
+                return REFLINK
+
+        if allow_hardlink:
+            os.remove(dst)
+            try:
+                os.link(src, dst)
+                _copy_and_hash(fsrc, None, hashes)
+                return HARDLINK
+            except OSError:
+                pass
+
+        with open(dst, "wb") as fdst:
+            if sparse:
+                _copy_sparse(fsrc, fdst, size, hashes)
+                return SPARSE
+
+            if not hashes:
+                if _copy_file_range(fsrc, fdst, size):
+                    return COPY_FILE_RANGE
+                if _sendfile(fsrc, fdst, size):
+                    return SENDFILE
+
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            _copy_and_hash(fsrc, fdst, hashes)
+            return COPY
+
+
+class DigestSidecar:
+    """Digests of staged files, kept in a JSON file outside the package.
+
+    Digests are recorded with the size and modification time of the file
+    and are only returned while both still match, so a file changed after
+    staging is hashed again.
+
+    :param path: Path to sidecar JSON file (str)
+    :param base_dir: Directory file paths are recorded relative to, e.g.
+        the SIP directory (str)
+    """
+
+    def __init__(self, path, base_dir):
+        self.path = os.path.abspath(path)
+        self.base_dir = os.path.abspath(base_dir)
+        self._entries = {}
+        try:
+            with open(self.path, "r") as sidecar_file:
+                self._entries = json.load(sidecar_file)
+        except (OSError, ValueError):
+            pass
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), self.base_dir)
+
+    def record(self, path, digests):
+        """Record digests (dict of algorithm to hex digest) for path."""
+        stat_result = os.stat(path)
+        entry = {"size": stat_result.st_size, "mtime_ns": stat_result.st_mtime_ns}
+        entry.update(digests)
+        self._entries[self._key(path)] = entry
+
+    def get(self, path, algorithm):
+        """Return recorded hex digest of path, or None if unknown or stale."""
+        entry = self._entries.get(self._key(path))
+        if not entry or algorithm not in entry:
+            return None
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        if (stat_result.st_size, stat_result.st_mtime_ns) != (
+            entry["size"],
+            entry["mtime_ns"],
+        ):
+            return None
+        return entry[algorithm]
+
+    def known_digests(self):
+        """Return current digests as a dict of absolute path to entry.
+
+        Entries for files that are missing or have changed are left out.
+        """
+        known_digests = {}
+        for key, entry in self._entries.items():
+            path = os.path.join(self.base_dir, key)
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                continue
+            if (stat_result.st_size, stat_result.st_mtime_ns) == (
+                entry["size"],
+                entry["mtime_ns"],
+            ):
+                known_digests[path] = entry
+        return known_digests
+
+    def save(self):
+        """Write sidecar to disk."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as sidecar_file:
+            json.dump(self._entries, sidecar_file, indent=1)
+        os.replace(temp_path, self.path)
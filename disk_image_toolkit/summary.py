@@ -0,0 +1,354 @@
+"""Summary statistics of DFXML for description spreadsheets.
+
+scan_dfxml streams a DFXML file through expat and keeps only what the
+description and analysis spreadsheets use: the number and total size of
+regular files and the earliest and latest of each kind of timestamp. No
+FileObjects are built and no lists of dates are kept, so large fiwalk
+output is summarized in constant memory.
+
+Summaries can be saved to a JSON sidecar, kept outside the SIP, and
+loaded again while the DFXML file is unchanged.
+"""
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import typing
+import xml.parsers.expat
+
+from disk_image_toolkit.exception import DFXMLError
+
+
+TIMESTAMP_KINDS = ("mtime", "ctime", "crtime")
+
+# Direct children of <fileobject> read by the scanner
+_FILE_FIELDS = frozenset(
+    ("name_type", "filesize", "alloc", "unalloc") + TIMESTAMP_KINDS
+)
+
+READ_SIZE = 1024**2
+
+SIDECAR_VERSION = 1
+
+
+def timestamp_to_int(value):
+    """Convert DFXML timestamp to unix integer, or None if unparsable.
+
+    Timestamps without a UTC offset are taken to be UTC. Fractional
+    seconds are ignored, as fromisoformat before Python 3.11 only accepts
+    3 or 6 digits.
+
+    :param value: ISO 8601 timestamp, e.g. 2023-02-05T21:00:46Z (str)
+    """
+    offset = value[19:]
+    if offset.startswith("."):
+        offset = offset[1:].lstrip("0123456789")
+    if offset == "Z":
+        offset = "+00:00"
+    try:
+        datetime_obj = datetime.fromisoformat(value[:19] + offset)
+    except ValueError:
+        return None
+    if datetime_obj.tzinfo is None:
+        datetime_obj = datetime_obj.replace(tzinfo=timezone.utc)
+    return int(datetime_obj.timestamp())
+
+
+@dataclass
+class DFXMLSummary:
+    """Counts, sizes and date ranges of regular files in DFXML.
+
+    Timestamps are kept as (unix integer, DFXML value) so they are compared
+    as instants while dates are still reported as written in DFXML.
+
+    :param files: Number of regular files counted (int)
+    :param bytes: Total size of files counted (int)
+    :param unallocated: Number of unallocated regular files, whether
+        counted or not (int)
+    :param earliest: Earliest timestamp by kind (dict)
+    :param latest: Latest timestamp by kind (dict)
+    """
+
+    files: int = 0
+    bytes: int = 0
+    unallocated: int = 0
+    earliest: typing.Dict[str, typing.Tuple[int, str]] = field(default_factory=dict)
+    latest: typing.Dict[str, typing.Tuple[int, str]] = field(default_factory=dict)
+
+    def add_file(self, size, timestamps):
+        """Count a file.
+
+        Timestamps that cannot be parsed are ignored.
+
+        :param size: File size in bytes (int)
+        :param timestamps: Dict of timestamp kind to DFXML value (dict)
+        """
+        self.files += 1
+        self.bytes += size
+        for kind, value in timestamps.items():
+            epoch = timestamp_to_int(value)
+            if epoch is not None:
+                self._add_timestamp(kind, (epoch, value), (epoch, value))
+
+    def add_fileobject(self, fobj, export_all=False):
+        """Count a FileObject as scan_dfxml counts its DFXML.
+
+        :param fobj: File to count (objects.FileObject)
+        :param export_all: Whether unallocated files should be counted (bool)
+        """
+        # skip directories and links
+        if fobj.name_type and fobj.name_type != "r":
+            return
+
+        if fobj.unalloc:
+            self.unallocated += 1
+            # skip unallocated unless all files were exported
+            if not export_all:
+                return
+
+        timestamps = {}
+        for kind in TIMESTAMP_KINDS:
+            timestamp = getattr(fobj, kind)
+            if timestamp is not None and timestamp.time:
+                timestamps[kind] = str(timestamp)
+        self.add_file(fobj.filesize or 0, timestamps)
+
+    def merge(self, other):
+        """Add counts and date ranges of another summary to this one.
+
+        :param other: Summary of other files (DFXMLSummary)
+
+        :returns: This summary (DFXMLSummary)
+        """
+        self.files += other.files
+        self.bytes += other.bytes
+        self.unallocated += other.unallocated
+        for kind, earliest in other.earliest.items():
+            self._add_timestamp(kind, earliest, other.latest[kind])
+        return self
+
+    def _add_timestamp(self, kind, earliest, latest):
+        if kind not in self.earliest or earliest[0] < self.earliest[kind][0]:
+            self.earliest[kind] = earliest
+        if kind not in self.latest or latest[0] > self.latest[kind][0]:
+            self.latest[kind] = latest
+
+    def to_dict(self):
+        """Return summary as a JSON-serializable dict."""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, values):
+        """Return summary from a dict returned by to_dict.
+
+        :raises: KeyError, TypeError or ValueError if values are malformed
+        """
+        return cls(
+            files=values["files"],
+            bytes=values["bytes"],
+            unallocated=values["unallocated"],
+            earliest={k: tuple(v) for k, v in values["earliest"].items()},
+            latest={k: tuple(v) for k, v in values["latest"].items()},
+        )
+
+    def date_range(self, default):
+        """Return (earliest, latest) dates as YYYY-MM-DD strings.
+
+        Modification dates are used unless the change or creation dates
+        start earlier, in which case the set starting earliest is used.
+
+        :param default: Value for both dates if there are no modification
+            dates, e.g. the current year (str)
+        """
+        kind_to_use = "mtime" if "mtime" in self.earliest else None
+        for kind in ("ctime", "crtime"):
+            if kind not in self.earliest:
+                continue
+            if kind_to_use is None:
+                # the default is not a timestamp, compare it as text
+                earlier = self.earliest[kind][1] < default
+            else:
+                earlier = self.earliest[kind][0] < self.earliest[kind_to_use][0]
+            if earlier:
+                kind_to_use = kind
+
+        if kind_to_use is None:
+            return default[:10], default[:10]
+        return self.earliest[kind_to_use][1][:10], self.latest[kind_to_use][1][:10]
+
+
+class _Handler:
+    """expat handlers collecting the direct children of each fileobject."""
+
+    def __init__(self, summary, export_all):
+        self.summary = summary
+        self.export_all = export_all
+        self.depth = 0
+        self.file_depth = None
+        self.file_fields = None
+        self.field = None
+        self.text = []
+
+    def start_element(self, name, attrs):
+        self.depth += 1
+        local_name = name.rpartition(" ")[2]
+        if self.file_depth is None:
+            if local_name == "fileobject":
+                self.file_depth = self.depth
+                self.file_fields = {}
+        elif self.depth == self.file_depth + 1 and local_name in _FILE_FIELDS:
+            self.field = local_name
+            self.text = []
+
+    def end_element(self, name):
+        if self.field is not None:
+            self.file_fields[self.field] = "".join(self.text).strip()
+            # alloc and unalloc are opposites; the last one given wins
+            if self.field == "alloc":
+                self.file_fields["unalloc"] = self.file_fields.pop("alloc") == "0"
+            elif self.field == "unalloc":
+                self.file_fields["unalloc"] = self.file_fields["unalloc"] in (
+                    "1",
+                    "true",
+                )
+            self.field = None
+        elif self.depth == self.file_depth:
+            self._add_file(self.file_fields)
+            self.file_depth = None
+        self.depth -= 1
+
+    def character_data(self, data):
+        if self.field is not None:
+            self.text.append(data)
+
+    def _add_file(self, file_fields):
+        # skip directories and links
+        name_type = file_fields.get("name_type")
+        if name_type and name_type != "r":
+            return
+
+        if file_fields.get("unalloc"):
+            self.summary.unallocated += 1
+            # skip unallocated unless all files were exported
+            if not self.export_all:
+                return
+
+        self.summary.add_file(
+            int(file_fields.get("filesize") or 0),
+            {
+                kind: file_fields[kind]
+                for kind in TIMESTAMP_KINDS
+                if file_fields.get(kind)
+            },
+        )
+
+
+def scan_dfxml(dfxml_path, export_all=False):
+    """Return DFXMLSummary of regular files in DFXML.
+
+    :param dfxml_path: Path to DFXML file (str)
+    :param export_all: Whether unallocated files were exported and should
+        be counted (bool)
+
+    :returns: Summary (DFXMLSummary)
+    """
+    summary = DFXMLSummary()
+    handler = _Handler(summary, export_all)
+    parser = xml.parsers.expat.ParserCreate(namespace_separator=" ")
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start_element
+    parser.EndElementHandler = handler.end_element
+    parser.CharacterDataHandler = handler.character_data
+
+    try:
+        with open(dfxml_path, "rb") as dfxml_file:
+            while True:
+                data = dfxml_file.read(READ_SIZE)
+                parser.Parse(data, not data)
+                if not data:
+                    break
+    except (OSError, ValueError, xml.parsers.expat.ExpatError) as err:
+        raise DFXMLError("Unable to read DFXML file {}: {}".format(dfxml_path, err))
+
+    return summary
+
+
+def save_summary(sidecar_path, dfxml_path, summary, export_all=False):
+    """Write summary of dfxml_path to a JSON sidecar.
+
+    :param sidecar_path: Path to sidecar JSON file (str)
+    :param dfxml_path: Path to the DFXML file summarized (str)
+    :param summary: Summary of the DFXML file (DFXMLSummary)
+    :param export_all: Whether unallocated files were counted (bool)
+    """
+    stat_result = os.stat(dfxml_path)
+    sidecar = {
+        "version": SIDECAR_VERSION,
+        "dfxml_size": stat_result.st_size,
+        "dfxml_mtime_ns": stat_result.st_mtime_ns,
+        "export_all": export_all,
+        "summary": summary.to_dict(),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(sidecar_path)), exist_ok=True)
+    temp_path = sidecar_path + ".tmp"
+    with open(temp_path, "w") as sidecar_file:
+        json.dump(sidecar, sidecar_file, indent=1)
+    os.replace(temp_path, sidecar_path)
+
+
+def load_summary(sidecar_path, dfxml_path, export_all=False):
+    """Return summary saved by save_summary, or None.
+
+    None is returned if the sidecar is missing or unreadable, if the DFXML
+    file has changed since it was written or if it was written with a
+    different export_all.
+    """
+    try:
+        with open(sidecar_path, "r") as sidecar_file:
+            sidecar = json.load(sidecar_file)
+        stat_result = os.stat(dfxml_path)
+    except (OSError, ValueError):
+        return None
+
+    if (
+        sidecar.get("version") != SIDECAR_VERSION
+        or sidecar.get("export_all") != export_all
+        or (sidecar.get("dfxml_size"), sidecar.get("dfxml_mtime_ns"))
+        != (stat_result.st_size, stat_result.st_mtime_ns)
+    ):
+        return None
+
+    try:
+        return DFXMLSummary.from_dict(sidecar["summary"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def summarize_dfxml(dfxml_path, export_all=False, sidecar_path=None):
+    """Return DFXMLSummary of DFXML, from its sidecar while still valid.
+
+    The DFXML file is scanned if there is no valid sidecar, and the sidecar
+    is then written again.
+
+    :param dfxml_path: Path to DFXML file (str)
+    :param export_all: Whether unallocated files should be counted (bool)
+    :param sidecar_path: Path to sidecar JSON file, or None to always scan
+        (str)
+
+    :returns: Summary (DFXMLSummary)
+    """
+    if sidecar_path:
+        summary = load_summary(sidecar_path, dfxml_path, export_all)
+        if summary is not None:
+            return summary
+
+    summary = scan_dfxml(dfxml_path, export_all=export_all)
+    if sidecar_path:
+        try:
+            save_summary(sidecar_path, dfxml_path, summary, export_all)
+        except OSError as err:
+            logging.getLogger().warning(
+                "Unable to save DFXML statistics to {}: {}".format(sidecar_path, err)
+            )
+    return summary
@@ -0,0 +1,70 @@
+"""BagIt writer unit tests."""
+import hashlib
+import os
+
+import bagit
+
+from disk_image_toolkit import checksums
+from disk_image_toolkit.bag import make_bag
+
+
+def _make_sip(tmp_path):
+    sip_dir = tmp_path / "disk.dd"
+    (sip_dir / "objects" / "files" / "Docs").mkdir(parents=True)
+    (sip_dir / "objects" / "diskimage").mkdir()
+    (sip_dir / "metadata" / "submissionDocumentation").mkdir(parents=True)
+    (sip_dir / "objects" / "files" / "Docs" / "a%b.txt").write_bytes(b"hello\n")
+    (sip_dir / "objects" / "diskimage" / "disk.dd").write_bytes(b"disk image")
+    (sip_dir / "metadata" / "submissionDocumentation" / "disktype.txt").write_bytes(
+        b"FAT12 file system\n"
+    )
+    return sip_dir
+
+
+def test_make_bag_validates(tmp_path):
+    """Test bag is valid according to bagit-python."""
+    sip_dir = _make_sip(tmp_path)
+
+    tagmanifests = make_bag(str(sip_dir))
+
+    bag = bagit.Bag(str(sip_dir))
+    bag.validate()
+    assert bag.info["Payload-Oxum"] == "34.3"
+    assert sorted(bag.algorithms) == ["sha256", "sha512"]
+    assert tagmanifests == [
+        str(sip_dir / "tagmanifest-sha256.txt"),
+        str(sip_dir / "tagmanifest-sha512.txt"),
+    ]
+
+
+def test_make_bag_reuses_known_digests(mocker, tmp_path):
+    """Test digests known for pre-bag paths are reused after the move."""
+    sip_dir = _make_sip(tmp_path)
+    hash_file = mocker.spy(checksums, "hash_file")
+    known_digests = {
+        str(sip_dir / "objects" / "diskimage" / "disk.dd"): {
+            "size": 10,
+            "sha256": hashlib.sha256(b"disk image").hexdigest(),
+            "sha512": hashlib.sha512(b"disk image").hexdigest(),
+        }
+    }
+
+    make_bag(str(sip_dir), known_digests=known_digests)
+
+    # Only the two other payload files are read.
+    assert hash_file.call_count == 2
+    bagit.Bag(str(sip_dir)).validate()
+
+
+def test_make_bag_restarts_interrupted_bag(tmp_path):
+    """Test an interrupted bag is completed by bagging again."""
+    sip_dir = _make_sip(tmp_path)
+    os.makedirs(sip_dir / "data")
+    os.rename(sip_dir / "objects", sip_dir / "data" / "objects")
+    (sip_dir / "manifest-md5.txt").write_text("partial")
+
+    make_bag(str(sip_dir))
+
+    assert sorted(os.listdir(sip_dir / "data")) == ["metadata", "objects"]
+    assert not (sip_dir / "manifest-md5.txt").exists()
+    bagit.Bag(str(sip_dir)).validate()
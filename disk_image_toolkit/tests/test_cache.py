@@ -0,0 +1,196 @@
+"""Result cache unit tests."""
+import os
+import shutil
+import threading
+
+from disk_image_toolkit import DiskImage
+from disk_image_toolkit.cache import ResultCache, images_sharing_size
+
+TEST_FIXTURES_DIR = os.path.abspath(os.path.join(__file__, "../../../tests/fixtures"))
+
+DISK_IMAGE_FAT_12 = os.path.join(TEST_FIXTURES_DIR, "fat12", "practical.floppy.dd")
+DFXML_FIXTURE = os.path.join(TEST_FIXTURES_DIR, "dfxml", "fat12.xml")
+
+VOLUMES = [
+    {
+        "id": 1,
+        "name": "",
+        "formatted_name": "",
+        "file_system": "FAT12",
+        "output_directory_name": "volume-1-fat12",
+        "size": "1.390 MiB (1457664 bytes, 2847 sectors)",
+    }
+]
+
+
+def test_cache_put_and_get(tmp_path):
+    """Test cached results are returned with the new image path substituted."""
+    cache = ResultCache(tmp_path / "cache")
+    cache.put(
+        "abc",
+        b"--- /old/disk.dd\nBlock device, size 1.390 MiB\n",
+        VOLUMES,
+        [DFXML_FIXTURE],
+        image_path="/old/disk.dd",
+    )
+
+    entry = cache.get("abc", image_path="/new/disk.dd")
+
+    assert entry["disktype"].startswith(b"--- /new/disk.dd\n")
+    assert entry["volumes"] == VOLUMES
+    assert os.path.isfile(entry["dfxml_files"]["fat12.xml"])
+    assert entry["stats"] == {}
+    assert cache.get("missing") is None
+
+    cache.update_stats("abc", {"fat12.xml": {"files": 2}})
+    assert cache.get("abc")["stats"] == {"fat12.xml": {"files": 2}}
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    """Test entries are evicted oldest access first once over the size cap."""
+    cache = ResultCache(tmp_path / "cache", max_size=250)
+    for index, digest in enumerate(("first", "second")):
+        cache.put(digest, b"x" * 100, VOLUMES)
+        entry_path = os.path.join(cache.cache_dir, digest, "entry.json")
+        os.utime(entry_path, (index, index))
+
+    # Accessing the older entry makes the newer one least recently used.
+    assert cache.get("first") is not None
+    cache.put("third", b"x" * 100, VOLUMES)
+
+    assert cache.get("second") is None
+    assert cache.get("first") is not None
+    assert cache.get("third") is not None
+
+
+def test_images_sharing_size(tmp_path):
+    """Test only images the same total size as another are candidates."""
+    for name, content in (
+        ("a.dd", b"disk one"),
+        ("b.001", b"disk"),
+        ("b.002", b" two"),
+        ("c.img", b"other size"),
+    ):
+        (tmp_path / name).write_bytes(content)
+
+    candidates = images_sharing_size(
+        {
+            "c.img": [str(tmp_path / "c.img")],
+            "b.001": [str(tmp_path / "b.001"), str(tmp_path / "b.002")],
+            "a.dd": [str(tmp_path / "a.dd")],
+        }
+    )
+
+    assert candidates == ["a.dd", "b.001"]
+
+
+def test_disk_image_digest_covers_segments(tmp_path):
+    """Test the cache key is the digest of all segments given, in order."""
+    (tmp_path / "disk.001").write_bytes(b"disk")
+    (tmp_path / "disk.002").write_bytes(b" one")
+    (tmp_path / "disk.dd").write_bytes(b"disk one")
+    cache = ResultCache(tmp_path / "cache")
+
+    split = DiskImage(
+        str(tmp_path / "disk.001"),
+        cache=cache,
+        segments=[str(tmp_path / "disk.001"), str(tmp_path / "disk.002")],
+    )
+    whole = DiskImage(str(tmp_path / "disk.dd"), cache=cache)
+    split.cached_results()
+    whole.cached_results()
+
+    assert split.digest == whole.digest
+
+
+def test_cache_claim_waits_for_release(tmp_path):
+    """Test a second claim on a digest waits until the first is released."""
+    cache = ResultCache(tmp_path / "cache")
+    first = cache.claim("abc")
+    claimed = threading.Event()
+
+    def claim_again():
+        cache.claim("abc").release()
+        claimed.set()
+
+    thread = threading.Thread(target=claim_again)
+    thread.start()
+    assert not claimed.wait(0.2)
+    # other digests are not held up
+    cache.claim("def").release()
+
+    first.release()
+    thread.join(5)
+    assert claimed.is_set()
+
+
+def test_disk_image_reuses_cached_results(mocker, tmp_path):
+    """Test a cache hit skips disktype and fiwalk."""
+    cache = ResultCache(tmp_path / "cache")
+    disk_image = DiskImage(DISK_IMAGE_FAT_12, cache=cache)
+    disk_image.digest = "abc"
+    cached_dfxml = tmp_path / "cached" / "dfxml.xml"
+    cached_dfxml.parent.mkdir()
+    shutil.copyfile(DFXML_FIXTURE, cached_dfxml)
+    cache.put(
+        "abc",
+        b"--- /old/disk.dd\nFAT12 file system\n",
+        VOLUMES,
+        [str(cached_dfxml)],
+        image_path="/old/disk.dd",
+    )
+    call_subprocess = mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage._call_subprocess"
+    )
+    carve_files = mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage.carve_files", return_value=None
+    )
+
+    disk_image.run_disktype(output_file=None)
+    volumes = disk_image.carve_files_from_all_volumes(
+        destination_path=str(tmp_path / "files"), dfxml_directory=str(tmp_path)
+    )
+
+    call_subprocess.assert_not_called()
+    assert carve_files.call_count == 1
+    assert disk_image.disktype.startswith("--- {}\n".format(DISK_IMAGE_FAT_12).encode())
+    assert volumes == VOLUMES
+    assert disk_image.disk_dfxml_path == str(tmp_path / "dfxml.xml")
+    assert os.path.isfile(disk_image.disk_dfxml_path)
+
+
+def test_disk_image_waits_for_identical_image(mocker, tmp_path):
+    """Test an identical image being carved is waited for and reused."""
+    cache = ResultCache(tmp_path / "cache")
+    disk_image = DiskImage(DISK_IMAGE_FAT_12, cache=cache)
+    disk_image.digest = "abc"
+    disk_image.disktype = b"FAT12 file system\n"
+    call_subprocess = mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage._call_subprocess"
+    )
+    mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage.carve_files", return_value=None
+    )
+    first = cache.claim("abc")
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(
+            disk_image.carve_files_from_all_volumes(
+                destination_path=str(tmp_path / "files"),
+                dfxml_directory=str(tmp_path),
+            )
+        )
+    )
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive()
+
+    cached_dfxml = tmp_path / "cached" / "dfxml.xml"
+    cached_dfxml.parent.mkdir()
+    shutil.copyfile(DFXML_FIXTURE, cached_dfxml)
+    cache.put("abc", b"FAT12 file system\n", VOLUMES, [str(cached_dfxml)])
+    first.release()
+    thread.join(5)
+
+    call_subprocess.assert_not_called()
+    assert results == [VOLUMES]
@@ -0,0 +1,141 @@
+"""Checksum manifest unit tests."""
+import hashlib
+import os
+
+from disk_image_toolkit import checksums
+from disk_image_toolkit.checksums import digests_from_dfxml, write_checksum_manifests
+
+TEST_FIXTURES_DIR = os.path.abspath(os.path.join(__file__, "../../../tests/fixtures"))
+
+DFXML_FIXTURE = os.path.join(TEST_FIXTURES_DIR, "dfxml", "fat12.xml")
+
+PARTITIONED_DFXML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<dfxml xmlns="http://www.forensicswiki.org/wiki/Category:Digital_Forensics_XML" version="1.0">
+  <volume offset="512">
+    <partition_offset>512</partition_offset>
+    <fileobject>
+      <filename>a.txt</filename>
+      <name_type>r</name_type>
+      <filesize>10</filesize>
+      <alloc>1</alloc>
+      <hashdigest type="MD5">aaa</hashdigest>
+      <hashdigest type="sha224">ignored</hashdigest>
+    </fileobject>
+    <fileobject>
+      <filename>deleted.txt</filename>
+      <name_type>r</name_type>
+      <filesize>3</filesize>
+      <unalloc>1</unalloc>
+      <hashdigest type="md5">ddd</hashdigest>
+    </fileobject>
+    <fileobject>
+      <filename>docs</filename>
+      <name_type>d</name_type>
+      <filesize>4096</filesize>
+      <hashdigest type="md5">dir</hashdigest>
+    </fileobject>
+  </volume>
+  <volume offset="4096">
+    <partition_offset>4096</partition_offset>
+    <fileobject>
+      <filename>b.txt</filename>
+      <name_type>r</name_type>
+      <filesize>20</filesize>
+      <hashdigest type="md5">bbb</hashdigest>
+    </fileobject>
+  </volume>
+</dfxml>
+"""
+
+
+def _make_objects(tmp_path):
+    objects_dir = tmp_path / "objects"
+    (objects_dir / "files" / "Docs").mkdir(parents=True)
+    (objects_dir / "diskimage").mkdir()
+    (objects_dir / "files" / "Docs" / "a.txt").write_bytes(b"hello\n")
+    (objects_dir / "files" / "b.txt").write_bytes(b"world\n")
+    (objects_dir / "diskimage" / "disk.dd").write_bytes(b"disk image")
+    metadata_dir = tmp_path / "metadata"
+    metadata_dir.mkdir()
+    return objects_dir, metadata_dir
+
+
+def test_write_checksum_manifests(tmp_path):
+    """Test md5deep-format manifests are written for every algorithm."""
+    objects_dir, metadata_dir = _make_objects(tmp_path)
+    manifests = {
+        "md5": str(metadata_dir / "checksum.md5"),
+        "sha256": str(metadata_dir / "checksum.sha256"),
+    }
+
+    stats = write_checksum_manifests(
+        str(objects_dir), manifests, start=str(metadata_dir), workers=2
+    )
+
+    assert stats == {"files": 3, "hashed": 3, "reused": 0, "errors": 0}
+    assert (metadata_dir / "checksum.md5").read_text() == (
+        "{}  ../objects/diskimage/disk.dd\n"
+        "{}  ../objects/files/Docs/a.txt\n"
+        "{}  ../objects/files/b.txt\n"
+    ).format(
+        hashlib.md5(b"disk image").hexdigest(),
+        hashlib.md5(b"hello\n").hexdigest(),
+        hashlib.md5(b"world\n").hexdigest(),
+    )
+    assert (
+        (metadata_dir / "checksum.sha256")
+        .read_text()
+        .startswith(
+            "{}  ../objects/diskimage/disk.dd\n".format(
+                hashlib.sha256(b"disk image").hexdigest()
+            )
+        )
+    )
+
+
+def test_write_checksum_manifests_reuses_known_digests(mocker, tmp_path):
+    """Test known digests are used only when the file size matches."""
+    objects_dir, metadata_dir = _make_objects(tmp_path)
+    hash_file = mocker.spy(checksums, "hash_file")
+    known_digests = {
+        str(objects_dir / "diskimage" / "disk.dd"): {"size": 10, "md5": "known"},
+        str(objects_dir / "files" / "b.txt"): {"size": 999, "md5": "stale"},
+    }
+
+    stats = write_checksum_manifests(
+        str(objects_dir),
+        {"md5": str(metadata_dir / "checksum.md5")},
+        start=str(metadata_dir),
+        known_digests=known_digests,
+    )
+
+    assert stats["reused"] == 1
+    assert stats["hashed"] == 2
+    assert hash_file.call_count == 2
+    manifest = (metadata_dir / "checksum.md5").read_text()
+    assert "known  ../objects/diskimage/disk.dd\n" in manifest
+    assert "stale" not in manifest
+
+
+def test_digests_from_dfxml():
+    """Test digests and sizes are read for regular files in DFXML."""
+    known_digests = digests_from_dfxml(DFXML_FIXTURE, "/carved")
+
+    entry = known_digests["/carved/practical.floppy.dd"]
+    assert entry["size"] == 1474560
+    assert entry["md5"] == "2f4791784e2af37cf196e6a72cc79d99"
+    assert "/carved/." not in known_digests
+
+
+def test_digests_from_dfxml_volumes(tmp_path):
+    """Test only allocated regular files in the given volume are included."""
+    dfxml_path = tmp_path / "dfxml.xml"
+    dfxml_path.write_bytes(PARTITIONED_DFXML)
+
+    assert digests_from_dfxml(str(dfxml_path), "/carved") == {
+        "/carved/a.txt": {"md5": "aaa", "size": 10},
+        "/carved/b.txt": {"md5": "bbb", "size": 20},
+    }
+    assert list(digests_from_dfxml(str(dfxml_path), "/carved", offset=4096)) == [
+        "/carved/b.txt"
+    ]
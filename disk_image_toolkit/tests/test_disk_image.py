@@ -1,12 +1,16 @@
 """DiskImage class unit tests."""
+import hashlib
+import io
 import os
 import pytest
 import subprocess
+import threading
 
 from disk_image_toolkit.dfxml import objects
 
 from disk_image_toolkit import DiskImage
 from disk_image_toolkit.exception import DiskImageError
+from disk_image_toolkit.summary import DFXMLSummary, scan_dfxml
 
 TEST_FIXTURES_DIR = os.path.abspath(os.path.join(__file__, "../../../tests/fixtures"))
 
@@ -38,22 +42,27 @@ def test_call_subprocess_raises(mocker):
         disk_image._call_subprocess(["test-command"])
 
 
-def test_convert_to_raw_ewf(mocker):
-    """Test method calls to convert EWF disk image."""
+def test_convert_to_raw_ewf(mocker, tmp_path):
+    """Test EWF disk image is exported to a sparse raw image."""
     is_ewf = mocker.patch("disk_image_toolkit.disk_image.DiskImage.is_ewf")
     is_ewf.return_value = True
 
-    ewfexport = mocker.patch("disk_image_toolkit.disk_image.DiskImage._call_subprocess")
-    rename = mocker.patch("os.rename")
+    raw_content = b"boot" + bytes(1024**2) + b"data" + bytes(1024**2)
+    popen = mocker.patch("subprocess.Popen")
+    popen.return_value.stdout = io.BytesIO(raw_content)
+    popen.return_value.wait.return_value = 0
 
-    DESTINATION_PATH = "/path/to/practical.floppy.dd"
+    DESTINATION_PATH = str(tmp_path / "practical.floppy.dd")
     disk_image_path = os.path.join(TEST_FIXTURES_DIR, "fat12", "practical.floppy.ewf")
     disk_image = DiskImage(disk_image_path)
     return_value = disk_image.convert_to_raw(destination_path=DESTINATION_PATH)
 
-    assert ewfexport.call_count == 1
-    assert rename.call_count == 2
+    assert popen.call_count == 1
+    assert popen.call_args[0][0][:3] == ["ewfexport", "-t", "-"]
     assert return_value == DESTINATION_PATH
+    assert os.path.isfile(DESTINATION_PATH + ".info")
+    with open(DESTINATION_PATH, "rb") as raw_file:
+        assert raw_file.read() == raw_content
 
 
 def test_convert_to_raw_already_raw():
@@ -64,6 +73,67 @@ def test_convert_to_raw_already_raw():
     assert disk_image.raw_disk_image == DISK_IMAGE
 
 
+def test_mount_raw_view_ewf(mocker, tmp_path):
+    """Test EWF disk image is mounted with ewfmount instead of converted."""
+    ewfmount = mocker.patch("disk_image_toolkit.disk_image.DiskImage._call_subprocess")
+    unmount = mocker.patch("disk_image_toolkit.disk_image.unmount_raw_view")
+    mocker.patch("disk_image_toolkit.disk_image.tsk_supports_ewf", return_value=True)
+
+    mount_point = str(tmp_path / "ewf")
+    disk_image = DiskImage("path/to/image.E01")
+    return_value = disk_image.mount_raw_view(mount_point)
+
+    assert ewfmount.call_args[1]["command"] == [
+        "ewfmount",
+        disk_image.path,
+        mount_point,
+    ]
+    assert return_value == os.path.join(mount_point, "ewf1")
+    assert disk_image.raw_disk_image == return_value
+    assert disk_image.tsk_image_path == disk_image.path
+
+    disk_image.close_raw_view()
+
+    unmount.assert_called_once_with(mount_point)
+    assert disk_image.raw_disk_image is None
+    assert disk_image.raw_view_mount is None
+
+
+def test_mount_raw_view_already_raw(mocker):
+    """Test raw disk images are used as they are."""
+    call_subprocess = mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage._call_subprocess"
+    )
+
+    disk_image = DiskImage(DISK_IMAGE)
+    return_value = disk_image.mount_raw_view("path/to/mount")
+
+    call_subprocess.assert_not_called()
+    assert return_value == DISK_IMAGE
+    assert disk_image.tsk_image_path == DISK_IMAGE
+
+
+def test_udf_materializes_raw_view(mocker, tmp_path):
+    """Test a raw file is written before loop mounting a raw view."""
+    mocker.patch("disk_image_toolkit.disk_image.unmount_raw_view")
+    mocker.patch("disk_image_toolkit.disk_image.DiskImage.set_file_permissions")
+    mocker.patch("subprocess.call")
+    mocker.patch("shutil.copytree")
+    convert_raw = mocker.patch("disk_image_toolkit.disk_image.DiskImage.convert_to_raw")
+
+    mount_point = str(tmp_path / "ewf")
+    disk_image = DiskImage("path/to/image.E01")
+    disk_image.raw_view_mount = mount_point
+    disk_image.raw_disk_image = os.path.join(mount_point, "ewf1")
+
+    disk_image.mount_disk_image_and_copy_files(
+        destination_path=str(tmp_path / "files"), create_dfxml=False
+    )
+
+    convert_raw.assert_called_once_with(mount_point + ".raw")
+    assert disk_image.raw_view_mount is None
+
+
 def test_run_disktype(mocker, tmp_path):
     """Test method calls subprocess and returns as expected."""
     DISKTYPE_OUTPUT = b"fake disktype output\n"
@@ -71,6 +141,7 @@ def test_run_disktype(mocker, tmp_path):
         "disk_image_toolkit.disk_image.DiskImage._call_subprocess"
     )
     disktype_call.return_value = DISKTYPE_OUTPUT
+    mocker.patch("disk_image_toolkit.disk_image.probe_disk_image", return_value=None)
 
     tmp_output_file = tmp_path / "disktype.txt"
 
@@ -85,6 +156,38 @@ def test_run_disktype(mocker, tmp_path):
         disk_image.disktype == f.read()
 
 
+def test_carve_does_not_rerun_failed_disktype(mocker, tmp_path):
+    """Test disktype that gave no output is not run again with defaults."""
+    disktype_call = mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage._call_subprocess",
+        return_value=None,
+    )
+    probe = mocker.patch(
+        "disk_image_toolkit.disk_image.probe_disk_image", return_value=None
+    )
+
+    disk_image = DiskImage(DISK_IMAGE)
+    disk_image.run_disktype(str(tmp_path / "disktype.txt"), probe=False)
+    with pytest.raises(DiskImageError):
+        disk_image.carve_files_from_all_volumes(
+            destination_path=str(tmp_path / "files"), dfxml_directory=str(tmp_path)
+        )
+
+    assert disktype_call.call_count == 1
+    probe.assert_not_called()
+    assert not os.path.exists(tmp_path / "disktype.txt")
+    assert not os.path.exists(DiskImage.DEFAULT_DISKTYPE_TXT)
+
+    # a resumed run without disktype output does not run it either
+    disk_image = DiskImage(DISK_IMAGE)
+    disk_image.load_disktype(str(tmp_path / "disktype.txt"))
+    with pytest.raises(DiskImageError):
+        disk_image.carve_files_from_all_volumes(
+            destination_path=str(tmp_path / "files"), dfxml_directory=str(tmp_path)
+        )
+    assert disktype_call.call_count == 1
+
+
 @pytest.mark.parametrize(
     "disk_image_path, disktype_path, expected_volumes_return",
     [
@@ -99,6 +202,10 @@ def test_run_disktype(mocker, tmp_path):
                     "name": "ok_images + rome2",
                     "formatted_name": "ok_images__rome2",
                     "output_directory_name": "volume-1-hfs-ok_images__rome2",
+                    "partition": 4,
+                    "offset": 251392,
+                    "depth": 1,
+                    "length": 100392960,
                     "size": "95.74 MiB (100392960 bytes, 65360 blocks of 1536 bytes)",
                 }
             ],
@@ -114,6 +221,10 @@ def test_run_disktype(mocker, tmp_path):
                     "name": "ISO9660/HFS",
                     "formatted_name": "ISO9660HFS",
                     "output_directory_name": "volume-1-hfs-ISO9660HFS",
+                    "partition": None,
+                    "offset": None,
+                    "depth": 0,
+                    "length": 901120,
                     "size": "880 KiB (901120 bytes, 440 blocks of 2 KiB)",
                 },
                 {
@@ -122,6 +233,10 @@ def test_run_disktype(mocker, tmp_path):
                     "name": "ISO9660/HFS",
                     "formatted_name": "ISO9660HFS",
                     "output_directory_name": "volume-2-iso9660-ISO9660HFS",
+                    "partition": None,
+                    "offset": None,
+                    "length": 1210368,
+                    "depth": 0,
                 },
             ],
         ),
@@ -136,6 +251,10 @@ def test_run_disktype(mocker, tmp_path):
                     "name": "",
                     "formatted_name": "",
                     "output_directory_name": "volume-1-fat12",
+                    "partition": None,
+                    "offset": None,
+                    "depth": 0,
+                    "length": 1457664,
                     "size": "1.390 MiB (1457664 bytes, 2847 clusters of 512 bytes)",
                 }
             ],
@@ -148,7 +267,9 @@ def test_carve_files_from_all_volumes(
     """Confirm disktype.txt parses volumes as expected to carve files."""
     mocker.patch("os.makedirs")
     mocker.patch("disk_image_toolkit.disk_image.DiskImage.write_dfxml_with_fiwalk")
-    carve_files = mocker.patch("disk_image_toolkit.disk_image.DiskImage.carve_files")
+    carve_files = mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage.carve_files", return_value=None
+    )
 
     disk_image = DiskImage(disk_image_path)
     with open(disktype_path, "r") as disktype_file:
@@ -159,6 +280,142 @@ def test_carve_files_from_all_volumes(
     assert carve_files.call_count == len(expected_volumes_return)
 
 
+def test_carve_files_from_all_volumes_partitions(mocker):
+    """Test each partition is carved once, from its own offset."""
+    mocker.patch("os.makedirs")
+    mocker.patch("disk_image_toolkit.disk_image.DiskImage.write_dfxml_with_fiwalk")
+    carve_files = mocker.patch("disk_image_toolkit.disk_image.DiskImage.carve_files")
+
+    disk_image = DiskImage("two-partitions.dd")
+    disk_image.disktype = b"""
+--- two-partitions.dd
+Regular file, size 200 MiB (209715200 bytes)
+DOS/MBR partition map
+Partition 1: 100 MiB (104857600 bytes, 204800 sectors from 2048)
+  Type 0x07 (HPFS/NTFS)
+  NTFS file system
+    Volume size 100.0 MiB (104853504 bytes, 204792 sectors)
+Partition 2: 98.00 MiB (102760448 bytes, 200704 sectors from 206848)
+  Type 0x07 (HPFS/NTFS)
+  NTFS file system
+    Volume size 98.00 MiB (102756352 bytes, 200696 sectors)
+"""
+
+    volumes = disk_image.carve_files_from_all_volumes()
+
+    assert [(volume["offset"], volume["length"]) for volume in volumes] == [
+        (2048 * 512, 104853504),
+        (206848 * 512, 102756352),
+    ]
+    assert sorted(call[1]["offset"] for call in carve_files.call_args_list) == [
+        2048 * 512,
+        206848 * 512,
+    ]
+
+
+@pytest.mark.parametrize("workers, file_workers", [(1, 1), (4, 2), (5, 2)])
+def test_carve_files_from_all_volumes_shares_workers(mocker, workers, file_workers):
+    """Test volumes carved at once share the disk image's threads."""
+    mocker.patch("os.makedirs")
+    mocker.patch("disk_image_toolkit.disk_image.DiskImage.write_dfxml_with_fiwalk")
+    mocker.patch("disk_image_toolkit.disk_image.DiskImage.carve_files")
+    mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage.get_volumes_from_disktype",
+        return_value=[
+            {"file_system": "HFS", "output_directory_name": "volume-1"},
+            {"file_system": "UDF", "output_directory_name": "volume-2"},
+        ],
+    )
+
+    disk_image = DiskImage("cd.iso")
+    disk_image.disktype = b"--- cd.iso"
+    disk_image.workers = workers
+    disk_image.carve_files_from_all_volumes()
+
+    assert disk_image._file_workers == file_workers
+
+
+@pytest.mark.parametrize(
+    "volumes, has_stats",
+    [
+        # El Torito floppy image in a bootable CD, neither in a partition
+        ([("ISO9660", None), ("FAT12", None)], False),
+        ([("NTFS", 1048576), ("NTFS", 105906176)], True),
+        ([("HFS", None), ("ISO9660", None)], True),
+    ],
+)
+def test_carve_files_from_all_volumes_stats(mocker, volumes, has_stats):
+    """Test disk DFXML statistics are kept only if files map to one volume."""
+    mocker.patch("os.makedirs")
+    mocker.patch("disk_image_toolkit.disk_image.DiskImage.write_dfxml_with_fiwalk")
+    mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage.carve_files",
+        return_value=DFXMLSummary(files=1),
+    )
+    mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage.get_volumes_from_disktype",
+        return_value=[
+            {
+                "file_system": file_system,
+                "output_directory_name": "volume-{}".format(number),
+                "offset": offset,
+            }
+            for number, (file_system, offset) in enumerate(volumes, 1)
+        ],
+    )
+
+    disk_image = DiskImage("cd.iso")
+    disk_image.disktype = b"--- cd.iso"
+    volumes = disk_image.carve_files_from_all_volumes()
+
+    assert ["stats" in volume for volume in volumes] == [has_stats] * len(volumes)
+
+
+def test_carve_files_from_all_volumes_runs_fiwalk_alongside_tsk_recover(
+    mocker, tmp_path
+):
+    """Test tsk_recover starts before fiwalk ends, and dates wait for both."""
+    tsk_recover_started = threading.Event()
+    events = []
+
+    def call_subprocess(command, *args, **kwargs):
+        if command[0] == "fiwalk":
+            assert tsk_recover_started.wait(timeout=10)
+            events.append("fiwalk done")
+        elif command[0] == "tsk_recover":
+            tsk_recover_started.set()
+            events.append("tsk_recover done")
+
+    mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage._call_subprocess",
+        side_effect=call_subprocess,
+    )
+    mocker.patch("disk_image_toolkit.disk_image.DiskImage.set_file_permissions")
+
+    def restore_dates(*args):
+        events.append("dates restored")
+        return {"summary": DFXMLSummary(files=1)}
+
+    restore = mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage._restore_file_last_modified_dates",
+        side_effect=restore_dates,
+    )
+
+    disk_image = DiskImage(DISK_IMAGE)
+    disk_image.raw_disk_image = DISK_IMAGE
+    with open(os.path.join(TEST_FIXTURES_DIR, "fat12", "disktype.txt"), "rb") as f:
+        disk_image.disktype = f.read()
+    volumes = disk_image.carve_files_from_all_volumes(
+        destination_path=str(tmp_path / "files"), dfxml_directory=str(tmp_path)
+    )
+
+    assert events == ["tsk_recover done", "fiwalk done", "dates restored"]
+    assert volumes[0]["stats"] == DFXMLSummary(files=1).to_dict()
+    restore.assert_called_once_with(
+        str(tmp_path / "files" / "volume-1-fat12"), str(tmp_path / "dfxml.xml"), None
+    )
+
+
 @pytest.mark.parametrize(
     "file_system, tsk_call_count, hfs_call_count, mount_copy_call_count",
     [
@@ -269,6 +526,29 @@ def test_carve_files_with_tsk_recover(
     assert restore_dates.call_count == 1
 
 
+def test_carve_files_with_tsk_recover_offset(mocker):
+    """Test tsk_recover is given the partition offset in sectors."""
+    call_subprocess = mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage._call_subprocess"
+    )
+    mocker.patch("disk_image_toolkit.disk_image.DiskImage.set_file_permissions")
+    restore_dates = mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage._restore_file_last_modified_dates"
+    )
+
+    disk_image = DiskImage(DISK_IMAGE)
+    disk_image.raw_disk_image = DISK_IMAGE
+    disk_image.disk_dfxml_path = "dfxml.xml"
+
+    disk_image.carve_files_with_tsk_recover(offset=2048 * 512)
+
+    call_subprocess.assert_called_with(
+        ["tsk_recover", "-a", "-o", "2048", DISK_IMAGE, "carved_files"],
+        "tsk_recover could not carve files",
+    )
+    restore_dates.assert_called_with("carved_files", "dfxml.xml", 2048 * 512)
+
+
 @pytest.mark.parametrize(
     "raw_image, appledouble_resforks, create_dfxml",
     [
@@ -420,14 +700,49 @@ def test_restore_file_last_modified_dates(mocker):
     assert os_utime.call_count == 2
 
 
+def test_restore_file_last_modified_dates_counts(tmp_path):
+    """Test dates are set on carved files and other entries are counted."""
+    carved = tmp_path / "carved"
+    (carved / "dir").mkdir(parents=True)
+    (carved / "dir" / "a.txt").write_text("a")
+    (carved / "b.txt").write_text("b")
+    dfxml_path = tmp_path / "dfxml.xml"
+    dfxml_path.write_text(
+        """<?xml version="1.0"?>
+<dfxml version="1.1.1"
+ xmlns="http://www.forensicswiki.org/wiki/Category:Digital_Forensics_XML">
+<fileobject><filename>dir</filename><name_type>d</name_type></fileobject>
+<fileobject><filename>dir/a.txt</filename><name_type>r</name_type>
+<mtime>2001-02-03T04:05:06Z</mtime></fileobject>
+<fileobject><filename>b.txt</filename><name_type>r</name_type>
+<crtime>1999-12-31T23:59:59Z</crtime></fileobject>
+<fileobject><filename>deleted.txt</filename><name_type>r</name_type>
+<mtime>2001-02-03T04:05:06Z</mtime></fileobject>
+</dfxml>
+"""
+    )
+
+    disk_image = DiskImage("image.dd")
+    stats = disk_image._restore_file_last_modified_dates(str(carved), str(dfxml_path))
+
+    summary = stats.pop("summary")
+    assert stats == {"restored": 2, "skipped": 1, "missing": 1}
+    assert (summary.files, summary.earliest["mtime"][1]) == (3, "2001-02-03T04:05:06Z")
+    assert summary.date_range("N/A") == ("1999-12-31", "1999-12-31")
+    assert os.stat(carved / "dir" / "a.txt").st_mtime == 981173106
+    assert os.stat(carved / "b.txt").st_mtime == 946684799
+
+
 def test_write_dfxml_from_path(tmp_path):
     """Test DFXML creation from path."""
     dfxml_path = tmp_path / "dfxml.xml"
 
     disk_image = DiskImage("image.dd")
-    disk_image.write_dfxml_from_path(
+    summary = disk_image.write_dfxml_from_path(
         target_path=os.path.join(TEST_FIXTURES_DIR, "fat12"), dfxml_path=dfxml_path
     )
+    assert summary == scan_dfxml(dfxml_path)
+    assert summary.files == 2
 
     fixture_fileobjects = []
     dfxml_fileobjects = []
@@ -446,6 +761,110 @@ def test_write_dfxml_from_path(tmp_path):
     assert fixture_fileobjects == dfxml_fileobjects
 
 
+def test_write_dfxml_from_path_nested(tmp_path):
+    """Test DFXML lists nested paths in sorted order."""
+    for relpath in ("b", "a/y/z", "a b", "a/x"):
+        (tmp_path / "src" / relpath).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / "src" / relpath).write_text(relpath)
+    dfxml_path = tmp_path / "dfxml.xml"
+
+    DiskImage.write_dfxml_from_path(str(tmp_path / "src"), str(dfxml_path))
+
+    filenames = [
+        obj.filename
+        for _, obj in objects.iterparse(str(dfxml_path))
+        if isinstance(obj, objects.FileObject)
+    ]
+    assert filenames == [
+        ".",
+        "a",
+        "a b",
+        os.path.join("a", "x"),
+        os.path.join("a", "y"),
+        os.path.join("a", "y", "z"),
+        "b",
+    ]
+
+
+def test_write_dfxml_from_path_workers(tmp_path):
+    """Test DFXML is the same whether files are hashed on one or more threads."""
+    for index in range(20):
+        (tmp_path / "src" / str(index % 3)).mkdir(parents=True, exist_ok=True)
+        (tmp_path / "src" / str(index % 3) / f"{index}.bin").write_bytes(
+            os.urandom(1024 * index)
+        )
+
+    def _fileobjects(workers):
+        dfxml_path = str(tmp_path / f"dfxml_{workers}.xml")
+        DiskImage.write_dfxml_from_path(
+            str(tmp_path / "src"), dfxml_path, workers=workers
+        )
+        return [
+            (obj.filename, obj.sha256)
+            for _, obj in objects.iterparse(dfxml_path)
+            if isinstance(obj, objects.FileObject)
+        ]
+
+    assert _fileobjects(1) == _fileobjects(4)
+
+
+@pytest.mark.parametrize(
+    "hash_profile, parallel_hash_threshold, expected_hashes",
+    [
+        ("minimal", 2**26, {"md5"}),
+        ("archival", 2**26, {"md5", "sha256", "sha512"}),
+        ("archival", 0, {"md5", "sha256", "sha512"}),
+        ("all", 0, {"md5", "sha1", "sha224", "sha256", "sha384", "sha512"}),
+    ],
+)
+def test_write_dfxml_from_path_hash_profile(
+    mocker, tmp_path, hash_profile, parallel_hash_threshold, expected_hashes
+):
+    """Test DFXML records the digests of the hash profile."""
+    mocker.patch(
+        "disk_image_toolkit.dfxml.walk_to_dfxml.parallel_hash_threshold",
+        parallel_hash_threshold,
+    )
+    content = os.urandom(5 * 2**20)
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "file.bin").write_bytes(content)
+    dfxml_path = str(tmp_path / "dfxml.xml")
+
+    DiskImage.write_dfxml_from_path(
+        str(tmp_path / "src"), dfxml_path, hash_profile=hash_profile
+    )
+
+    fobj = [
+        obj
+        for _, obj in objects.iterparse(dfxml_path)
+        if isinstance(obj, objects.FileObject) and obj.filename == "file.bin"
+    ][0]
+    for algorithm in ("md5", "sha1", "sha224", "sha256", "sha384", "sha512"):
+        if algorithm in expected_hashes:
+            assert (
+                getattr(fobj, algorithm) == hashlib.new(algorithm, content).hexdigest()
+            )
+        else:
+            assert getattr(fobj, algorithm) is None
+
+
+def test_dfxml_writer_incomplete_on_error():
+    """Test streaming DFXML writer leaves out the foot if writing fails."""
+    output = io.StringIO()
+
+    with pytest.raises(RuntimeError):
+        with objects.DFXMLWriter(
+            objects.DFXMLObject(version="1.1.1"), output
+        ) as writer:
+            fobj = objects.FileObject()
+            fobj.filename = "a.txt"
+            writer.write_fileobject(fobj)
+            raise RuntimeError
+
+    assert "<filename>a.txt</filename>" in output.getvalue()
+    assert "</dfxml>" not in output.getvalue()
+
+
 @pytest.mark.parametrize(
     "extension, return_value",
     [
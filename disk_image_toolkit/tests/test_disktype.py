@@ -0,0 +1,92 @@
+"""disktype parser unit tests."""
+import os
+
+from disk_image_toolkit import DiskImage
+from disk_image_toolkit.disktype import (
+    DisktypeVolume,
+    load_volumes,
+    parse_disktype,
+    save_volumes,
+)
+
+DISKTYPE_EXTENDED = b"""
+--- disk.dd
+Regular file, size 4 GiB (4294967296 bytes)
+DOS/MBR partition map
+Partition 1: 1 GiB (1073741824 bytes, 2097152 sectors from 2048, bootable)
+  Type 0x0C (Win95 FAT32 LBA)
+  FAT32 file system (hints score 5 of 5)
+    Volume size 1023 MiB (1072693248 bytes, 261888 clusters of 4 KiB)
+    Volume name "BOOT"
+Partition 2: 2.999 GiB (3219128320 bytes, 6287360 sectors from 2099200)
+  Type 0x05 (Extended)
+  Partition 5: 2.999 GiB (3219062784 bytes, 6287232 sectors from 2099200+128)
+    Type 0x83 (Linux)
+    Ext4 file system
+      Volume name "data"
+Partition 3: unused
+"""
+
+
+def test_parse_disktype_nested_partitions():
+    """Test volumes in logical partitions get absolute offsets and nesting."""
+    volumes = parse_disktype(DISKTYPE_EXTENDED)
+
+    assert volumes == [
+        DisktypeVolume(
+            index=1,
+            file_system="FAT32",
+            name="BOOT",
+            partition=1,
+            offset=2048 * 512,
+            length=1072693248,
+            depth=1,
+            size="1023 MiB (1072693248 bytes, 261888 clusters of 4 KiB)",
+        ),
+        DisktypeVolume(
+            index=2,
+            file_system="Ext4",
+            name="data",
+            partition=5,
+            offset=(2099200 + 128) * 512,
+            length=6287232 * 512,
+            depth=2,
+        ),
+    ]
+    assert volumes[1].output_directory_name == "volume-2-ext4-data"
+
+
+def test_volumes_sidecar(tmp_path):
+    """Test saved volumes are loaded only while disktype output is unchanged."""
+    disktype_path = tmp_path / "disktype.txt"
+    disktype_path.write_bytes(DISKTYPE_EXTENDED)
+    sidecar_path = str(tmp_path / "disktype.json")
+    volumes = parse_disktype(DISKTYPE_EXTENDED)
+
+    save_volumes(sidecar_path, str(disktype_path), volumes)
+    assert load_volumes(sidecar_path, str(disktype_path)) == volumes
+
+    disktype_path.write_bytes(DISKTYPE_EXTENDED + b"changed\n")
+    assert load_volumes(sidecar_path, str(disktype_path)) is None
+    assert load_volumes(str(tmp_path / "missing.json"), str(disktype_path)) is None
+
+
+def test_disk_image_reuses_parsed_volumes(mocker, tmp_path):
+    """Test disktype output is parsed once and then read from the sidecar."""
+    disktype_path = tmp_path / "disktype.txt"
+    disktype_path.write_bytes(DISKTYPE_EXTENDED)
+    parse = mocker.patch(
+        "disk_image_toolkit.disk_image.parse_disktype", side_effect=parse_disktype
+    )
+
+    disk_image = DiskImage("disk.dd")
+    disk_image.load_disktype(str(disktype_path))
+    volumes = disk_image.get_volumes_from_disktype()
+    assert disk_image.get_volumes_from_disktype() == volumes
+
+    disk_image = DiskImage("disk.dd")
+    disk_image.load_disktype(str(disktype_path))
+    assert disk_image.get_volumes_from_disktype() == volumes
+
+    assert parse.call_count == 1
+    assert os.path.isfile(tmp_path / "disktype.json")
@@ -0,0 +1,100 @@
+"""StageJournal unit tests."""
+import os
+
+from disk_image_toolkit.journal import StageJournal
+from disk_image_toolkit.pipeline import Pipeline, Stage
+
+STAGES = ["copy", "carve", "package"]
+
+
+def test_record_and_reload(tmp_path):
+    """Test completed stages survive reopening the journal."""
+    artifact = tmp_path / "disktype.txt"
+    artifact.write_text("FAT12 file system")
+
+    journal = StageJournal(str(tmp_path / "journal.jsonl"))
+    journal.record(
+        "disk1.img",
+        "copy",
+        artifacts=[str(artifact), str(tmp_path / "missing")],
+        data={"volumes": [{"id": 1}]},
+    )
+
+    reopened = StageJournal(str(tmp_path / "journal.jsonl"))
+    entry = reopened.get("disk1.img", "copy")
+    assert entry["artifacts"] == ["disktype.txt"]
+    assert entry["data"] == {"volumes": [{"id": 1}]}
+    assert reopened.get("disk1.img", "carve") is None
+
+
+def test_resume_index(tmp_path):
+    """Test resume point is the newest finished stage with its artifacts."""
+    artifact = tmp_path / "checksum.md5"
+    artifact.write_text("")
+
+    journal = StageJournal(str(tmp_path / "journal.jsonl"))
+    assert journal.resume_index("disk1.img", STAGES) == 0
+
+    journal.record("disk1.img", "copy")
+    journal.record("disk1.img", "package", artifacts=[str(artifact)])
+    # Stages only count as a contiguous prefix.
+    assert journal.resume_index("disk1.img", STAGES) == 1
+
+    journal.record("disk1.img", "carve")
+    assert journal.resume_index("disk1.img", STAGES) == 3
+
+    os.remove(artifact)
+    assert journal.resume_index("disk1.img", STAGES) == 2
+
+    journal.reset("disk1.img", ["carve", "package"])
+    assert StageJournal(journal.path).resume_index("disk1.img", STAGES) == 1
+
+
+def test_truncated_entry_is_ignored(tmp_path):
+    """Test a line cut short by a crash does not break later entries."""
+    journal_path = tmp_path / "journal.jsonl"
+    journal = StageJournal(str(journal_path))
+    journal.record("disk1.img", "copy")
+    with open(journal_path, "a") as journal_file:
+        journal_file.write('{"image": "disk1.img", "sta')
+
+    journal = StageJournal(str(journal_path))
+    journal.record("disk1.img", "carve")
+
+    reopened = StageJournal(str(journal_path))
+    assert reopened.resume_index("disk1.img", STAGES) == 2
+
+
+def test_pipeline_skips_completed_stages(tmp_path):
+    """Test pipeline resumes items from the journal."""
+    journal = StageJournal(str(tmp_path / "journal.jsonl"))
+    journal.record("disk1.img", "copy")
+    journal.record("disk1.img", "carve", data={"volumes": ["volume-1-fat12"]})
+
+    calls = []
+    resumed = {}
+
+    def _stage(name):
+        def _func(item):
+            calls.append((item, name))
+            return {"data": {"volumes": [name]}}
+
+        return _func
+
+    stages = [
+        Stage("copy", _stage("copy")),
+        Stage(
+            "carve",
+            _stage("carve"),
+            resume=lambda item, data: resumed.update({item: data["volumes"]}),
+        ),
+        Stage("package", _stage("package")),
+    ]
+    Pipeline(stages, journal=journal).run(["disk1.img", "disk2.img"])
+
+    assert ("disk1.img", "copy") not in calls
+    assert ("disk1.img", "carve") not in calls
+    assert ("disk1.img", "package") in calls
+    assert ("disk2.img", "copy") in calls
+    assert resumed == {"disk1.img": ["volume-1-fat12"]}
+    assert journal.resume_index("disk2.img", STAGES) == 3
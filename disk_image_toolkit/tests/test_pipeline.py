@@ -0,0 +1,103 @@
+"""Pipeline executor unit tests."""
+import sys
+import threading
+import time
+
+import pytest
+
+from disk_image_toolkit.pipeline import Pipeline, Stage
+
+
+def test_pipeline_runs_all_stages_in_order():
+    """Test each item passes through every stage in stage order."""
+    calls = []
+    lock = threading.Lock()
+
+    def _record(name):
+        def _func(item):
+            with lock:
+                calls.append((item["id"], name))
+            item["stages"].append(name)
+
+        return _func
+
+    items = [{"id": index, "stages": []} for index in range(10)]
+    pipeline = Pipeline(
+        [
+            Stage("copy", _record("copy"), workers=2),
+            Stage("carve", _record("carve"), workers=3),
+            Stage("package", _record("package")),
+        ]
+    )
+    return_value = pipeline.run(items)
+
+    assert return_value == items
+    for item in return_value:
+        assert item["stages"] == ["copy", "carve", "package"]
+    assert len(calls) == 30
+
+
+def test_pipeline_respects_stage_workers():
+    """Test no stage runs more items concurrently than its worker count."""
+    active = {"count": 0, "max": 0}
+    lock = threading.Lock()
+
+    def _slow(item):
+        with lock:
+            active["count"] += 1
+            active["max"] = max(active["max"], active["count"])
+        time.sleep(0.01)
+        with lock:
+            active["count"] -= 1
+
+    pipeline = Pipeline([Stage("copy", lambda item: None), Stage("carve", _slow, 3)])
+    pipeline.run(range(20))
+
+    assert active["max"] <= 3
+
+
+def test_pipeline_failed_items_skip_later_stages():
+    """Test an exception removes the item from later stages and is reported."""
+    errors = []
+    packaged = []
+
+    def _carve(item):
+        if item == 2:
+            raise RuntimeError("tsk_recover failed")
+
+    pipeline = Pipeline(
+        [Stage("carve", _carve, workers=2), Stage("package", packaged.append)],
+        on_error=lambda item, stage, err: errors.append((item, stage.name)),
+    )
+    pipeline.run(range(5))
+
+    assert errors == [(2, "carve")]
+    assert sorted(packaged) == [0, 1, 3, 4]
+
+
+def test_pipeline_system_exit_fails_item_only():
+    """Test SystemExit in a stage fails its item without stopping the stage."""
+    errors = []
+    packaged = []
+
+    def _carve(item):
+        if item in (1, 3):
+            sys.exit(1)
+
+    pipeline = Pipeline(
+        [
+            Stage("copy", lambda item: None),
+            Stage("carve", _carve),
+            Stage("package", packaged.append),
+        ],
+        on_error=lambda item, stage, err: errors.append((item, type(err))),
+    )
+    pipeline.run(range(6))
+
+    assert errors == [(1, SystemExit), (3, SystemExit)]
+    assert packaged == [0, 2, 4, 5]
+
+
+def test_stage_requires_worker():
+    with pytest.raises(ValueError):
+        Stage("copy", lambda item: None, workers=0)
@@ -0,0 +1,225 @@
+"""Disk layout probe unit tests."""
+import os
+import struct
+
+import pytest
+
+from disk_image_toolkit import DiskImage
+from disk_image_toolkit.disktype import parse_disktype
+from disk_image_toolkit.probe import format_size, probe_disk_image
+
+TEST_FIXTURES_DIR = os.path.abspath(os.path.join(__file__, "../../../tests/fixtures"))
+
+
+def _fat32_boot_sector(total_sectors, label=b"DATA       "):
+    """Return a FAT32 boot sector with 8 sectors per cluster."""
+    boot = bytearray(512)
+    boot[0:3] = b"\xebX\x90"
+    boot[3:11] = b"MSDOS5.0"
+    struct.pack_into("<HBHBHHBH", boot, 11, 512, 8, 32, 2, 0, 0, 0xF8, 0)
+    struct.pack_into("<II", boot, 32, total_sectors, 1000)
+    struct.pack_into("<I", boot, 44, 2)
+    boot[66] = 0x29
+    boot[71:82] = label
+    boot[510:512] = b"\x55\xaa"
+    return bytes(boot)
+
+
+def _ntfs_boot_sector(total_sectors):
+    boot = bytearray(512)
+    boot[0:3] = b"\xebR\x90"
+    boot[3:11] = b"NTFS    "
+    struct.pack_into("<H", boot, 11, 512)
+    struct.pack_into("<Q", boot, 40, total_sectors)
+    boot[510:512] = b"\x55\xaa"
+    return bytes(boot)
+
+
+def _write_image(path, size, blocks):
+    """Write a sparse image of size bytes with blocks at their offsets."""
+    with open(path, "wb") as image_file:
+        image_file.truncate(size)
+        for offset, data in blocks.items():
+            image_file.seek(offset)
+            image_file.write(data)
+    return str(path)
+
+
+@pytest.mark.parametrize(
+    "disk_image_path, disktype_path",
+    [
+        (
+            os.path.join(TEST_FIXTURES_DIR, "fat12", "practical.floppy.dd"),
+            os.path.join(TEST_FIXTURES_DIR, "fat12", "disktype.txt"),
+        ),
+        (
+            os.path.join(TEST_FIXTURES_DIR, "iso-hfs-dual", "iso9660_hfs.iso"),
+            os.path.join(TEST_FIXTURES_DIR, "iso-hfs-dual", "disktype.txt"),
+        ),
+    ],
+)
+def test_probe_matches_disktype(disk_image_path, disktype_path):
+    """Test probe reports the volumes disktype reports for fixtures."""
+    with open(disktype_path, "rb") as f:
+        expected_volumes = parse_disktype(f.read())
+
+    report = probe_disk_image(disk_image_path)
+
+    assert parse_disktype(report) == expected_volumes
+
+
+def test_probe_apple_partition_map(tmp_path):
+    """Test probe reports HFS volume in an Apple partition map like disktype."""
+    partitions = [
+        (1, 80, b"Apple_partition_map"),
+        (81, 10, b"Iomega_DiskInfo"),
+        (91, 400, b"Apple_Driver"),
+        (491, 196106, b"Apple_HFS"),
+        (196597, 1, b"Iomega_backup"),
+        (196598, 10, b"Iomega_DiskInfo"),
+    ]
+    blocks = {0: b"ER\x02\x00"}
+    for number, (start, sectors, partition_type) in enumerate(partitions, 1):
+        entry = bytearray(512)
+        entry[0:2] = b"PM"
+        struct.pack_into(">III", entry, 4, len(partitions), start, sectors)
+        entry[48 : 48 + len(partition_type)] = partition_type
+        blocks[number * 512] = bytes(entry)
+    mdb = bytearray(512)
+    mdb[0:2] = b"BD"
+    struct.pack_into(">HI", mdb, 18, 65360, 1536)
+    mdb[36] = 17
+    mdb[37:54] = b"ok_images + rome2"
+    blocks[491 * 512 + 1024] = bytes(mdb)
+    image = _write_image(tmp_path / "hfs.dd", 100663296, blocks)
+
+    with open(os.path.join(TEST_FIXTURES_DIR, "hfs", "disktype.txt"), "rb") as f:
+        expected_volumes = parse_disktype(f.read())
+
+    assert parse_disktype(probe_disk_image(image)) == expected_volumes
+
+
+def test_probe_mbr(tmp_path):
+    """Test probe reports volumes in MBR partitions with their offsets."""
+    mbr = bytearray(512)
+    struct.pack_into("<B3xB3xII", mbr, 446, 0x80, 0x0C, 2048, 40960)
+    struct.pack_into("<B3xB3xII", mbr, 462, 0x00, 0x07, 43008, 20480)
+    mbr[510:512] = b"\x55\xaa"
+    image = _write_image(
+        tmp_path / "mbr.dd",
+        64 * 1024**2,
+        {
+            0: bytes(mbr),
+            2048 * 512: _fat32_boot_sector(40960),
+            43008 * 512: _ntfs_boot_sector(20479),
+        },
+    )
+
+    volumes = [volume.to_dict() for volume in parse_disktype(probe_disk_image(image))]
+
+    assert [
+        (v["file_system"], v["name"], v["partition"], v["offset"], v["length"])
+        for v in volumes
+    ] == [
+        ("FAT32", "DATA", 1, 2048 * 512, (40960 - 32 - 2000) // 8 * 4096),
+        ("NTFS", "", 2, 43008 * 512, 20479 * 512),
+    ]
+
+
+def test_probe_gpt(tmp_path):
+    """Test probe reports volumes in GPT partitions, skipping reserved ones."""
+    mbr = bytearray(512)
+    struct.pack_into("<B3xB3xII", mbr, 446, 0x00, 0xEE, 1, 131071)
+    mbr[510:512] = b"\x55\xaa"
+    header = bytearray(512)
+    header[0:8] = b"EFI PART"
+    struct.pack_into("<QII", header, 72, 2, 128, 128)
+    entries = bytearray(128 * 128)
+    reserved_type = bytes.fromhex("16e3c9e35c0bb84d817df92df00215ae")
+    data_type = bytes.fromhex("a2a0d0ebe5b9334487c068b6b72699c7")
+    entries[0:16] = reserved_type
+    struct.pack_into("<QQ", entries, 32, 34, 32801)
+    entries[128:144] = data_type
+    struct.pack_into("<QQ", entries, 160, 32802, 131038)
+    entries[184:192] = "data".encode("utf-16-le")
+    image = _write_image(
+        tmp_path / "gpt.dd",
+        64 * 1024**2,
+        {
+            0: bytes(mbr),
+            512: bytes(header),
+            1024: bytes(entries),
+            32802 * 512: _ntfs_boot_sector(98236),
+        },
+    )
+
+    report = probe_disk_image(image)
+    volumes = parse_disktype(report)
+
+    assert b'Partition Name "data"' in report
+    assert len(volumes) == 1
+    assert (volumes[0].partition, volumes[0].offset) == (2, 32802 * 512)
+
+
+@pytest.mark.parametrize(
+    "blocks",
+    [
+        # no signatures at all
+        {},
+        # extended partition
+        {446: struct.pack("<B3xB3xII", 0, 0x05, 2048, 4096), 510: b"\x55\xaa"},
+        # data partition without a known file system
+        {446: struct.pack("<B3xB3xII", 0, 0x83, 2048, 4096), 510: b"\x55\xaa"},
+        # partition table on an ISO9660 disc
+        {
+            446: struct.pack("<B3xB3xII", 0x80, 0x0C, 64, 4096),
+            510: b"\x55\xaa",
+            32768: b"\x01CD001",
+        },
+    ],
+)
+def test_probe_unrecognized(tmp_path, blocks):
+    """Test probe leaves layouts it does not recognize to disktype."""
+    image = _write_image(tmp_path / "disk.dd", 4 * 1024**2, blocks)
+
+    assert probe_disk_image(image) is None
+
+
+def test_probe_read_limit():
+    """Test probe gives up rather than read more than its limit."""
+    disk_image_path = os.path.join(TEST_FIXTURES_DIR, "fat12", "practical.floppy.dd")
+
+    assert probe_disk_image(disk_image_path, read_limit=4096) is None
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [
+        (512, "512 bytes"),
+        (901120, "880 KiB"),
+        (1457664, "1.390 MiB"),
+        (100392960, "95.74 MiB"),
+        (100663296, "96 MiB"),
+    ],
+)
+def test_format_size(size, expected):
+    assert format_size(size) == expected
+
+
+def test_run_disktype_uses_probe(mocker, tmp_path):
+    """Test disktype is only run for layouts the probe does not recognize."""
+    disktype_call = mocker.patch(
+        "disk_image_toolkit.disk_image.DiskImage._call_subprocess",
+        return_value=b"",
+    )
+    disk_image = DiskImage(
+        os.path.join(TEST_FIXTURES_DIR, "fat12", "practical.floppy.dd")
+    )
+    disk_image.raw_disk_image = disk_image.path
+
+    disk_image.run_disktype(str(tmp_path / "disktype.txt"))
+    assert not disktype_call.called
+    assert disk_image.get_volumes_from_disktype()[0]["file_system"] == "FAT12"
+
+    disk_image.run_disktype(str(tmp_path / "disktype.txt"), probe=False)
+    assert disktype_call.called
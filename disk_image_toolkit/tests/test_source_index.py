@@ -0,0 +1,104 @@
+"""Source directory index unit tests."""
+from disk_image_toolkit.source_index import SourceIndex
+
+
+def _make_files(directory, names):
+    for name in names:
+        (directory / name).write_bytes(b"")
+    (directory / "subdir.img").mkdir()
+
+
+def test_source_index_exact_stems(tmp_path):
+    """Test images only claim files sharing their exact stem."""
+    _make_files(
+        tmp_path,
+        (
+            "disk1.E01",
+            "disk1.E02",
+            "disk1.E01.txt",
+            "disk1.info",
+            "disk10.img",
+            "disk10.img.md5",
+            "disk100.E01",
+            "disk100.log",
+            "notes.txt",
+        ),
+    )
+
+    index = SourceIndex(str(tmp_path))
+
+    assert list(index.images) == ["disk1.E01", "disk10.img", "disk100.E01"]
+    assert index.images["disk1.E01"].segments == ["disk1.E01", "disk1.E02"]
+    assert index.images["disk1.E01"].files == [
+        "disk1.E01",
+        "disk1.E01.txt",
+        "disk1.E02",
+        "disk1.info",
+    ]
+    assert index.images["disk10.img"].files == ["disk10.img", "disk10.img.md5"]
+    assert index.images["disk100.E01"].files == ["disk100.E01", "disk100.log"]
+    assert index.segment_paths("disk1.E01") == [
+        str(tmp_path / "disk1.E01"),
+        str(tmp_path / "disk1.E02"),
+    ]
+    assert "subdir.img" not in index.names
+
+
+def test_source_index_split_raw(tmp_path):
+    """Test later segments are not images and images never claim images."""
+    _make_files(
+        tmp_path,
+        (
+            "disk.000",
+            "disk.001",
+            "disk.002",
+            "disk.log",
+            "disk.iso",
+            "disk.part2.img",
+            "disk.part2.log",
+        ),
+    )
+
+    index = SourceIndex(str(tmp_path))
+
+    assert list(index.images) == ["disk.000", "disk.iso", "disk.part2.img"]
+    assert index.images["disk.000"].segments == ["disk.000", "disk.001", "disk.002"]
+    assert index.images["disk.000"].sidecars == ["disk.log"]
+    assert index.images["disk.iso"].files == ["disk.iso", "disk.log"]
+    assert index.images["disk.part2.img"].files == ["disk.part2.img", "disk.part2.log"]
+
+
+def test_source_index_segment_like_sidecars(tmp_path):
+    """Test extensions that only look like segments are sidecars."""
+    _make_files(
+        tmp_path,
+        (
+            "disk.E01",
+            "disk.E02",
+            "disk.eps",
+            "disk.exe",
+            "disk.Ex01",
+            "photos.002",
+            "photos.img",
+        ),
+    )
+
+    index = SourceIndex(str(tmp_path))
+
+    assert list(index.images) == ["disk.E01", "photos.img"]
+    assert index.images["disk.E01"].segments == ["disk.E01", "disk.E02"]
+    assert index.images["disk.E01"].sidecars == ["disk.Ex01", "disk.eps", "disk.exe"]
+    # a split raw series without its first segment is not one
+    assert index.images["photos.img"].sidecars == ["photos.002"]
+
+
+def test_source_index_lettered_ewf_segments(tmp_path):
+    """Test lettered EWF segments follow the 99th numbered segment."""
+    names = ["disk.E{:02d}".format(number) for number in range(1, 100)]
+    _make_files(tmp_path, names + ["disk.EAA", "disk.EAB", "disk.info"])
+
+    index = SourceIndex(str(tmp_path))
+
+    assert list(index.images) == ["disk.E01"]
+    assert index.images["disk.E01"].segments == names + ["disk.EAA", "disk.EAB"]
+    assert index.images["disk.E01"].sidecars == ["disk.info"]
@@ -0,0 +1,123 @@
+"""Shared pipeline stage unit tests."""
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+
+from disk_image_toolkit.source_index import SourceIndex
+from disk_image_toolkit.stages import (
+    DiskImageJob,
+    copy_disk_image,
+    image_workers,
+    remove_scratch_dirs,
+    report_identical_images,
+    share_results,
+)
+
+TEST_FIXTURES_DIR = os.path.abspath(os.path.join(__file__, "../../../tests/fixtures"))
+
+DISK_IMAGE_FAT_12 = os.path.join(TEST_FIXTURES_DIR, "fat12", "practical.floppy.dd")
+
+
+def make_source(tmp_path, names):
+    source = tmp_path / "source"
+    source.mkdir()
+    for name in names:
+        shutil.copyfile(DISK_IMAGE_FAT_12, str(source / name))
+    return str(source)
+
+
+def make_job(tmp_path, source, file, cache=None):
+    root_dir = str(tmp_path / "out" / file)
+    return DiskImageJob(
+        file,
+        source,
+        root_dir=root_dir,
+        diskimage_dir=os.path.join(root_dir, "diskimage"),
+        files_dir=os.path.join(root_dir, "files"),
+        dfxml_dir=os.path.join(root_dir, "metadata"),
+        state_dir=str(tmp_path / "out"),
+        cache=cache,
+    )
+
+
+def test_copy_disk_image_records_digests(tmp_path):
+    """Test staged files are hashed into the job's digest sidecar."""
+    source = make_source(tmp_path, ["disk.dd"])
+    job = make_job(tmp_path, source, "disk.dd")
+
+    result = copy_disk_image(job, algorithms=["md5", "md5"])
+
+    staged_path = os.path.join(job.diskimage_dir, "disk.dd")
+    with open(DISK_IMAGE_FAT_12, "rb") as f:
+        md5 = hashlib.md5(f.read()).hexdigest()
+    assert result["artifacts"] == [staged_path, job.digests_path]
+    assert job.digest_sidecar().known_digests()[staged_path]["md5"] == md5
+    assert os.path.isdir(job.dfxml_dir)
+
+
+def test_copy_disk_image_computes_cache_key(tmp_path):
+    """Test the content digest is computed while staging for cached images."""
+    source = make_source(tmp_path, ["disk1.dd", "disk2.dd", "other.dd"])
+    with open(os.path.join(source, "other.dd"), "ab") as f:
+        f.write(b"x")
+    index = SourceIndex(source)
+    jobs = [make_job(tmp_path, source, file) for file in index.images]
+
+    run_cache = share_results(jobs, index, None, str(tmp_path))
+
+    assert run_cache.cache_dir == str(tmp_path / ".cache")
+    assert [job.disk_image.cache is run_cache for job in jobs] == [True, True, False]
+
+    result = copy_disk_image(jobs[0])
+
+    with open(DISK_IMAGE_FAT_12, "rb") as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    assert jobs[0].disk_image.digest == sha256
+    assert result["data"] == {"digest": sha256}
+    assert not os.path.exists(jobs[0].digests_path)
+
+
+def test_share_results_keeps_cache(tmp_path):
+    """Test no cache local to the run is made without candidates."""
+    source = make_source(tmp_path, ["disk.dd"])
+    index = SourceIndex(source)
+    jobs = [make_job(tmp_path, source, "disk.dd")]
+
+    assert share_results(jobs, index, None, str(tmp_path)) is None
+    assert jobs[0].disk_image.cache is None
+    assert not os.path.exists(str(tmp_path / ".cache"))
+
+
+def test_report_identical_images(tmp_path, caplog):
+    """Test disk images with the same digest are reported together."""
+    source = make_source(tmp_path, ["a.dd", "b.dd", "c.dd"])
+    jobs = [make_job(tmp_path, source, file) for file in ("a.dd", "b.dd", "c.dd")]
+    jobs[0].disk_image.digest = "abc"
+    jobs[1].disk_image.digest = "def"
+    jobs[2].disk_image.digest = "abc"
+
+    with caplog.at_level(logging.WARNING):
+        report_identical_images(jobs)
+
+    assert [record.getMessage() for record in caplog.records] == [
+        "Identical disk images found: a.dd, c.dd"
+    ]
+
+
+def test_remove_scratch_dirs(tmp_path):
+    """Test only scratch directories are removed."""
+    (tmp_path / ".scratch-abc" / "ewf").mkdir(parents=True)
+    (tmp_path / "SIPs").mkdir()
+
+    remove_scratch_dirs(str(tmp_path))
+
+    assert os.listdir(str(tmp_path)) == ["SIPs"]
+
+
+def test_image_workers():
+    """Test the thread budget is split between concurrent disk images."""
+    assert image_workers(argparse.Namespace(threads=8, jobs=1)) == 8
+    assert image_workers(argparse.Namespace(threads=8, jobs=3)) == 2
+    assert image_workers(argparse.Namespace(threads=2, jobs=4)) == 1
@@ -0,0 +1,111 @@
+"""Disk image staging unit tests."""
+import errno
+import hashlib
+import os
+
+from disk_image_toolkit import staging
+from disk_image_toolkit.staging import DigestSidecar, stage_file
+
+CONTENT = b"disk image" * 1000
+
+
+def test_stage_file(tmp_path):
+    """Test file is staged with identical content by a known method."""
+    src = tmp_path / "disk.dd"
+    src.write_bytes(CONTENT)
+    dst = tmp_path / "staged.dd"
+
+    method = stage_file(str(src), str(dst))
+
+    assert method in (
+        staging.REFLINK,
+        staging.COPY_FILE_RANGE,
+        staging.SENDFILE,
+        staging.COPY,
+    )
+    assert dst.read_bytes() == CONTENT
+    assert not os.path.samefile(src, dst)
+
+
+def test_stage_file_hardlink(mocker, tmp_path):
+    """Test a hard link is made only when allowed and cloning fails."""
+    mocker.patch("disk_image_toolkit.staging._reflink", return_value=False)
+    src = tmp_path / "disk.dd"
+    src.write_bytes(CONTENT)
+    dst = tmp_path / "staged.dd"
+
+    assert stage_file(str(src), str(dst), allow_hardlink=True) == staging.HARDLINK
+    assert os.path.samefile(src, dst)
+
+
+def test_stage_file_falls_back_to_userspace_copy(mocker, tmp_path):
+    """Test unsupported kernel copies fall back to a userspace copy."""
+    mocker.patch("disk_image_toolkit.staging._reflink", return_value=False)
+    unsupported = OSError(errno.EXDEV, "Invalid cross-device link")
+    mocker.patch("os.copy_file_range", side_effect=unsupported, create=True)
+    mocker.patch("os.sendfile", side_effect=unsupported, create=True)
+    src = tmp_path / "disk.dd"
+    src.write_bytes(CONTENT)
+    dst = tmp_path / "staged.dd"
+    dst.write_bytes(b"stale content from an earlier run" * 1000)
+
+    assert stage_file(str(src), str(dst)) == staging.COPY
+    assert dst.read_bytes() == CONTENT
+
+
+def test_stage_file_hashes_while_copying(mocker, tmp_path):
+    """Test hashes are updated with the staged content."""
+    copy_file_range = mocker.patch("os.copy_file_range", create=True)
+    src = tmp_path / "disk.dd"
+    src.write_bytes(CONTENT)
+    dst = tmp_path / "staged.dd"
+    md5, sha256 = hashlib.md5(), hashlib.sha256()
+
+    method = stage_file(str(src), str(dst), hashes=[md5, sha256])
+
+    assert method in (staging.REFLINK, staging.COPY)
+    copy_file_range.assert_not_called()
+    assert dst.read_bytes() == CONTENT
+    assert md5.hexdigest() == hashlib.md5(CONTENT).hexdigest()
+    assert sha256.hexdigest() == hashlib.sha256(CONTENT).hexdigest()
+
+
+def test_stage_file_sparse(tmp_path):
+    """Test sparse copies keep holes, skip zeros and hash the full content."""
+    src = tmp_path / "disk.dd"
+    with open(src, "wb") as f:
+        f.write(CONTENT)
+        f.write(bytes(staging.SPARSE_BLOCK_SIZE * 4))
+        f.seek(staging.SPARSE_BLOCK_SIZE * 16, os.SEEK_CUR)
+        f.write(CONTENT)
+        f.truncate(f.tell() + staging.SPARSE_BLOCK_SIZE * 8)
+    content = src.read_bytes()
+    dst = tmp_path / "staged.dd"
+    sha256 = hashlib.sha256()
+
+    method = stage_file(str(src), str(dst), hashes=[sha256], sparse=True)
+
+    assert method in (staging.REFLINK, staging.SPARSE)
+    assert dst.read_bytes() == content
+    assert sha256.hexdigest() == hashlib.sha256(content).hexdigest()
+    if method == staging.SPARSE:
+        assert os.stat(dst).st_blocks * 512 < len(content) // 2
+
+
+def test_digest_sidecar(tmp_path):
+    """Test digests persist and are dropped once the file changes."""
+    staged = tmp_path / "sip" / "objects" / "disk.dd"
+    staged.parent.mkdir(parents=True)
+    staged.write_bytes(CONTENT)
+    sidecar_path = tmp_path / ".digests" / "disk.dd.json"
+
+    sidecar = DigestSidecar(str(sidecar_path), str(tmp_path / "sip"))
+    sidecar.record(str(staged), {"md5": "abc"})
+    sidecar.save()
+
+    sidecar = DigestSidecar(str(sidecar_path), str(tmp_path / "sip"))
+    assert sidecar.get(str(staged), "md5") == "abc"
+    assert sidecar.get(str(staged), "sha256") is None
+
+    staged.write_bytes(CONTENT + b"changed")
+    assert sidecar.get(str(staged), "md5") is None
@@ -0,0 +1,167 @@
+"""DFXML summary scanner unit tests."""
+import os
+
+import pytest
+
+from disk_image_toolkit.exception import DFXMLError
+from disk_image_toolkit.summary import (
+    DFXMLSummary,
+    load_summary,
+    scan_dfxml,
+    summarize_dfxml,
+    timestamp_to_int,
+)
+
+TEST_FIXTURES_DIR = os.path.abspath(os.path.join(__file__, "../../../tests/fixtures"))
+
+DFXML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<dfxml xmlns="http://www.forensicswiki.org/wiki/Category:Digital_Forensics_XML" version="1.0">
+  <volume>
+    <fileobject>
+      <filename>docs</filename>
+      <name_type>d</name_type>
+      <filesize>4096</filesize>
+      <mtime>1990-01-01T00:00:00Z</mtime>
+    </fileobject>
+    <fileobject>
+      <filename>docs/a.txt</filename>
+      <name_type>r</name_type>
+      <filesize>10</filesize>
+      <alloc>1</alloc>
+      <mtime>2001-05-01T10:00:00Z</mtime>
+      <ctime>1999-03-01T10:00:00Z</ctime>
+      <crtime>2000-01-01T10:00:00Z</crtime>
+    </fileobject>
+    <fileobject>
+      <filename>docs/b.txt</filename>
+      <name_type>r</name_type>
+      <filesize>20</filesize>
+      <mtime>2003-07-01T10:00:00Z</mtime>
+      <ctime>2004-03-01T10:00:00Z</ctime>
+    </fileobject>
+    <fileobject>
+      <filename>deleted.txt</filename>
+      <name_type>r</name_type>
+      <filesize>300</filesize>
+      <unalloc>1</unalloc>
+      <mtime>1980-01-01T00:00:00Z</mtime>
+    </fileobject>
+  </volume>
+</dfxml>
+"""
+
+
+def test_scan_dfxml_fixture():
+    """Test scanner counts the regular files in fiwalk output."""
+    summary = scan_dfxml(os.path.join(TEST_FIXTURES_DIR, "dfxml", "fat12.xml"))
+
+    assert (summary.files, summary.bytes, summary.unallocated) == (2, 1474847, 0)
+    assert summary.date_range("N/A") == ("2023-02-05", "2023-02-05")
+
+
+@pytest.mark.parametrize(
+    "export_all, files, total_bytes, date_range",
+    [
+        (False, 2, 30, ("1999-03-01", "2004-03-01")),
+        (True, 3, 330, ("1980-01-01", "2003-07-01")),
+    ],
+)
+def test_scan_dfxml(tmp_path, export_all, files, total_bytes, date_range):
+    """Test directories are skipped and unallocated files counted on request."""
+    dfxml_path = tmp_path / "dfxml.xml"
+    dfxml_path.write_bytes(DFXML)
+
+    summary = scan_dfxml(str(dfxml_path), export_all=export_all)
+
+    assert (summary.files, summary.bytes, summary.unallocated) == (
+        files,
+        total_bytes,
+        1,
+    )
+    assert summary.date_range("N/A") == date_range
+
+
+def test_date_range_default():
+    """Test default is used when no file has a modification date."""
+    assert DFXMLSummary().date_range("2024") == ("2024", "2024")
+
+
+def test_scan_dfxml_invalid(tmp_path):
+    """Test unreadable DFXML raises DFXMLError."""
+    dfxml_path = tmp_path / "dfxml.xml"
+    dfxml_path.write_bytes(DFXML[:-20])
+
+    with pytest.raises(DFXMLError):
+        scan_dfxml(str(dfxml_path))
+    with pytest.raises(DFXMLError):
+        scan_dfxml(str(tmp_path / "missing.xml"))
+
+
+def test_summary_merge():
+    """Test merged summaries match a summary of all files."""
+    first = DFXMLSummary()
+    first.add_file(10, {"mtime": "2001-05-01T10:00:00Z", "ctime": "bad"})
+    second = DFXMLSummary(unallocated=1)
+    second.add_file(20, {"mtime": "1999-05-01T10:00:00Z"})
+    second.add_file(30, {"mtime": "2003-05-01T10:00:00Z"})
+
+    merged = DFXMLSummary().merge(first).merge(second)
+
+    assert (merged.files, merged.bytes, merged.unallocated) == (3, 60, 1)
+    assert "ctime" not in merged.earliest
+    assert merged.date_range("N/A") == ("1999-05-01", "2003-05-01")
+
+
+def test_date_range_compares_instants():
+    """Test timestamps with UTC offsets are compared as instants."""
+    summary = DFXMLSummary()
+    summary.add_file(1, {"mtime": "2001-05-02T01:00:00+05:00"})
+    summary.add_file(1, {"mtime": "2001-05-01T22:00:00Z"})
+
+    assert summary.earliest["mtime"][0] == timestamp_to_int("2001-05-01T20:00:00")
+    assert summary.date_range("N/A") == ("2001-05-02", "2001-05-01")
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2009-02-05T22:50:57Z", "2009-02-05T22:50:57"),
+        ("2009-02-05T22:50:57.5Z", "2009-02-05T22:50:57"),
+        ("2009-02-05T22:50:57.1234567Z", "2009-02-05T22:50:57"),
+        ("2009-02-05T22:50:57.123456789", "2009-02-05T22:50:57"),
+        ("2009-02-06T01:50:57+03:00", "2009-02-05T22:50:57"),
+        ("2009-02-06T01:50:57.1234567+03:00", "2009-02-05T22:50:57"),
+    ],
+)
+def test_timestamp_to_int_fractions_and_offsets(value, expected):
+    """Test fractional seconds of any length are ignored and offsets applied."""
+    assert timestamp_to_int(value) == timestamp_to_int(expected)
+
+
+def test_date_range_fractional_seconds():
+    """Test timestamps with 7-digit fractions still give the date range."""
+    summary = DFXMLSummary()
+    summary.add_file(1, {"mtime": "2009-02-05T22:50:57.1234567Z"})
+    summary.add_file(1, {"mtime": "2010-03-01T10:00:00.5Z"})
+
+    assert summary.date_range("2026") == ("2009-02-05", "2010-03-01")
+
+
+def test_summarize_dfxml_sidecar(mocker, tmp_path):
+    """Test DFXML is scanned again only when the sidecar is stale."""
+    dfxml_path = tmp_path / "dfxml.xml"
+    dfxml_path.write_bytes(DFXML)
+    sidecar_path = str(tmp_path / "stats" / "dfxml.xml.json")
+    scan = mocker.patch("disk_image_toolkit.summary.scan_dfxml", side_effect=scan_dfxml)
+
+    summary = summarize_dfxml(str(dfxml_path), sidecar_path=sidecar_path)
+    assert summarize_dfxml(str(dfxml_path), sidecar_path=sidecar_path) == summary
+    assert scan.call_count == 1
+
+    assert load_summary(sidecar_path, str(dfxml_path), export_all=True) is None
+    assert summarize_dfxml(str(dfxml_path), True, sidecar_path).files == 3
+    assert scan.call_count == 2
+
+    dfxml_path.write_bytes(DFXML.replace(b"<filesize>10<", b"<filesize>11<"))
+    assert load_summary(sidecar_path, str(dfxml_path), export_all=True) is None
+    assert summarize_dfxml(str(dfxml_path), True, sidecar_path).bytes == 331
@@ -0,0 +1,82 @@
+"""Restore last modified dates of carved files.
+
+The carved tree is indexed with a single os.scandir walk, so files named
+in DFXML that were not carved are skipped without probing the file
+system. Dates are then set directory by directory on a thread pool,
+through a file descriptor for each directory where the platform allows
+it, so each os.utime call does not resolve the full path again.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+
+def index_files(root):
+    """Return dict of path relative to root to (directory, filename).
+
+    Paths use "/" as separator, as filenames in DFXML do. Symbolic links to
+    directories are not followed.
+
+    :param root: Directory to index recursively (str)
+
+    :returns: Index of regular files under root (dict)
+    """
+    index = {}
+    dirs = [(root, "")]
+    while dirs:
+        dirpath, prefix = dirs.pop()
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append((entry.path, prefix + entry.name + "/"))
+                elif entry.is_file():
+                    index[prefix + entry.name] = (dirpath, entry.name)
+    return index
+
+
+def _set_times_in_directory(dirpath, times):
+    """Set times of files in one directory.
+
+    :param times: List of (filename, timestamp) (list)
+    """
+    if os.utime not in os.supports_dir_fd:
+        for filename, timestamp in times:
+            os.utime(os.path.join(dirpath, filename), (timestamp, timestamp))
+        return
+
+    dir_fd = os.open(dirpath, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    try:
+        for filename, timestamp in times:
+            os.utime(filename, (timestamp, timestamp), dir_fd=dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def set_times(index, timestamps, workers=1):
+    """Set access and modification times of indexed files.
+
+    :param index: Index returned by index_files (dict)
+    :param timestamps: Iterable of (relative path, unix timestamp)
+    :param workers: Number of directories updated concurrently (int)
+
+    :returns: Tuple of number of files set and number of paths not in the
+        index (tuple)
+    """
+    by_directory = {}
+    restored = missing = 0
+    for relpath, timestamp in timestamps:
+        location = index.get(relpath)
+        if location is None:
+            missing += 1
+            continue
+        dirpath, filename = location
+        by_directory.setdefault(dirpath, []).append((filename, timestamp))
+        restored += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [
+            executor.submit(_set_times_in_directory, dirpath, times)
+            for dirpath, times in by_directory.items()
+        ]:
+            future.result()
+
+    return restored, missing
@@ -1,16 +1,43 @@
 from datetime import datetime, timezone
+import functools
+import logging
 import math
 
 
+@functools.lru_cache(maxsize=4096)
+def _date_to_int(str_date):
+    """Convert YYYY-MM-DD date to unix integer of its midnight (UTC)."""
+    datetime_obj = datetime.strptime(str_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return int(datetime.timestamp(datetime_obj))
+
+
 def time_to_int(str_time):
     """Convert datetime to unix integer since epoch."""
+    # Carved files share few distinct dates, so in the usual fixed-width
+    # format only the time of day is parsed per call.
+    hour, minute, second = str_time[11:13], str_time[14:16], str_time[17:19]
     try:
+        if (
+            len(str_time) == 19
+            and str_time[10] == "T"
+            and str_time[13] == str_time[16] == ":"
+            and (hour + minute + second).isdigit()
+            and hour < "24"
+            and minute < "60"
+            and second < "60"
+        ):
+            return (
+                _date_to_int(str_time[:10])
+                + int(hour) * 3600
+                + int(minute) * 60
+                + int(second)
+            )
         datetime_obj = datetime.strptime(str_time, "%Y-%m-%dT%H:%M:%S").replace(
             tzinfo=timezone.utc
         )
         return int(datetime.timestamp(datetime_obj))
     except ValueError:
-        logger.warning(
+        logging.getLogger().warning(
             f"Date string {str_time} in unexpected format (expected: YYYY-MM-DDTHH-MM-SS). Unable to convert to Unix timestamp."
         )
 
@@ -16,26 +16,106 @@ https://bitarchivist.net
 import argparse
 import csv
 import datetime
+import functools
 import itertools
 import logging
 import os
 import shutil
 import subprocess
 import sys
+import threading
 import time
 
-from disk_image_toolkit import DiskImage
-from disk_image_toolkit.dfxml import objects
+from disk_image_toolkit.cache import DEFAULT_CACHE_SIZE, ResultCache
+from disk_image_toolkit.disk_image import DEFAULT_HASH_PROFILE, HASH_PROFILES
+from disk_image_toolkit.exception import DFXMLError
+from disk_image_toolkit.journal import JOURNAL_FILENAME, StageJournal
+from disk_image_toolkit.pipeline import Pipeline, Stage
+from disk_image_toolkit.source_index import SourceIndex
+from disk_image_toolkit.stages import (
+    MAX_IO_WORKERS,
+    DiskImageJob,
+    cache_dfxml_stats,
+    disk_image_stages,
+    image_workers,
+    remove_scratch_dirs,
+    report_identical_images,
+    share_results,
+)
+from disk_image_toolkit.summary import DFXMLSummary, summarize_dfxml
 from disk_image_toolkit.util import human_readable_size
 
 
-def write_to_spreadsheet(disk_result, volumes, spreadsheet_path, export_all, logger):
-    """Append info for current disk to analysis CSV"""
-    spreadsheet = open(spreadsheet_path, "a")
-    writer = csv.writer(spreadsheet, quoting=csv.QUOTE_NONNUMERIC)
+ANALYSIS_HEADER = [
+    "Disk image",
+    "Volumes",
+    "File systems",
+    "Date statement",
+    "Date begin",
+    "Date end",
+    "Extent",
+    "Virus found",
+    "Content description",
+]
+
+
+class AnalysisSpreadsheet:
+    """analysis.csv, written a row at a time as disk images finish.
+
+    Rows are flushed as they are added, so results can be followed during
+    long runs. close rewrites the file with one row per disk image, sorted
+    by disk image.
+
+    :param path: Path to analysis CSV (str)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._rows = {}
+        self._lock = threading.Lock()
+        self._file = open(path, "w")
+        self._writer = csv.writer(self._file, quoting=csv.QUOTE_NONNUMERIC)
+        self._writer.writerow(ANALYSIS_HEADER)
+        self._file.flush()
+
+    def __contains__(self, item):
+        return item in self._rows
+
+    def add_row(self, row):
+        """Write row, whose first value is the disk image, and flush it."""
+        with self._lock:
+            self._rows[row[0]] = row
+            self._writer.writerow(row)
+            self._file.flush()
+
+    def close(self):
+        """Rewrite analysis CSV with rows sorted by disk image."""
+        with self._lock:
+            self._file.close()
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as spreadsheet:
+                writer = csv.writer(spreadsheet, quoting=csv.QUOTE_NONNUMERIC)
+                writer.writerow(ANALYSIS_HEADER)
+                for item in sorted(self._rows):
+                    writer.writerow(self._rows[item])
+            os.replace(temp_path, self.path)
+
+
+def analysis_row(disk_result, disk_volumes, logger, dfxml_stats=None, stats_dir=None):
+    """Return analysis CSV row for a disk
+
+    dfxml_stats maps DFXML paths to statistics already known (e.g. from the
+    result cache). Those files are not parsed again; statistics parsed here
+    are added to it.
+
+    If stats_dir is given, statistics of each DFXML file are also kept in a
+    sidecar there, outside the reports, so the csv can be rebuilt without
+    parsing DFXML again.
+    """
+    if dfxml_stats is None:
+        dfxml_stats = {}
 
     item = os.path.basename(disk_result)
-    disk_volumes = volumes[item]
     number_volumes = len(disk_volumes)
 
     date_earliest = ""
@@ -43,16 +123,32 @@ def write_to_spreadsheet(disk_result, volumes, spreadsheet_path, export_all, log
 
     virus_found = False
 
-    # Get and sum information from all DFXML files generated
+    # Use statistics gathered while carving each volume, else get and sum
+    # information from all DFXML files generated
+    volume_stats = [volume.get("stats") for volume in disk_volumes]
     dfxml_files = []
-    for root, _, files in os.walk(disk_result):
-        for file in files:
-            if file.startswith("dfxml"):
-                dfxml_files.append(os.path.join(root, file))
-
     dfxml_files_info = []
+    if disk_volumes and all(volume_stats):
+        dfxml_files_info = [
+            _summary_info(DFXMLSummary.from_dict(stats)) for stats in volume_stats
+        ]
+    else:
+        for root, _, files in os.walk(disk_result):
+            for file in files:
+                if file.startswith("dfxml") and file.endswith(".xml"):
+                    dfxml_files.append(os.path.join(root, file))
+
     for dfxml_file in dfxml_files:
-        dfxml_info = _parse_dfxml(dfxml_file, logger)
+        dfxml_info = dfxml_stats.get(dfxml_file)
+        if dfxml_info is None:
+            sidecar_path = None
+            if stats_dir:
+                sidecar_path = os.path.join(
+                    stats_dir,
+                    os.path.relpath(dfxml_file, os.path.dirname(disk_result)) + ".json",
+                )
+            dfxml_info = _parse_dfxml(dfxml_file, logger, sidecar_path=sidecar_path)
+            dfxml_stats[dfxml_file] = dfxml_info
         if not dfxml_info:
             logger.warning(
                 "No fileobjects in DFXML file {} - possibly file system fiwalk doesn't recognize".format(
@@ -76,22 +172,18 @@ def write_to_spreadsheet(disk_result, volumes, spreadsheet_path, export_all, log
             date_latest = dfxml_info["date_latest"]
 
     if file_count == 0:
-        writer.writerow(
-            [
-                os.path.basename(disk_result),
-                0,
-                "N/A",
-                "N/A",
-                "N/A",
-                "N/A",
-                "N/A",
-                "N/A",
-                "Error reading DFXML files.",
-            ]
-        )
         logger.error("Unable to read DFXML files for {}".format(item))
-        spreadsheet.close()
-        return
+        return [
+            os.path.basename(disk_result),
+            0,
+            "N/A",
+            "N/A",
+            "N/A",
+            "N/A",
+            "N/A",
+            "N/A",
+            "Error reading DFXML files.",
+        ]
 
     if date_earliest[:4] == date_latest[:4]:
         date_statement = date_earliest[:4]
@@ -135,136 +227,148 @@ def write_to_spreadsheet(disk_result, volumes, spreadsheet_path, export_all, log
 
     scope_content = "File formats: {}".format(file_formats_str)
 
-    # write csv row
-    writer.writerow(
-        [
-            os.path.basename(disk_result),
-            number_volumes,
-            file_systems_str,
-            date_statement,
-            date_earliest,
-            date_latest,
-            extent,
-            virus_found,
-            scope_content,
-        ]
-    )
     logger.info("Described {} successfully.".format(item))
+    return [
+        os.path.basename(disk_result),
+        number_volumes,
+        file_systems_str,
+        date_statement,
+        date_earliest,
+        date_latest,
+        extent,
+        virus_found,
+        scope_content,
+    ]
 
-    spreadsheet.close()
-
-
-def _parse_dfxml(dfxml_path, logger, export_all=False):
-    """Parse DFXML and return dict of information for spreadsheet."""
-    volume_info = {"files": 0, "bytes": 0, "date_earliest": "", "date_latest": ""}
 
-    mtimes = []
-    ctimes = []
-    crtimes = []
+def _parse_dfxml(dfxml_path, logger, export_all=False, sidecar_path=None):
+    """Parse DFXML and return dict of information for spreadsheet.
 
+    If sidecar_path is given, statistics saved there are used while the
+    DFXML file is unchanged, and are saved there after parsing.
+    """
     try:
-        for event, obj in objects.iterparse(dfxml_path):
-            if not isinstance(obj, objects.FileObject):
-                continue
-
-            # skip directories and links
-            if obj.name_type:
-                if obj.name_type != "r":
-                    continue
-
-            # skip unallocated unless we exported all files
-            if not export_all:
-                if obj.unalloc:
-                    if obj.unalloc == 1:
-                        continue
-
-            volume_info["files"] += 1
-
-            try:
-                mtime = obj.mtime
-                mtime = str(mtime)
-                mtimes.append(mtime)
-            except:
-                pass
-
-            try:
-                ctime = obj.ctime
-                ctime = str(ctime)
-                ctimes.append(ctime)
-            except:
-                pass
-
-            try:
-                crtime = obj.crtime
-                crtime = str(crtime)
-                crtimes.append(crtime)
-            except:
-                pass
-
-            volume_info["bytes"] += obj.filesize
-
-        # filter "None" values from date lists
-        for date_list in mtimes, ctimes, crtimes:
-            while "None" in date_list:
-                date_list.remove("None")
-
-        # determine earliest and latest MAC dates from lists
-        date_earliest_m = ""
-        date_latest_m = ""
-        date_earliest_c = ""
-        date_latest_c = ""
-        date_earliest_cr = ""
-        date_latest_cr = ""
-        date_statement = ""
-
-        if mtimes:
-            date_earliest_m = min(mtimes)
-            date_latest_m = max(mtimes)
-        if ctimes:
-            date_earliest_c = min(ctimes)
-            date_latest_c = max(ctimes)
-        if crtimes:
-            date_earliest_cr = min(crtimes)
-            date_latest_cr = max(crtimes)
-
-        # determine which set of dates to use (logic: use set with earliest start date,
-        # default to date modified)
-        use_ctimes = False
-        use_crtimes = False
-
-        if not date_earliest_m:
-            date_earliest_m = str(datetime.datetime.now().year)
-            date_latest_m = str(datetime.datetime.now().year)
-        date_to_use = date_earliest_m
-
-        if date_earliest_c:
-            if date_earliest_c < date_to_use:
-                date_to_use = date_earliest_c
-                use_ctimes = True
-        if date_earliest_cr:
-            if date_earliest_cr < date_to_use:
-                date_to_use = date_earliest_cr
-                use_ctimes = False
-                use_crtimes = True
-
-        if use_ctimes:
-            date_earliest = date_earliest_c[:10]
-            date_latest = date_latest_c[:10]
-        elif use_crtimes:
-            date_earliest = date_earliest_cr[:10]
-            date_latest = date_latest_cr[:10]
-        else:
-            date_earliest = date_earliest_m[:10]
-            date_latest = date_latest_m[:10]
-
-        volume_info["date_earliest"] = date_earliest
-        volume_info["date_latest"] = date_latest
-
-    except Exception as err:
-        logger.error("Error reading DFXML file {}: {}".format(dfxml_path, err))
+        summary = summarize_dfxml(
+            dfxml_path, export_all=export_all, sidecar_path=sidecar_path
+        )
+    except DFXMLError as err:
+        logger.error(str(err))
         return
 
-    return volume_info
+    return _summary_info(summary)
+
+
+def _summary_info(summary):
+    """Return dict of information for spreadsheet from DFXMLSummary."""
+    date_earliest, date_latest = summary.date_range(str(datetime.datetime.now().year))
+    return {
+        "files": summary.files,
+        "bytes": summary.bytes,
+        "date_earliest": date_earliest,
+        "date_latest": date_latest,
+    }
+
+
+class AnalysisJob(DiskImageJob):
+    """State of a single disk image moving through the analysis pipeline."""
+
+    def __init__(
+        self,
+        file,
+        source,
+        diskimages_dir,
+        files_dir,
+        results_dir,
+        cache=None,
+        source_image=None,
+    ):
+        self.disk_results_dir = os.path.join(results_dir, file)
+        super().__init__(
+            file,
+            source,
+            root_dir=self.disk_results_dir,
+            diskimage_dir=os.path.join(diskimages_dir, file),
+            files_dir=os.path.join(files_dir, file),
+            dfxml_dir=self.disk_results_dir,
+            # parsed volumes are kept outside the reports
+            state_dir=os.path.dirname(results_dir),
+            cache=cache,
+            source_image=source_image,
+        )
+
+
+def scan_files(job):
+    """Run Brunnhilde (with bulk_extractor) against carved files."""
+    brunnhilde_dir = os.path.join(job.disk_results_dir, "brunnhilde")
+    if os.path.isdir(brunnhilde_dir):
+        shutil.rmtree(brunnhilde_dir)
+
+    subprocess.call(
+        "brunnhilde.py -zwb '{}' '{}'".format(job.files_dir, brunnhilde_dir),
+        shell=True,
+    )
+
+    return {"artifacts": [brunnhilde_dir]}
+
+
+def report_disk_image(destination, spreadsheet, dfxml_stats, job):
+    """Add row for disk image to analysis CSV while its results are at hand."""
+    # reuse DFXML statistics cached for identical disk images
+    entry = job.disk_image.cache_entry
+    if entry and "dfxml.xml" in entry["stats"]:
+        dfxml_stats.setdefault(
+            os.path.join(job.disk_results_dir, "dfxml.xml"), entry["stats"]["dfxml.xml"]
+        )
+
+    row = analysis_row(
+        job.disk_results_dir,
+        job.volumes,
+        logging.getLogger(),
+        dfxml_stats,
+        stats_dir=os.path.join(destination, ".dfxml"),
+    )
+    spreadsheet.add_row(row)
+    return {"data": {"row": row}}
+
+
+def resume_report_disk_image(spreadsheet, job, data):
+    """Add row written by an earlier run to analysis CSV."""
+    spreadsheet.add_row(data["row"])
+
+
+def clean_up(args, job):
+    """Remove staged disk image and, unless retained, carved files."""
+    shutil.rmtree(job.diskimage_dir, ignore_errors=True)
+
+    if not args.keepfiles:
+        shutil.rmtree(job.files_dir, ignore_errors=True)
+
+    return {"artifacts": [job.disk_results_dir]}
+
+
+def _make_pipeline(
+    args, destination, spreadsheet, dfxml_stats, on_error=None, journal=None
+):
+    """Return Pipeline with one stage per analysis step.
+
+    Copying and clean-up are I/O-bound and limited to two workers so they
+    do not saturate the disks; the remaining stages use --jobs workers.
+    Rows are added to the analysis CSV (AnalysisSpreadsheet) one at a time.
+    """
+    stages = disk_image_stages(args, destination) + [
+        Stage("scan", scan_files, workers=args.jobs),
+        Stage(
+            "cleanup",
+            functools.partial(clean_up, args),
+            workers=min(args.jobs, MAX_IO_WORKERS),
+        ),
+        Stage(
+            "report",
+            functools.partial(report_disk_image, destination, spreadsheet, dfxml_stats),
+            resume=functools.partial(resume_report_disk_image, spreadsheet),
+        ),
+    ]
+    return Pipeline(stages, on_error=on_error, journal=journal)
 
 
 def _make_parser():
@@ -287,6 +391,59 @@ def _make_parser():
         help="Export AppleDouble resource forks from HFS-formatted disks",
         action="store_true",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of disk images to process concurrently in each pipeline stage (default: 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--threads",
+        help="Number of threads shared by the disk images processed concurrently, for carving volumes and hashing files (default: number of CPUs)",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    parser.add_argument(
+        "--resume",
+        help="Resume an interrupted run in destination, skipping stages already completed for each disk image",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--hardlink",
+        help="Stage disk images as hard links to the source files when they cannot be cloned, instead of copying them. Source files must not be modified during the run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory in which to cache disktype and DFXML results by disk image checksum, to reuse for identical disk images in later runs",
+    )
+    parser.add_argument(
+        "--cache-size",
+        help="Maximum size of the result cache in GB (default: {})".format(
+            DEFAULT_CACHE_SIZE // 1024**3
+        ),
+        type=float,
+        default=DEFAULT_CACHE_SIZE / 1024**3,
+    )
+    parser.add_argument(
+        "--no-conversion",
+        help="Read EWF disk images through a read-only raw view mounted with ewfmount instead of converting them to raw with ewfexport",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--hash-profile",
+        help="Digests to record in DFXML written for HFS and UDF volumes: minimal (md5), archival (md5, sha256, sha512) or all (default: {})".format(
+            DEFAULT_HASH_PROFILE
+        ),
+        choices=sorted(HASH_PROFILES),
+        default=DEFAULT_HASH_PROFILE,
+    )
+    parser.add_argument(
+        "--always-disktype",
+        help="Always run disktype, instead of describing common partition maps and file systems with the built-in probe",
+        action="store_true",
+    )
     parser.add_argument("--quiet", action="store_true", help="Write only errors to log")
     parser.add_argument("source", help="Path to folder containing disk images")
     parser.add_argument("destination", help="Output destination")
@@ -318,13 +475,13 @@ def main():
     destination = os.path.abspath(args.destination)
 
     # create output directories
-    if os.path.exists(destination):
+    if os.path.exists(destination) and not args.resume:
         shutil.rmtree(destination)
     diskimages_dir = os.path.join(destination, "diskimages")
     files_dir = os.path.join(destination, "files")
     results_dir = os.path.join(destination, "reports")
     for dir_ in (destination, diskimages_dir, files_dir, results_dir):
-        os.makedirs(dir_)
+        os.makedirs(dir_, exist_ok=True)
 
     logger = _configure_logging(
         os.path.join(destination, "diskimageanalyzer.log"), args
@@ -333,92 +490,96 @@ def main():
     unanalyzed = []
     volumes = {}
 
-    for file in sorted(os.listdir(source)):
+    # list the source once; staging and duplicate detection use the index
+    source_index = SourceIndex(source)
+    images = []
+    for file in source_index.names:
         logger.info("Found disk image: {}".format(file))
 
-        if not file.lower().endswith(
-            (".e01", ".000", ".ewf", ".001", ".raw", ".img", ".dd", ".iso")
-        ):
+        if file not in source_index.images:
             logger.info("File is not a disk image. Skipping file.")
             continue
 
-        image_path = os.path.join(source, file)
-        image_id = os.path.splitext(file)[0]
-        image_ext = os.path.splitext(file)[1]
+        images.append(file)
 
-        disk_results_dir = os.path.join(results_dir, file)
-        os.makedirs(disk_results_dir)
+    failed = set()
 
-        # copy disk image and its subsequent parts and sidecars to objects dir
-        # and used copied image moving forward
-        for file_ in os.listdir(args.source):
-            if file_.startswith(image_id):
-                shutil.copyfile(
-                    os.path.join(args.source, file_),
-                    os.path.join(diskimages_dir, file_),
-                )
-        image_path = os.path.join(diskimages_dir, file)
+    def _on_error(job, stage, err):
+        failed.add(job.file)
 
-        disk_files_dir = os.path.join(files_dir, file)
+    cache = None
+    if args.cache_dir:
+        cache = ResultCache(args.cache_dir, max_size=int(args.cache_size * 1024**3))
 
-        disk_image = DiskImage(image_path)
-        disk_image.run_disktype(os.path.join(disk_results_dir, "disktype.txt"))
-        disk_volumes = disk_image.carve_files_from_all_volumes(
-            destination_path=disk_files_dir,
-            export_unallocated=args.exportall,
-            appledouble_resforks=args.resforks,
-            dfxml_directory=disk_results_dir,
+    jobs = []
+    for file in images:
+        job = AnalysisJob(
+            file,
+            source,
+            diskimages_dir,
+            files_dir,
+            results_dir,
+            cache=cache,
+            source_image=source_index.images[file],
         )
+        job.disk_image.hash_profile = args.hash_profile
+        job.disk_image.workers = image_workers(args)
+        jobs.append(job)
+    run_cache = share_results(jobs, source_index, cache, destination)
+
+    # rows are written to analysis csv as each disk image finishes
+    spreadsheet = AnalysisSpreadsheet(os.path.join(destination, "analysis.csv"))
+    dfxml_stats = {}
+
+    journal = StageJournal(os.path.join(destination, JOURNAL_FILENAME))
+    pipeline = _make_pipeline(
+        args,
+        destination,
+        spreadsheet,
+        dfxml_stats,
+        on_error=_on_error,
+        journal=journal,
+    )
+    pipeline.run(jobs)
 
-        volumes[file] = disk_volumes
-
-        if not os.path.isdir(disk_files_dir) or not os.listdir(disk_files_dir):
-            logger.error("No files carved from disk image {} - skipping")
-            unanalyzed.append(os.path.basename(image_path))
-
-        subprocess.call(
-            "brunnhilde.py -zwb '{}' '{}'".format(
-                disk_files_dir, os.path.join(disk_results_dir, "brunnhilde")
-            ),
-            shell=True,
-        )
+    report_identical_images(jobs)
+    remove_scratch_dirs(destination)
 
-        if not args.keepfiles:
-            shutil.rmtree(disk_files_dir)
+    for job in jobs:
+        if job.file in failed:
+            unanalyzed.append(job.file)
+            continue
+        volumes[job.file] = job.volumes
+        if not job.files_carved:
+            unanalyzed.append(job.file)
 
     shutil.rmtree(diskimages_dir)
 
     if not args.keepfiles:
         shutil.rmtree(files_dir)
 
-    # create analysis csv, write header, and close file
-    ANALYSIS_CSV_PATH = os.path.join(destination, "analysis.csv")
-    spreadsheet = open(ANALYSIS_CSV_PATH, "w")
-    writer = csv.writer(spreadsheet, quoting=csv.QUOTE_NONNUMERIC)
-    header_list = [
-        "Disk image",
-        "Volumes",
-        "File systems",
-        "Date statement",
-        "Date begin",
-        "Date end",
-        "Extent",
-        "Virus found",
-        "Content description",
-    ]
-    writer.writerow(header_list)
+    # add rows for disks that did not reach the report stage
+    for item in sorted(os.listdir(results_dir)):
+        if item not in spreadsheet:
+            spreadsheet.add_row(
+                analysis_row(
+                    os.path.join(results_dir, item),
+                    volumes.get(item, []),
+                    logger,
+                    dfxml_stats,
+                    stats_dir=os.path.join(destination, ".dfxml"),
+                )
+            )
     spreadsheet.close()
 
-    # add info to analysis csv for each SIP
-    for item in sorted(os.listdir(results_dir)):
-        disk_result = os.path.join(results_dir, item)
-        write_to_spreadsheet(
-            disk_result,
-            volumes,
-            os.path.join(destination, "analysis.csv"),
-            args.exportall,
-            logger,
-        )
+    cache_dfxml_stats(
+        jobs,
+        dfxml_stats,
+        lambda job: os.path.join(job.disk_results_dir, "dfxml.xml"),
+    )
+
+    if run_cache is not cache:
+        shutil.rmtree(run_cache.cache_dir, ignore_errors=True)
 
     # write closing message
     if unanalyzed:
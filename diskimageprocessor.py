@@ -25,8 +25,10 @@ https://bitarchivist.net
 """
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import csv
 import datetime
+import functools
 import itertools
 import logging
 import os
@@ -36,15 +38,49 @@ import sys
 import time
 
 from disk_image_toolkit import DiskImage
-from disk_image_toolkit.dfxml import objects
+from disk_image_toolkit.bag import DEFAULT_ALGORITHMS as BAG_ALGORITHMS, make_bag
+from disk_image_toolkit.cache import DEFAULT_CACHE_SIZE, ResultCache
+from disk_image_toolkit.checksums import digests_from_dfxml, write_checksum_manifests
+from disk_image_toolkit.disk_image import DEFAULT_HASH_PROFILE, HASH_PROFILES
+from disk_image_toolkit.exception import DFXMLError
+from disk_image_toolkit.journal import JOURNAL_FILENAME, StageJournal
+from disk_image_toolkit.pipeline import Pipeline, Stage
+from disk_image_toolkit.source_index import SourceIndex
+from disk_image_toolkit.stages import (
+    MAX_IO_WORKERS,
+    DiskImageJob,
+    cache_dfxml_stats,
+    disk_image_stages,
+    image_workers,
+    remove_scratch_dirs,
+    report_identical_images,
+    share_results,
+)
+from disk_image_toolkit.summary import DFXMLSummary, summarize_dfxml
 from disk_image_toolkit.util import human_readable_size
 
 
 THIS_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
 
 
-def create_spreadsheet(args, sips, volumes, logger):
-    """Create csv describing created SIPs"""
+def create_spreadsheet(
+    args, sips, volumes, logger, dfxml_stats=None, stats_dir=None, workers=1
+):
+    """Create csv describing created SIPs
+
+    dfxml_stats maps DFXML paths to statistics already known (e.g. from the
+    result cache). Those files are not parsed again; statistics parsed here
+    are added to it.
+
+    If stats_dir is given, statistics of each DFXML file are also kept in a
+    sidecar there, outside the SIPs, so the csv can be rebuilt without
+    parsing DFXML again.
+
+    SIPs are described by up to workers processes. Rows are written in
+    sorted order of SIP; a SIP that cannot be described gets an error row.
+    """
+    if dfxml_stats is None:
+        dfxml_stats = {}
 
     # open description spreadsheet
     csv_path = os.path.abspath(os.path.join(args.destination, "description.csv"))
@@ -82,313 +118,468 @@ def create_spreadsheet(args, sips, volumes, logger):
         ]
         writer.writerow(header_list)
 
-        # process each SIP
-        for item in sorted(os.listdir(sips)):
-            sip_path = os.path.join(sips, item)
+        items = [
+            item
+            for item in sorted(os.listdir(sips))
+            if os.path.isdir(os.path.join(sips, item))
+        ]
+        describe = functools.partial(
+            _describe_sip,
+            args,
+            sips,
+            logger=logger,
+            dfxml_stats=dfxml_stats,
+            stats_dir=stats_dir,
+        )
+        tasks = [(item, volumes.get(item, [])) for item in items]
 
-            if not os.path.isdir(sip_path):
-                continue
+        # process each SIP; results are read in submission order
+        executor = None
+        if workers > 1 and len(tasks) > 1:
+            executor = ProcessPoolExecutor(max_workers=min(workers, len(tasks)))
+            results = [executor.submit(describe, *task).result for task in tasks]
+        else:
+            results = [functools.partial(describe, *task) for task in tasks]
+        try:
+            for item, result in zip(items, results):
+                sip_path = os.path.join(sips, item)
+                try:
+                    row, described, parsed_stats, elapsed = result()
+                except Exception as err:
+                    logger.error(f"Unable to describe {sip_path}: {err}")
+                    writer.writerow(_error_row(item))
+                    continue
+                dfxml_stats.update(parsed_stats)
+                writer.writerow(row)
+                if not described:
+                    logger.error("Unable to read DFXML files for {}".format(sip_path))
+                    continue
+                logger.info(
+                    "Described %s successfully in %.2f seconds." % (sip_path, elapsed)
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
 
-            disk_volumes = volumes[item]
-            number_volumes = len(disk_volumes)
+    logger.info("Description CSV created.")
 
-            date_earliest = ""
-            date_latest = ""
 
-            # Get and sum information from all DFXML files generated
-            dfxml_files = []
-            subdoc_dir = os.path.join(sip_path, "metadata", "submissionDocumentation")
-            if args.bagfiles:
-                subdoc_dir = os.path.join(
-                    sip_path, "data", "metadata", "submissionDocumentation"
-                )
-            for root, _, files in os.walk(subdoc_dir):
-                for file in files:
-                    if file.startswith("dfxml"):
-                        dfxml_files.append(os.path.join(root, file))
-
-            dfxml_files_info = []
-            for dfxml_file in dfxml_files:
-                dfxml_info = _parse_dfxml(dfxml_file, logger)
-                if not dfxml_info:
-                    logger.warning(
-                        "No fileobjects in DFXML file {} - possibly file system fiwalk doesn't recognize".format(
-                            dfxml_file
-                        )
-                    )
-                    continue
-                dfxml_files_info.append(dfxml_info)
-
-            file_count = sum([dfxml_info["files"] for dfxml_info in dfxml_files_info])
-            total_bytes = sum([dfxml_info["bytes"] for dfxml_info in dfxml_files_info])
-            file_systems = [volume["file_system"] for volume in disk_volumes]
-            # Deduplicate list
-            file_systems = list(dict.fromkeys(file_systems))
-            file_systems_str = ", ".join(file_systems)
-
-            for dfxml_info in dfxml_files_info:
-                if not date_earliest or dfxml_info["date_earliest"] < date_earliest:
-                    date_earliest = dfxml_info["date_earliest"]
-                if not date_latest or dfxml_info["date_latest"] > date_latest:
-                    date_latest = dfxml_info["date_latest"]
-
-            if file_count == 0:
-                writer.writerow(
-                    [
-                        "",
-                        item,
-                        "",
-                        "",
-                        "Error",
-                        "Error",
-                        "Error",
-                        "File",
-                        "Error",
-                        "Error gathering statistics from SIP directory.",
-                        "",
-                        "",
-                        "",
-                        "",
-                        "",
-                        "",
-                        "",
-                        "",
-                        "",
-                        "",
-                        "",
-                        "",
-                        "",
-                        "",
-                        "",
-                        "",
-                    ]
-                )
-                logger.error("Unable to read DFXML files for {}".format(sip_path))
-                continue
-
-            # Get file formats from Brunnhilde
-            file_formats = []
-            file_format_csv = os.path.join(
-                sip_path,
-                "metadata",
-                "submissionDocumentation",
-                "brunnhilde",
-                "csv_reports",
-                "formats.csv",
+def _describe_sip(
+    args, sips, item, disk_volumes, logger, dfxml_stats=None, stats_dir=None
+):
+    """Return description csv row of one SIP.
+
+    May run in another process, so statistics parsed from DFXML are
+    returned rather than added to dfxml_stats.
+
+    :returns: Tuple of csv row (list), whether statistics were gathered
+        (bool), dict of DFXML path to statistics parsed (dict) and seconds
+        spent (float). If statistics were not gathered, the row records an
+        error.
+    """
+    start_time = time.monotonic()
+    if dfxml_stats is None:
+        dfxml_stats = {}
+    parsed_stats = {}
+
+    sip_path = os.path.join(sips, item)
+    number_volumes = len(disk_volumes)
+
+    date_earliest = ""
+    date_latest = ""
+
+    # Use statistics gathered while carving each volume, else get and sum
+    # information from all DFXML files generated
+    volume_stats = [volume.get("stats") for volume in disk_volumes]
+    dfxml_files = []
+    dfxml_files_info = []
+    if disk_volumes and all(volume_stats):
+        dfxml_files_info = [
+            _summary_info(DFXMLSummary.from_dict(stats)) for stats in volume_stats
+        ]
+    else:
+        subdoc_dir = os.path.join(sip_path, "metadata", "submissionDocumentation")
+        if args.bagfiles:
+            subdoc_dir = os.path.join(
+                sip_path, "data", "metadata", "submissionDocumentation"
             )
-            if args.bagfiles:
-                file_format_csv = os.path.join(
-                    sip_path,
-                    "data",
-                    "metadata",
-                    "submissionDocumentation",
-                    "brunnhilde",
-                    "csv_reports",
-                    "formats.csv",
+        for root, _, files in os.walk(subdoc_dir):
+            for file in files:
+                if file.startswith("dfxml") and file.endswith(".xml"):
+                    dfxml_files.append(os.path.join(root, file))
+
+    for dfxml_file in dfxml_files:
+        dfxml_info = dfxml_stats.get(dfxml_file)
+        if dfxml_info is None:
+            sidecar_path = None
+            if stats_dir:
+                sidecar_path = os.path.join(
+                    stats_dir, os.path.relpath(dfxml_file, sips) + ".json"
                 )
-
-            try:
-                with open(file_format_csv, "r") as f:
-                    reader = csv.reader(f)
-                    next(reader)
-                    for row in itertools.islice(reader, 5):
-                        file_formats.append(row[0])
-            except:
-                file_formats.append(
-                    "ERROR! No Brunnhilde formats.csv file to pull formats from."
+            dfxml_info = _parse_dfxml(dfxml_file, logger, sidecar_path=sidecar_path)
+            parsed_stats[dfxml_file] = dfxml_info
+        if not dfxml_info:
+            logger.warning(
+                "No fileobjects in DFXML file {} - possibly file system fiwalk doesn't recognize".format(
+                    dfxml_file
                 )
+            )
+            continue
+        dfxml_files_info.append(dfxml_info)
+
+    file_count = sum([dfxml_info["files"] for dfxml_info in dfxml_files_info])
+    total_bytes = sum([dfxml_info["bytes"] for dfxml_info in dfxml_files_info])
+    file_systems = [volume["file_system"] for volume in disk_volumes]
+    # Deduplicate list
+    file_systems = list(dict.fromkeys(file_systems))
+    file_systems_str = ", ".join(file_systems)
+
+    for dfxml_info in dfxml_files_info:
+        if not date_earliest or dfxml_info["date_earliest"] < date_earliest:
+            date_earliest = dfxml_info["date_earliest"]
+        if not date_latest or dfxml_info["date_latest"] > date_latest:
+            date_latest = dfxml_info["date_latest"]
+
+    if file_count == 0 or not disk_volumes:
+        return _error_row(item), False, parsed_stats, time.monotonic() - start_time
+
+    # Get file formats from Brunnhilde
+    file_formats = []
+    file_format_csv = os.path.join(
+        sip_path,
+        "metadata",
+        "submissionDocumentation",
+        "brunnhilde",
+        "csv_reports",
+        "formats.csv",
+    )
+    if args.bagfiles:
+        file_format_csv = os.path.join(
+            sip_path,
+            "data",
+            "metadata",
+            "submissionDocumentation",
+            "brunnhilde",
+            "csv_reports",
+            "formats.csv",
+        )
 
-            file_formats = [element or "Unidentified" for element in file_formats]
-            file_formats_str = ", ".join(file_formats)
+    try:
+        with open(file_format_csv, "r") as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in itertools.islice(reader, 5):
+                file_formats.append(row[0])
+    except:
+        file_formats.append(
+            "ERROR! No Brunnhilde formats.csv file to pull formats from."
+        )
 
-            if date_earliest[:4] == date_latest[:4]:
-                date_statement = date_earliest[:4]
-            else:
-                date_statement = "{}-{}".format(date_earliest[:4], date_latest[:4])
+    file_formats = [element or "Unidentified" for element in file_formats]
+    file_formats_str = ", ".join(file_formats)
 
-            extent = "{} digital files ({})".format(
-                file_count, human_readable_size(total_bytes)
-            )
+    if date_earliest[:4] == date_latest[:4]:
+        date_statement = date_earliest[:4]
+    else:
+        date_statement = "{}-{}".format(date_earliest[:4], date_latest[:4])
 
-            if number_volumes > 1:
-                scope_content = "Files exported from {} volumes with file systems: {}. File formats: {}".format(
-                    number_volumes, file_systems_str, file_formats_str
-                )
-            else:
-                scope_content = "Files exported from {} file system volume. File formats: {}".format(
-                    disk_volumes[0]["file_system"], file_formats_str
-                )
+    extent = "{} digital files ({})".format(
+        file_count, human_readable_size(total_bytes)
+    )
 
-            # write csv row
-            writer.writerow(
-                [
-                    "",
-                    item,
-                    "",
-                    "",
-                    date_statement,
-                    date_earliest,
-                    date_latest,
-                    "File",
-                    extent,
-                    scope_content,
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                ]
+    if number_volumes > 1:
+        scope_content = "Files exported from {} volumes with file systems: {}. File formats: {}".format(
+            number_volumes, file_systems_str, file_formats_str
+        )
+    else:
+        scope_content = (
+            "Files exported from {} file system volume. File formats: {}".format(
+                disk_volumes[0]["file_system"], file_formats_str
             )
+        )
 
-            logger.info("Described %s successfully." % (sip_path))
+    row = [
+        "",
+        item,
+        "",
+        "",
+        date_statement,
+        date_earliest,
+        date_latest,
+        "File",
+        extent,
+        scope_content,
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+    ]
+    return row, True, parsed_stats, time.monotonic() - start_time
+
+
+def _error_row(item):
+    """Return description csv row of a SIP that could not be described."""
+    return [
+        "",
+        item,
+        "",
+        "",
+        "Error",
+        "Error",
+        "Error",
+        "File",
+        "Error",
+        "Error gathering statistics from SIP directory.",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "",
+    ]
+
+
+def _parse_dfxml(dfxml_path, logger, export_all=False, sidecar_path=None):
+    """Parse DFXML and return dict of information for spreadsheet.
+
+    If sidecar_path is given, statistics saved there are used while the
+    DFXML file is unchanged, and are saved there after parsing.
+    """
+    try:
+        summary = summarize_dfxml(
+            dfxml_path, export_all=export_all, sidecar_path=sidecar_path
+        )
+    except DFXMLError as err:
+        logger.error(str(err))
+        return
 
-    logger.info("Description CSV created.")
+    return _summary_info(summary)
 
 
-def _parse_dfxml(dfxml_path, logger, export_all=False):
-    """Parse DFXML and return dict of information for spreadsheet."""
-    volume_info = {
-        "files": 0,
-        "bytes": 0,
-        "date_earliest": "",
-        "date_latest": "",
+def _summary_info(summary):
+    """Return dict of information for spreadsheet from DFXMLSummary."""
+    date_earliest, date_latest = summary.date_range(str(datetime.datetime.now().year))
+    return {
+        "files": summary.files,
+        "bytes": summary.bytes,
+        "date_earliest": date_earliest,
+        "date_latest": date_latest,
     }
 
-    mtimes = []
-    ctimes = []
-    crtimes = []
 
-    try:
-        for event, obj in objects.iterparse(dfxml_path):
-            if not isinstance(obj, objects.FileObject):
-                continue
+def keep_logical_files_only(objects_dir):
+    """Remove disk image from SIP and repackage
 
-            # skip directories and links
-            if obj.name_type:
-                if obj.name_type != "r":
-                    continue
+    Safe to call again after an interrupted run.
+    """
 
-            # skip unallocated unless we exported all files
-            if not export_all:
-                if obj.unalloc:
-                    if obj.unalloc == 1:
-                        continue
-
-            volume_info["files"] += 1
-
-            try:
-                mtime = obj.mtime
-                mtime = str(mtime)
-                mtimes.append(mtime)
-            except:
-                pass
-
-            try:
-                ctime = obj.ctime
-                ctime = str(ctime)
-                ctimes.append(ctime)
-            except:
-                pass
-
-            try:
-                crtime = obj.crtime
-                crtime = str(crtime)
-                crtimes.append(crtime)
-            except:
-                pass
-
-            volume_info["bytes"] += obj.filesize
-
-        # filter "None" values from date lists
-        for date_list in mtimes, ctimes, crtimes:
-            while "None" in date_list:
-                date_list.remove("None")
-
-        # determine earliest and latest MAC dates from lists
-        date_earliest_m = ""
-        date_latest_m = ""
-        date_earliest_c = ""
-        date_latest_c = ""
-        date_earliest_cr = ""
-        date_latest_cr = ""
-        date_statement = ""
-
-        if mtimes:
-            date_earliest_m = min(mtimes)
-            date_latest_m = max(mtimes)
-        if ctimes:
-            date_earliest_c = min(ctimes)
-            date_latest_c = max(ctimes)
-        if crtimes:
-            date_earliest_cr = min(crtimes)
-            date_latest_cr = max(crtimes)
-
-        # determine which set of dates to use (logic: use set with earliest start date,
-        # default to date modified)
-        use_ctimes = False
-        use_crtimes = False
-
-        if not date_earliest_m:
-            date_earliest_m = str(datetime.datetime.now().year)
-            date_latest_m = str(datetime.datetime.now().year)
-        date_to_use = date_earliest_m
-
-        if date_earliest_c:
-            if date_earliest_c < date_to_use:
-                date_to_use = date_earliest_c
-                use_ctimes = True
-        if date_earliest_cr:
-            if date_earliest_cr < date_to_use:
-                date_to_use = date_earliest_cr
-                use_ctimes = False
-                use_crtimes = True
-
-        if use_ctimes:
-            date_earliest = date_earliest_c[:10]
-            date_latest = date_latest_c[:10]
-        elif use_crtimes:
-            date_earliest = date_earliest_cr[:10]
-            date_latest = date_latest_cr[:10]
-        else:
-            date_earliest = date_earliest_m[:10]
-            date_latest = date_latest_m[:10]
+    # get list of files in files dir
+    files_dir = os.path.join(objects_dir, "files")
+    if os.path.isdir(files_dir):
+        files = os.listdir(files_dir)
+        files = [os.path.join(files_dir, filename) for filename in files]
+
+        # move files up one directory
+        for f in files:
+            shutil.move(f, objects_dir)
+
+        # delete file dir
+        shutil.rmtree(files_dir)
+
+    # delete diskimage dir
+    diskimage_dir = os.path.join(objects_dir, "diskimage")
+    if os.path.isdir(diskimage_dir):
+        shutil.rmtree(diskimage_dir)
+
+
+class SIPJob(DiskImageJob):
+    """State of a single disk image moving through the processing pipeline."""
+
+    def __init__(self, file, source, sips, cache=None, source_image=None):
+        self.sip_dir = os.path.join(sips, file)
+        self.object_dir = os.path.join(self.sip_dir, "objects")
+        self.metadata_dir = os.path.join(self.sip_dir, "metadata")
+        self.subdoc_dir = os.path.join(self.metadata_dir, "submissionDocumentation")
+        super().__init__(
+            file,
+            source,
+            root_dir=self.sip_dir,
+            diskimage_dir=os.path.join(self.object_dir, "diskimage"),
+            files_dir=os.path.join(self.object_dir, "files"),
+            dfxml_dir=self.subdoc_dir,
+            # digests and parsed volumes are kept outside the SIP
+            state_dir=os.path.dirname(sips),
+            cache=cache,
+            source_image=source_image,
+        )
 
-        volume_info["date_earliest"] = date_earliest
-        volume_info["date_latest"] = date_latest
 
-    except Exception as err:
-        logger.error("Error reading DFXML file {}: {}".format(dfxml_path, err))
-        return
+def _staging_algorithms(args):
+    """Return algorithms of the checksum manifests, to hash while staging."""
+    if args.bagfiles:
+        return list(BAG_ALGORITHMS)
+    return ["md5"] + args.extra_checksums
 
-    return volume_info
 
+def scan_files(args, job):
+    """Run Brunnhilde against carved files."""
+    brunnhilde_dir = os.path.join(job.subdoc_dir, "brunnhilde")
+    if os.path.isdir(brunnhilde_dir):
+        shutil.rmtree(brunnhilde_dir)
 
-def keep_logical_files_only(objects_dir):
-    """Remove disk image from SIP and repackage"""
+    if args.piiscan:
+        subprocess.call(
+            'brunnhilde.py -zb "{}" "{}"'.format(job.files_dir, brunnhilde_dir),
+            shell=True,
+        )
+    else:
+        subprocess.call(
+            'brunnhilde.py -z "{}" "{}"'.format(job.files_dir, brunnhilde_dir),
+            shell=True,
+        )
 
-    # get list of files in files dir
-    files_dir = os.path.join(objects_dir, "files")
-    files = os.listdir(files_dir)
-    files = [os.path.join(files_dir, filename) for filename in files]
+    return {"artifacts": [brunnhilde_dir]}
 
-    # move files up one directory
-    for f in files:
-        shutil.move(f, objects_dir)
 
-    # delete file and diskimage dirs
-    shutil.rmtree(files_dir)
-    shutil.rmtree(os.path.join(objects_dir, "diskimage"))
+def package_sip(args, job):
+    """Write checksum manifest or bag SIP."""
+    if args.filesonly:
+        keep_logical_files_only(job.object_dir)
+
+    # write checksums
+    if args.bagfiles:
+        manifests = make_bag(
+            job.sip_dir,
+            known_digests=_known_digests(args, job),
+            workers=image_workers(args),
+        )
+    else:
+        manifests = _write_checksum_manifests(args, job)
+
+    return {"artifacts": manifests}
+
+
+def _disk_dfxml_path(args, job):
+    """Return path of fiwalk DFXML in job's SIP once packaged."""
+    if args.bagfiles:
+        return os.path.join(
+            job.sip_dir, "data", "metadata", "submissionDocumentation", "dfxml.xml"
+        )
+    return os.path.join(job.subdoc_dir, "dfxml.xml")
+
+
+def _known_digests(args, job):
+    """Return digests of SIP files already computed earlier in the pipeline.
+
+    Digests come from the staging sidecar (disk image and sidecars) and
+    from DFXML (carved files). They are only reused if file sizes match.
+    """
+    logger = logging.getLogger()
+
+    files_dir = job.object_dir if args.filesonly else job.files_dir
+    tsk_volumes = [
+        volume
+        for volume in job.volumes
+        if DiskImage.is_tsk_file_system(volume["file_system"])
+    ]
+    dfxml_roots = [
+        (
+            os.path.join(
+                job.subdoc_dir, "dfxml_{}.xml".format(volume["output_directory_name"])
+            ),
+            os.path.join(files_dir, volume["output_directory_name"]),
+            None,
+        )
+        for volume in job.volumes
+    ]
+    # fiwalk DFXML paths are relative to a volume, so they are mapped onto
+    # carved files by partition offset, or when there is a single TSK volume
+    for volume in tsk_volumes:
+        if len(tsk_volumes) == 1 or volume.get("offset") is not None:
+            dfxml_roots.append(
+                (
+                    os.path.join(job.subdoc_dir, "dfxml.xml"),
+                    os.path.join(files_dir, volume["output_directory_name"]),
+                    volume.get("offset"),
+                )
+            )
+
+    known_digests = {}
+    for dfxml_path, root_dir, offset in dfxml_roots:
+        if not os.path.isfile(dfxml_path) or not os.path.isdir(root_dir):
+            continue
+        try:
+            known_digests.update(digests_from_dfxml(dfxml_path, root_dir, offset))
+        except Exception as err:
+            logger.warning(f"Unable to read digests from {dfxml_path}: {err}")
+    known_digests.update(job.digest_sidecar().known_digests())
+
+    return known_digests
+
+
+def _write_checksum_manifests(args, job):
+    """Write checksum manifests of objects, reusing digests already known."""
+    logger = logging.getLogger()
+
+    manifests = {
+        algorithm: os.path.join(job.metadata_dir, f"checksum.{algorithm}")
+        for algorithm in ["md5"] + args.extra_checksums
+    }
+    stats = write_checksum_manifests(
+        job.object_dir,
+        manifests,
+        start=job.metadata_dir,
+        known_digests=_known_digests(args, job),
+        workers=image_workers(args),
+    )
+    logger.info(
+        "Checksums written for {}: {} files hashed, {} reused, {} errors".format(
+            job, stats["hashed"], stats["reused"], stats["errors"]
+        )
+    )
+
+    return list(manifests.values())
+
+
+def _make_pipeline(args, destination, on_error=None, journal=None):
+    """Return Pipeline with one stage per processing step.
+
+    Copying and packaging are I/O-bound and limited to two workers so they
+    do not saturate the disks; the remaining stages use --jobs workers.
+    """
+    stages = disk_image_stages(
+        args, destination, algorithms=_staging_algorithms(args)
+    ) + [
+        Stage("scan", functools.partial(scan_files, args), workers=args.jobs),
+        Stage(
+            "package",
+            functools.partial(package_sip, args),
+            workers=min(args.jobs, MAX_IO_WORKERS),
+        ),
+    ]
+    return Pipeline(stages, on_error=on_error, journal=journal)
 
 
 def _make_parser():
@@ -423,6 +614,67 @@ def _make_parser():
         help="Export AppleDouble resource forks from HFS-formatted disks",
         action="store_true",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of disk images to process concurrently in each pipeline stage (default: 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--threads",
+        help="Number of threads shared by the disk images processed concurrently, for carving volumes and hashing files (default: number of CPUs)",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    parser.add_argument(
+        "--resume",
+        help="Resume an interrupted run in destination, skipping stages already completed for each disk image",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--extra-checksum",
+        help="Also write a checksum manifest with this algorithm alongside checksum.md5 (may be repeated)",
+        dest="extra_checksums",
+        action="append",
+        choices=("sha1", "sha256", "sha512"),
+        default=[],
+    )
+    parser.add_argument(
+        "--hardlink",
+        help="Stage disk images as hard links to the source files when they cannot be cloned, instead of copying them. Source files must not be modified during the run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory in which to cache disktype and DFXML results by disk image checksum, to reuse for identical disk images in later runs",
+    )
+    parser.add_argument(
+        "--cache-size",
+        help="Maximum size of the result cache in GB (default: {})".format(
+            DEFAULT_CACHE_SIZE // 1024**3
+        ),
+        type=float,
+        default=DEFAULT_CACHE_SIZE / 1024**3,
+    )
+    parser.add_argument(
+        "--no-conversion",
+        help="Read EWF disk images through a read-only raw view mounted with ewfmount instead of converting them to raw with ewfexport",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--hash-profile",
+        help="Digests to record in DFXML written for HFS and UDF volumes: minimal (md5), archival (md5, sha256, sha512) or all (default: {})".format(
+            DEFAULT_HASH_PROFILE
+        ),
+        choices=sorted(HASH_PROFILES),
+        default=DEFAULT_HASH_PROFILE,
+    )
+    parser.add_argument(
+        "--always-disktype",
+        help="Always run disktype, instead of describing common partition maps and file systems with the built-in probe",
+        action="store_true",
+    )
     parser.add_argument("--quiet", action="store_true", help="Write only errors to log")
     parser.add_argument(
         "source", help="Source directory containing disk images (and related files)"
@@ -453,12 +705,13 @@ def main():
     args = parser.parse_args()
 
     # create output directories
+    source = os.path.abspath(args.source)
     destination = os.path.abspath(args.destination)
     sips = os.path.abspath(os.path.join(destination, "SIPs"))
-    if os.path.exists(destination):
+    if os.path.exists(destination) and not args.resume:
         shutil.rmtree(destination)
     for dir_ in (destination, sips):
-        os.makedirs(dir_)
+        os.makedirs(dir_, exist_ok=True)
 
     logger = _configure_logging(
         os.path.join(destination, "diskimageprocessor.log"), args
@@ -467,108 +720,79 @@ def main():
     unprocessed = []
     volumes = {}
 
-    for file in sorted(os.listdir(args.source)):
+    # list the source once; staging and duplicate detection use the index
+    source_index = SourceIndex(source)
+    images = []
+    for file in source_index.names:
         logger.info("Found disk image: {}".format(file))
 
-        if not file.lower().endswith(
-            (".e01", ".000", ".ewf", ".001", ".raw", ".img", ".dd", ".iso")
-        ):
+        if file not in source_index.images:
             logger.info("File is not a disk image. Skipping file.")
             continue
 
-        image_path = os.path.join(args.source, file)
-        image_id = os.path.splitext(file)[0]
-        image_ext = os.path.splitext(file)[1]
-
-        # create new folders
-        sip_dir = os.path.join(sips, file)
-        object_dir = os.path.join(sip_dir, "objects")
-        diskimage_dir = os.path.join(object_dir, "diskimage")
-        files_dir = os.path.join(object_dir, "files")
-        metadata_dir = os.path.join(sip_dir, "metadata")
-        subdoc_dir = os.path.join(metadata_dir, "submissionDocumentation")
-
-        for folder in (
-            sip_dir,
-            object_dir,
-            diskimage_dir,
-            files_dir,
-            metadata_dir,
-            subdoc_dir,
-        ):
-            os.makedirs(folder)
-
-        # copy disk image and its subsequent parts and sidecars to objects dir
-        # and used copied image moving forward
-        for file_ in os.listdir(args.source):
-            if file_.startswith(image_id):
-                try:
-                    shutil.copyfile(
-                        os.path.join(args.source, file_),
-                        os.path.join(diskimage_dir, file_),
-                    )
-                except:
-                    logger.error(
-                        "ERROR: File {} not successfully copied to {}".format(
-                            file_, diskimage_dir
-                        )
-                    )
-        image_path = os.path.join(diskimage_dir, file)
-
-        disk_image = DiskImage(image_path)
-        disk_image.run_disktype(os.path.join(subdoc_dir, "disktype.txt"))
-        disk_volumes = disk_image.carve_files_from_all_volumes(
-            destination_path=files_dir,
-            export_unallocated=args.exportall,
-            appledouble_resforks=args.resforks,
-            dfxml_directory=subdoc_dir,
-        )
+        images.append(file)
 
-        volumes[file] = disk_volumes
+    failed = set()
 
-        if not os.path.isdir(files_dir) or not os.listdir(files_dir):
-            logger.error("No files carved from disk image {} - skipping")
-            unprocessed.append(os.path.basename(image_path))
+    def _on_error(job, stage, err):
+        failed.add(job.file)
 
-        if args.piiscan:
-            subprocess.call(
-                'brunnhilde.py -zb "{}" "{}"'.format(
-                    files_dir, os.path.join(subdoc_dir, "brunnhilde")
-                ),
-                shell=True,
-            )
-        else:
-            subprocess.call(
-                'brunnhilde.py -z "{}" "{}"'.format(
-                    files_dir, os.path.join(subdoc_dir, "brunnhilde")
-                ),
-                shell=True,
-            )
+    cache = None
+    if args.cache_dir:
+        cache = ResultCache(args.cache_dir, max_size=int(args.cache_size * 1024**3))
 
-        if args.filesonly:
-            keep_logical_files_only(object_dir)
+    jobs = []
+    for file in images:
+        job = SIPJob(
+            file, source, sips, cache=cache, source_image=source_index.images[file]
+        )
+        job.disk_image.hash_profile = args.hash_profile
+        job.disk_image.workers = image_workers(args)
+        jobs.append(job)
+    run_cache = share_results(jobs, source_index, cache, destination)
+
+    journal = StageJournal(os.path.join(destination, JOURNAL_FILENAME))
+    pipeline = _make_pipeline(args, destination, on_error=_on_error, journal=journal)
+    pipeline.run(jobs)
+
+    report_identical_images(jobs)
+    remove_scratch_dirs(destination)
+
+    # collect results in sorted order regardless of completion order
+    for job in jobs:
+        if job.file in failed:
+            unprocessed.append(job.file)
+            continue
+        volumes[job.file] = job.volumes
+        if not job.files_carved:
+            unprocessed.append(job.file)
 
-        # write checksums
-        if args.bagfiles:
-            # TODO: Multithread bagging via --processes when bug described at
-            # https://github.com/LibraryOfCongress/bagit-python/issues/130 is
-            # resolved.
-            subprocess.call(
-                'cd {} && bagit.py "{}"'.format(THIS_DIR, sip_dir),
-                shell=True,
-            )
-        else:
-            subprocess.call(
-                'cd "{}" && md5deep -rl ../objects > checksum.md5'.format(metadata_dir),
-                shell=True,
-            )
+    # reuse DFXML statistics cached for identical disk images
+    dfxml_stats = {}
+    for job in jobs:
+        entry = job.disk_image.cache_entry
+        if entry and "dfxml.xml" in entry["stats"]:
+            dfxml_stats[_disk_dfxml_path(args, job)] = entry["stats"]["dfxml.xml"]
 
     # write description
     try:
-        create_spreadsheet(args, sips, volumes, logger)
+        create_spreadsheet(
+            args,
+            sips,
+            volumes,
+            logger,
+            dfxml_stats,
+            stats_dir=os.path.join(destination, ".dfxml"),
+            workers=args.jobs,
+        )
     except Exception as err:
         logger.error(f"Error creating description csv: {err}")
 
+    cache_dfxml_stats(jobs, dfxml_stats, functools.partial(_disk_dfxml_path, args))
+
+    if run_cache is not cache:
+        shutil.rmtree(run_cache.cache_dir, ignore_errors=True)
+
     # print unprocessed list
     if unprocessed:
         skipped_disks = ", ".join(unprocessed)
@@ -25,7 +25,9 @@ import subprocess
 import sys
 import time
 
+from disk_image_toolkit.bag import make_bag
 from disk_image_toolkit.dfxml import objects
+from disk_image_toolkit.summary import scan_dfxml
 from disk_image_toolkit.util import human_readable_size, time_to_int
 
 
@@ -67,13 +69,6 @@ def create_spreadsheet(args, destination, sip_dir, filename):
         current = os.path.abspath(sip_dir)
         # test if entry if directory
         if os.path.isdir(current):
-            # intialize values
-            number_files = 0
-            total_bytes = 0
-            mtimes = []
-            ctimes = []
-            crtimes = []
-
             # parse dfxml file
             if args.bagfiles == True:
                 dfxml_file = os.path.abspath(
@@ -94,53 +89,9 @@ def create_spreadsheet(args, destination, sip_dir, filename):
 
             # try to read DFXML file
             try:
-                # gather info for each FileObject
-                for event, obj in objects.iterparse(dfxml_file):
-                    # only work on FileObjects
-                    if not isinstance(obj, objects.FileObject):
-                        continue
-
-                    # skip directories and links
-                    if obj.name_type:
-                        if obj.name_type != "r":
-                            continue
-
-                    # skip unallocated if args.exportall is False
-                    if args.exportall == False:
-                        if obj.unalloc:
-                            if obj.unalloc == 1:
-                                continue
-
-                    # gather info
-                    number_files += 1
-
-                    try:
-                        mtime = obj.mtime
-                        mtime = str(mtime)
-                        mtimes.append(mtime)
-                    except:
-                        pass
-
-                    try:
-                        ctime = obj.ctime
-                        ctime = str(ctime)
-                        ctimes.append(ctime)
-                    except:
-                        pass
-
-                    try:
-                        crtime = obj.crtime
-                        crtime = str(crtime)
-                        crtimes.append(crtime)
-                    except:
-                        pass
-
-                    total_bytes += obj.filesize
-
-                # filter 'None' values from date lists
-                for date_list in mtimes, ctimes, crtimes:
-                    while "None" in date_list:
-                        date_list.remove("None")
+                summary = scan_dfxml(dfxml_file, export_all=args.exportall)
+                number_files = summary.files
+                total_bytes = summary.bytes
 
                 # build extent statement
                 size_readable = human_readable_size(total_bytes)
@@ -151,54 +102,9 @@ def create_spreadsheet(args, destination, sip_dir, filename):
                 else:
                     extent = "%d digital files (%s)" % (number_files, size_readable)
 
-                # determine earliest and latest MAC dates from lists
-                date_earliest_m = ""
-                date_latest_m = ""
-                date_earliest_c = ""
-                date_latest_c = ""
-                date_earliest_cr = ""
-                date_latest_cr = ""
-                date_statement = ""
-
-                if mtimes:
-                    date_earliest_m = min(mtimes)
-                    date_latest_m = max(mtimes)
-                if ctimes:
-                    date_earliest_c = min(ctimes)
-                    date_latest_c = max(ctimes)
-                if crtimes:
-                    date_earliest_cr = min(crtimes)
-                    date_latest_cr = max(crtimes)
-
-                # determine which set of dates to use (logic: use set with earliest start date)
-                use_ctimes = False
-                use_crtimes = False
-
-                if not date_earliest_m:
-                    date_earliest_m = "N/A"
-                    date_latest_m = "N/A"
-                date_to_use = date_earliest_m  # default to date modified
-
-                if date_earliest_c:
-                    if date_earliest_c < date_to_use:
-                        date_to_use = date_earliest_c
-                        use_ctimes = True
-                if date_earliest_cr:
-                    if date_earliest_cr < date_to_use:
-                        date_to_use = date_earliest_cr
-                        use_ctimes = False
-                        use_crtimes = True
-
-                # store date_earliest and date_latest values based on datetype used
-                if use_ctimes == True:
-                    date_earliest = date_earliest_c[:10]
-                    date_latest = date_latest_c[:10]
-                elif use_crtimes == True:
-                    date_earliest = date_earliest_cr[:10]
-                    date_latest = date_latest_cr[:10]
-                else:
-                    date_earliest = date_earliest_m[:10]
-                    date_latest = date_latest_m[:10]
+                # determine earliest and latest dates (logic: use set with earliest
+                # start date, default to date modified)
+                date_earliest, date_latest = summary.date_range("N/A")
 
                 # write date statement
                 if date_earliest[:4] == date_latest[:4]:
@@ -605,9 +511,7 @@ def main():
 
                 # write checksums
                 if args.bagfiles == True:  # bag entire SIP
-                    subprocess.call(
-                        "bagit.py --processes 4 '%s'" % (sip_dir), shell=True
-                    )
+                    make_bag(sip_dir)
                 else:  # write metadata/checksum.md5
                     subprocess.call(
                         "cd '%s' && md5deep -rl ../objects > checksum.md5"
@@ -0,0 +1,5 @@
+"""Make the front-end scripts importable from their unit tests."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
@@ -0,0 +1,165 @@
+"""Unit tests for diskimageanalyzer.py."""
+import argparse
+import csv
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from os.path import join as j
+from unittest import mock
+
+import diskimageanalyzer
+from disk_image_toolkit.summary import DFXMLSummary
+
+TEST_FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+FIXTURES_PATH = j(TEST_FILE_DIR, "fixtures")
+DFXML_FIXTURE = j(FIXTURES_PATH, "dfxml", "fat12.xml")
+
+LOGGER = logging.getLogger(__name__)
+
+
+def make_report(reports_dir, item):
+    """Create disk image results directory with the FAT12 DFXML fixture."""
+    disk_result = j(reports_dir, item)
+    os.makedirs(disk_result)
+    shutil.copyfile(DFXML_FIXTURE, j(disk_result, "dfxml.xml"))
+    return disk_result
+
+
+class TestAnalysisRow(unittest.TestCase):
+    """Tests for statistics gathered for analysis.csv rows."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.reports_dir = j(self.tmpdir, "reports")
+
+    def test_analysis_row_volume_stats(self):
+        """Test statistics gathered while carving are used without DFXML."""
+        disk_result = make_report(self.reports_dir, "disk.dd")
+        stats = DFXMLSummary()
+        stats.add_file(1024, {"mtime": "1999-03-01T10:00:00Z"})
+        volumes = [
+            {"file_system": "FAT12", "stats": stats.to_dict()},
+            {"file_system": "HFS", "stats": stats.to_dict()},
+        ]
+
+        with mock.patch.object(diskimageanalyzer, "_parse_dfxml") as parse_dfxml:
+            row = diskimageanalyzer.analysis_row(disk_result, volumes, LOGGER)
+
+        parse_dfxml.assert_not_called()
+        self.assertEqual(
+            row[:7],
+            [
+                "disk.dd",
+                2,
+                "FAT12, HFS",
+                "1999",
+                "1999-03-01",
+                "1999-03-01",
+                "2 digital files (2 KB)",
+            ],
+        )
+
+    def test_analysis_row_dfxml_fallback(self):
+        """Test disk DFXML is read once if volumes have no statistics.
+
+        Two TSK volumes outside partitions (e.g. an El Torito floppy image
+        in a bootable CD) share the disk DFXML and get no statistics.
+        """
+        disk_result = make_report(self.reports_dir, "cd.iso")
+        volumes = [{"file_system": "ISO9660"}, {"file_system": "FAT12"}]
+        dfxml_stats = {}
+
+        row = diskimageanalyzer.analysis_row(
+            disk_result, volumes, LOGGER, dfxml_stats=dfxml_stats
+        )
+
+        self.assertEqual(list(dfxml_stats), [j(disk_result, "dfxml.xml")])
+        self.assertEqual(
+            row[:7],
+            [
+                "cd.iso",
+                2,
+                "ISO9660, FAT12",
+                "2023",
+                "2023-02-05",
+                "2023-02-05",
+                "2 digital files (1 MB)",
+            ],
+        )
+
+
+class TestAnalysisSpreadsheet(unittest.TestCase):
+    """Tests for analysis.csv written as disk images finish."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.reports_dir = j(self.tmpdir, "reports")
+        self.csv_path = j(self.tmpdir, "analysis.csv")
+
+    def read_items(self):
+        with open(self.csv_path, newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], diskimageanalyzer.ANALYSIS_HEADER)
+        return [row[0] for row in rows[1:]]
+
+    def make_job(self, item):
+        disk_result = j(self.reports_dir, item)
+        if not os.path.isdir(disk_result):
+            make_report(self.reports_dir, item)
+        return argparse.Namespace(
+            disk_image=argparse.Namespace(cache_entry=None),
+            disk_results_dir=disk_result,
+            volumes=[{"file_system": "FAT12"}],
+        )
+
+    def test_spreadsheet_sorted_on_close(self):
+        """Test rows are flushed as added and sorted once closed."""
+        spreadsheet = diskimageanalyzer.AnalysisSpreadsheet(self.csv_path)
+        for item in ("disk3.dd", "disk1.dd", "disk2.dd"):
+            spreadsheet.add_row([item, 1])
+
+        self.assertEqual(self.read_items(), ["disk3.dd", "disk1.dd", "disk2.dd"])
+        spreadsheet.close()
+        self.assertEqual(self.read_items(), ["disk1.dd", "disk2.dd", "disk3.dd"])
+
+    def test_spreadsheet_resumed_run(self):
+        """Test a resumed run neither duplicates nor loses rows.
+
+        disk2.dd was reported by the earlier run and its row is restored
+        from the journal, disk1.dd is reported again, and disk3.dd never
+        reached the report stage, so its row is added at the end of the run.
+        """
+        dfxml_stats = {}
+        first_run = diskimageanalyzer.AnalysisSpreadsheet(self.csv_path)
+        result = diskimageanalyzer.report_disk_image(
+            self.tmpdir, first_run, dfxml_stats, self.make_job("disk2.dd")
+        )
+        first_run.close()
+
+        spreadsheet = diskimageanalyzer.AnalysisSpreadsheet(self.csv_path)
+        diskimageanalyzer.resume_report_disk_image(
+            spreadsheet, self.make_job("disk2.dd"), result["data"]
+        )
+        diskimageanalyzer.report_disk_image(
+            self.tmpdir, spreadsheet, dfxml_stats, self.make_job("disk1.dd")
+        )
+        make_report(self.reports_dir, "disk3.dd")
+        for item in sorted(os.listdir(self.reports_dir)):
+            if item not in spreadsheet:
+                spreadsheet.add_row(
+                    diskimageanalyzer.analysis_row(
+                        j(self.reports_dir, item), [], LOGGER, dfxml_stats
+                    )
+                )
+        spreadsheet.close()
+
+        self.assertEqual(self.read_items(), ["disk1.dd", "disk2.dd", "disk3.dd"])
+
+
+if __name__ == "__main__":
+    unittest.main()
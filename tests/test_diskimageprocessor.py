@@ -0,0 +1,177 @@
+"""Unit tests for diskimageprocessor.py."""
+import argparse
+import csv
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from os.path import join as j
+from unittest import mock
+
+import diskimageprocessor
+from disk_image_toolkit.summary import DFXMLSummary
+
+TEST_FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+FIXTURES_PATH = j(TEST_FILE_DIR, "fixtures")
+DFXML_FIXTURE = j(FIXTURES_PATH, "dfxml", "fat12.xml")
+
+LOGGER = logging.getLogger(__name__)
+
+
+def make_sip(sips, item, dfxml_files=("dfxml.xml",)):
+    """Create SIP directory with copies of the FAT12 DFXML fixture."""
+    subdoc_dir = j(sips, item, "metadata", "submissionDocumentation")
+    os.makedirs(subdoc_dir)
+    for dfxml_file in dfxml_files:
+        shutil.copyfile(DFXML_FIXTURE, j(subdoc_dir, dfxml_file))
+
+
+class TestDescribeSIP(unittest.TestCase):
+    """Tests for statistics gathered for description.csv rows."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.sips = j(self.tmpdir, "SIPs")
+        self.args = argparse.Namespace(bagfiles=False, destination=self.tmpdir)
+
+    def test_describe_sip_volume_stats(self):
+        """Test statistics gathered while carving are used without DFXML."""
+        make_sip(self.sips, "disk.dd")
+        stats = DFXMLSummary()
+        stats.add_file(1024, {"mtime": "1999-03-01T10:00:00Z"})
+        volumes = [
+            {"file_system": "FAT12", "stats": stats.to_dict()},
+            {"file_system": "HFS", "stats": stats.to_dict()},
+        ]
+
+        with mock.patch.object(diskimageprocessor, "_parse_dfxml") as parse_dfxml:
+            row, described, parsed_stats, _ = diskimageprocessor._describe_sip(
+                self.args, self.sips, "disk.dd", volumes, LOGGER
+            )
+
+        parse_dfxml.assert_not_called()
+        self.assertTrue(described)
+        self.assertEqual(parsed_stats, {})
+        self.assertEqual(
+            row[4:9],
+            ["1999", "1999-03-01", "1999-03-01", "File", "2 digital files (2 KB)"],
+        )
+
+    def test_describe_sip_dfxml_fallback(self):
+        """Test disk DFXML is read once if volumes have no statistics.
+
+        Two TSK volumes outside partitions (e.g. an El Torito floppy image
+        in a bootable CD) share the disk DFXML and get no statistics.
+        """
+        make_sip(self.sips, "cd.iso")
+        volumes = [{"file_system": "ISO9660"}, {"file_system": "FAT12"}]
+
+        row, described, parsed_stats, _ = diskimageprocessor._describe_sip(
+            self.args, self.sips, "cd.iso", volumes, LOGGER
+        )
+
+        dfxml_path = j(
+            self.sips, "cd.iso", "metadata", "submissionDocumentation", "dfxml.xml"
+        )
+        self.assertTrue(described)
+        self.assertEqual(list(parsed_stats), [dfxml_path])
+        self.assertEqual(
+            row[4:9],
+            ["2023", "2023-02-05", "2023-02-05", "File", "2 digital files (1 MB)"],
+        )
+
+
+class TestCreateSpreadsheet(unittest.TestCase):
+    """Tests for description.csv written by worker processes."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.sips = j(self.tmpdir, "SIPs")
+        self.args = argparse.Namespace(bagfiles=False, destination=self.tmpdir)
+        stats = DFXMLSummary()
+        stats.add_file(1024, {"mtime": "1999-03-01T10:00:00Z"})
+        self.stats = stats.to_dict()
+
+    def read_rows(self):
+        with open(j(self.tmpdir, "description.csv"), newline="") as f:
+            return list(csv.reader(f))[1:]
+
+    def test_create_spreadsheet_sorted(self):
+        """Test rows from worker processes are written in sorted SIP order."""
+        items = ["disk3.dd", "disk1.dd", "disk2.dd"]
+        for item in items:
+            make_sip(self.sips, item)
+        volumes = {
+            item: [{"file_system": "FAT12", "stats": self.stats}] for item in items
+        }
+
+        diskimageprocessor.create_spreadsheet(
+            self.args, self.sips, volumes, LOGGER, workers=2
+        )
+
+        rows = self.read_rows()
+        self.assertEqual([row[1] for row in rows], sorted(items))
+        self.assertEqual(
+            [row[8] for row in rows], ["1 digital files (1 KB)"] * len(items)
+        )
+
+    def test_create_spreadsheet_worker_error(self):
+        """Test a SIP whose worker fails gets an error row among the others."""
+        for item in ("disk1.dd", "disk2.dd", "disk3.dd"):
+            make_sip(self.sips, item)
+        volumes = {
+            "disk1.dd": [{"file_system": "FAT12", "stats": self.stats}],
+            # a volume without a file system fails in the worker
+            "disk2.dd": [{"stats": self.stats}],
+            "disk3.dd": [{"file_system": "FAT12", "stats": self.stats}],
+        }
+
+        diskimageprocessor.create_spreadsheet(
+            self.args, self.sips, volumes, LOGGER, workers=2
+        )
+
+        rows = self.read_rows()
+        self.assertEqual([row[1] for row in rows], ["disk1.dd", "disk2.dd", "disk3.dd"])
+        self.assertEqual(
+            [row[8] for row in rows],
+            ["1 digital files (1 KB)", "Error", "1 digital files (1 KB)"],
+        )
+        self.assertEqual(rows[1][9], "Error gathering statistics from SIP directory.")
+
+    def test_create_spreadsheet_dfxml_fallback(self):
+        """Test DFXML is parsed for SIPs whose volumes have no statistics."""
+        for item in ("disk1.dd", "disk2.dd"):
+            make_sip(self.sips, item)
+        volumes = {
+            "disk1.dd": [{"file_system": "FAT12", "stats": self.stats}],
+            "disk2.dd": [{"file_system": "FAT12"}],
+        }
+        dfxml_stats = {}
+
+        with mock.patch.object(
+            diskimageprocessor,
+            "_parse_dfxml",
+            wraps=diskimageprocessor._parse_dfxml,
+        ) as parse_dfxml:
+            diskimageprocessor.create_spreadsheet(
+                self.args, self.sips, volumes, LOGGER, dfxml_stats=dfxml_stats
+            )
+
+        dfxml_path = j(
+            self.sips, "disk2.dd", "metadata", "submissionDocumentation", "dfxml.xml"
+        )
+        self.assertEqual(parse_dfxml.call_count, 1)
+        self.assertEqual(parse_dfxml.call_args[0][0], dfxml_path)
+        self.assertEqual(list(dfxml_stats), [dfxml_path])
+        self.assertEqual(
+            [row[8] for row in self.read_rows()],
+            ["1 digital files (1 KB)", "2 digital files (1 MB)"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+"""Tests that parallel runs of the front-end scripts match serial runs.
+
+The external tools are replaced by stubs that write fixed output, so the
+scripts run without BitCurator installed.
+"""
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import unittest
+from os.path import join as j
+
+TEST_FILE_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(TEST_FILE_DIR)
+
+FIXTURES_PATH = j(TEST_FILE_DIR, "fixtures")
+DISK_IMAGE_FIXTURE = j(FIXTURES_PATH, "fat12", "practical.floppy.dd")
+
+STUB_TOOLS = {
+    "disktype": 'tail -n +2 "{}"\n'.format(j(FIXTURES_PATH, "fat12", "disktype.txt")),
+    "fiwalk": 'cp "{}" "$2"\n'.format(j(FIXTURES_PATH, "dfxml", "fat12.xml")),
+    "tsk_recover": (
+        'if [ "$1" = "-i" ]; then exit 1; fi\n'
+        "for dest; do :; done\n"
+        'mkdir -p "$dest/Docs"\n'
+        'echo ARP > "$dest/ARP.EXE"\n'
+        'echo doc > "$dest/Docs/a.txt"\n'
+    ),
+    "brunnhilde.py": (
+        "for dest; do :; done\n"
+        'mkdir -p "$dest/csv_reports" "$dest/logs"\n'
+        "printf 'Format,Count\\nPlain Text,2\\n' > \"$dest/csv_reports/formats.csv\"\n"
+    ),
+}
+
+
+class TestParallelRun(unittest.TestCase):
+    """Tests for disk images processed with --jobs 2."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+        bin_dir = j(self.tmpdir, "bin")
+        os.makedirs(bin_dir)
+        for name, script in STUB_TOOLS.items():
+            path = j(bin_dir, name)
+            with open(path, "w") as f:
+                f.write("#!/bin/sh\n" + script)
+            os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        self.env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ["PATH"])
+
+        # two identical disk images and one differing in content only
+        self.source = j(self.tmpdir, "source")
+        os.makedirs(self.source)
+        for name in ("disk1.dd", "disk2.dd", "disk3.dd"):
+            shutil.copyfile(DISK_IMAGE_FIXTURE, j(self.source, name))
+        with open(j(self.source, "disk3.dd"), "r+b") as f:
+            f.seek(100)
+            f.write(b"x")
+
+    def run_script(self, script, jobs):
+        destination = j(self.tmpdir, "{}-{}".format(script, jobs))
+        subprocess.run(
+            [sys.executable, j(REPO_DIR, script), "-j", str(jobs)]
+            + [self.source, destination],
+            env=self.env,
+            cwd=self.tmpdir,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        return destination
+
+    def read_outputs(self, destination, names):
+        """Return dict of relative path to contents of files named names."""
+        outputs = {}
+        for root, _, files in os.walk(destination):
+            for file in files:
+                if file in names:
+                    path = j(root, file)
+                    with open(path) as f:
+                        outputs[os.path.relpath(path, destination)] = f.read()
+        return outputs
+
+    def test_diskimageprocessor_jobs(self):
+        """Test SIPs, checksums and description.csv match a serial run."""
+        serial = self.run_script("diskimageprocessor.py", 1)
+        parallel = self.run_script("diskimageprocessor.py", 2)
+
+        names = ("description.csv", "checksum.md5")
+        serial_outputs = self.read_outputs(serial, names)
+        self.assertEqual(len(serial_outputs), 4)
+        self.assertEqual(self.read_outputs(parallel, names), serial_outputs)
+        self.assertIn(
+            '"disk3.dd","","","2023","2023-02-05","2023-02-05","File",'
+            '"2 digital files (1 MB)"',
+            serial_outputs["description.csv"],
+        )
+        for item in ("disk1.dd", "disk2.dd", "disk3.dd"):
+            self.assertEqual(
+                sorted(os.listdir(j(parallel, "SIPs", item, "objects"))),
+                ["diskimage", "files"],
+            )
+
+    def test_diskimageanalyzer_jobs(self):
+        """Test analysis.csv matches a serial run."""
+        serial = self.run_script("diskimageanalyzer.py", 1)
+        parallel = self.run_script("diskimageanalyzer.py", 2)
+
+        serial_outputs = self.read_outputs(serial, ("analysis.csv",))
+        self.assertEqual(self.read_outputs(parallel, ("analysis.csv",)), serial_outputs)
+        rows = serial_outputs["analysis.csv"].splitlines()[1:]
+        self.assertEqual(
+            [row.split(",")[0] for row in rows],
+            ['"disk1.dd"', '"disk2.dd"', '"disk3.dd"'],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()